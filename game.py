@@ -1,8 +1,7 @@
 import pygame
 import sys
-from scripts import map, entity, explosion, enemy, coin, portal, transition, utils
-from scripts.consts import window_size
-import copy
+from scripts import map, entity, explosion, enemy, animation, portal, transition, utils, dirty, room, lighting
+from scripts.consts import window_size, MAP_PATH, DESCENT_SEED, DIRTY_RECTS, ROOMS, ROOM_TICK_EVERY, PRELOAD_REPORT
 
 pygame.init()
 
@@ -21,30 +20,30 @@ class App:
         self.screen = screen
         self.clock = pygame.time.Clock()
         if not restart:
-            self.map = map.Map()
-            self.original_map = copy.copy(self.map)
-            self.original_map.tile_map = copy.deepcopy(self.map.tile_map)
+            # the images are decoded in parallel if there are no cached frames
+            preloaded = utils.preload()
+            # every room map is loaded once and kept, the main one is active
+            self.rooms = {'main': room.Room(self, map.Map(grid=True, path=MAP_PATH, descent_seed=DESCENT_SEED))}
+            for name, path in ROOMS.items():
+                self.rooms[name] = room.Room(self, map.Map(grid=True, path=path), tick_every=ROOM_TICK_EVERY)
+            self.room = self.rooms['main']
+            self.entity_factory = entity.EntityFactory(self, self.map)
+            self.enemies_factory = enemy.EnemiesFactory(self, self.map)
         else:
-            self.map = copy.copy(self.original_map)
-            self.map.tile_map = copy.deepcopy(self.original_map.tile_map)
-        
-        if not restart:
-            self.entity_factory = entity.EntityFactory(self)
-            self.enemies_factory = enemy.EnemiesFactory(self)
-        else:
-            self.enemies_factory
+            self.room = self.rooms['main']
         
+        # npcs, enemies and coins of every room, the reset puts the camera back at the start
+        for r in self.rooms.values():
+            if restart:
+                r.reset(self.entity_factory, self.enemies_factory)
+            else:
+                r.populate(self.entity_factory, self.enemies_factory)
         # main player
-        self.main_player = self.entity_factory.make_player('wizard', (self.map.camera_x, self.map.camera_y), [0, 0])
+        self.main_player = self.entity_factory.make_player('wizard', (self.map.camera_x, self.map.camera_y), [0, 0], room=self.room)
         self.main_player.surf = screen
         self.restart_timer = 0
         self.restart_timer_set = False
-        # npc
-        self.npcs = []
-        for i, npc_name in enumerate(sorted(self.entity_factory.players.keys())):
-            for pos, tile in self.map.get_tiles('npc', i):
-                npc = self.entity_factory.make_player(npc_name, pos, (0, 0))
-                self.npcs.append(npc)
+        self.frame = 0
 
         self.must_attack_enemy = False
         if not restart:
@@ -54,30 +53,14 @@ class App:
         if not restart:
             self.horn_icon = utils.load_image('data/icons/horn_icon.png', scale=1, size=(50, 50))
         
-        # enemies
-        self.enemies = []
-        for i, enemy_name in enumerate(sorted(self.enemies_factory.enemies.keys())):
-            for pos, tile in self.map.get_tiles('entities', i):
-                demon = self.enemies_factory.make_enemy(enemy_name, pos, (0, 0))
-                self.enemies.append(demon)
-        
         # keys
         self.shift_pressed = False
         self.ctrl_pressed = False
 
         # explosions
-        self.finishing_effects = []
-        self.rigid_effects = []
         if not restart:
             self.explosion_factory = explosion.ExplosionFactory(size=(self.map.tile_size, ) *  2)
 
-        # rigid bodies with effects
-        self.rigidbodies = []
-        self._init_coins()
-
-        # portals
-        self.portals = []
-
         # transitions
         self.transitions = {
             'expand': transition.IrisTransition(period=60, expand=True),
@@ -88,58 +71,90 @@ class App:
         # darkness
         self.start_level = self.map.camera_y
         self.dark_step = 50 
-        self.dark_surf = pygame.Surface(window_size, pygame.SRCALPHA)
         self.light_on = False
 
-    def _init_coins(self):
-        coinClass = [coin.EnergyCoin, coin.HealthCoin]
-        for variant, cclass in enumerate(coinClass):
-            for pos, tile in self.map.get_tiles('coins', variant=variant, absolute=True, keep=False):
-                c = cclass(pos, 10)
-                self.rigidbodies.append(c)
-            for pos, tile in self.map.get_offgrid_tiles('coins', variant=variant, keep=False):
-                c = cclass((pos[0] * self.map.k, pos[1] * self.map.k), 10)
-                self.rigidbodies.append(c) 
+        # presented screen areas
+        self.dirty = dirty.DirtyRects(window_size, enabled=DIRTY_RECTS)
+        if not restart:
+            if preloaded and PRELOAD_REPORT:
+                print(preloaded.report())
+            # the next launch makes its frames from the cache
+            utils.save_frame_cache()
+
+    # the active room
+    @property
+    def map(self):
+        return self.room.map
+
+    @property
+    def npcs(self):
+        return self.room.npcs
+
+    @property
+    def enemies(self):
+        return self.room.enemies
+
+    @property
+    def rigidbodies(self):
+        return self.room.rigidbodies
+
+    @property
+    def finishing_effects(self):
+        return self.room.finishing_effects
+
+    @property
+    def rigid_effects(self):
+        return self.room.rigid_effects
+
+    @property
+    def portals(self):
+        return self.room.portals
+
+    def enter_room(self, name, pos=None):
+        '''
+        Moves the main player to another loaded room, nothing is reloaded
+        @ pos - player position in the room, the start of its map by default
+        '''
+        self.room = self.rooms[name]
+        self.main_player.bind(self.room)
+        if pos is None:
+            pos = self.map.start_camera
+        self.main_player.pos = list(pos)
+        self.main_player.vel = [0, 0]
+        self.map.camera_x = pos[0] - window_size[0] // 2
+        self.map.camera_y = pos[1] - window_size[1] // 2
+        self.start_level = self.map.start_camera[1]
+        self.dirty.full()
+
+    def close(self):
+        '''
+        Drops the rooms and gives the frames of the factories back to the asset registry
+        '''
+        for r in self.rooms.values():
+            r.close()
+        self.entity_factory.release()
+        self.enemies_factory.release()
+        self.explosion_factory.release()
 
     def attack(self, rect, damage, attack_main_player=True, attack_enemies=True, attack_npc=True, delay=60, intensity=80):
-        def fattack_main_player(rect, damage):
-            if self.main_player.get_rect().colliderect(rect):
-                self.main_player.hurt(damage, delay=delay, intensity=intensity)
-                return True
-            return False
-        def fattack_enemies(rect, damage):
-            for enemy in self.enemies:
-                if not enemy.died and enemy.get_rect().colliderect(rect):
-                    enemy.hurt(damage)
-                    return True
-            return False
-        def fattack_npc(rect, damage):
-            for npc in self.npcs:
-                if not npc.died and npc.get_rect().colliderect(rect):
-                    npc.hurt(damage)
-                    return True
-            return False
-    
-        collision = False
-        if attack_main_player:
-            collision = fattack_main_player(rect, damage) or collision
-        if attack_enemies:
-            collision = fattack_enemies(rect, damage) or collision
-        if attack_npc:
-            collision = fattack_npc(rect, damage) or collision
-        return collision
+        return self.room.attack(rect, damage, attack_main_player, attack_enemies, attack_npc, delay, intensity)
             
         
     def make_dark(self):
         delta_level = max(0, self.map.camera_y - self.start_level) / self.dark_step#/ self.map.tile_size
         transparency = min(255, delta_level)
-        self.dark_surf.fill((0, 0, 0, transparency))
+        if transparency == 0: return
+        camera = (self.map.camera_x, self.map.camera_y)
+        static, dynamic = self.room.light_sources()
+        if self.room.lights.set_static(static):
+            self.dirty.full()
         if self.light_on:
-            center = self.main_player.get_rect().center
-            light_radius = int(transparency)
-            for r in range(light_radius, 0, -1):
-                pygame.draw.circle(self.dark_surf, (0, 0, 0, r), (center[0] - self.map.camera_x, center[1] - self.map.camera_y), r)
-        screen.blit(self.dark_surf, (0, 0))
+            light_ball = self.main_player.light_ball
+            dynamic.append((*self.main_player.get_rect().center, lighting.PLAYER_LEVEL))
+            dynamic.append((light_ball.x, light_ball.y, lighting.FIRE_LEVEL))
+        for x, y, level in dynamic:
+            self.dirty.add_world(pygame.Rect(x, y, 0, 0), camera, (level + 1) * self.map.tile_size)
+        self.room.lights.render(screen, camera, transparency, dynamic)
 
 
     def run(self):
@@ -148,39 +163,47 @@ class App:
         while running:
 
             self.clock.tick(60)
+            self.frame += 1
+
+            # the other rooms live on at a lower rate
+            for r in self.rooms.values():
+                if r is not self.room and r.tick_every and self.frame % r.tick_every == 0:
+                    r.tick()
+                # enemies and coins of the streamed regions
+                r.spawn_streamed(self.entity_factory, self.enemies_factory)
 
             self.map.camera_x += (self.main_player.pos[0] - window_size[0] // 2 - self.map.camera_x) // 30
             self.map.camera_y += (self.main_player.pos[1] - window_size[1] // 2 - self.map.camera_y) // 30
             self.map.update()
+            self.room.update()
             self.map.render(screen)
+            camera = (self.map.camera_x, self.map.camera_y)
 
             # npc
             for npc in self.npcs:
-                npc.ai()
-                npc.update()
-                if npc.died and npc.dieing > npc.died_time:
-                    self.npcs.remove(npc)
                 rect = npc.get_rect() 
                 if not (
                     rect.right - self.map.camera_x < 0
                     or rect.left - self.map.camera_x > window_size[0]
                     or rect.bottom - self.map.camera_y < 0
                     or rect.top - self.map.camera_y > window_size[1]
-                ): npc.render(screen)
+                ):
+                    npc.render(screen)
+                    self.dirty.add_world(npc.get_render_rect(), camera, 1)
+                    self.dirty.add(npc.health_rect)
 
             # enemies
             for enemy in self.enemies:
-                enemy.ai()
-                # enemy.update()
                 rect = enemy.get_rect() 
-                if enemy.died and enemy.dieing > enemy.died_time:
-                    self.enemies.remove(enemy)
                 if not (
                     rect.right - self.map.camera_x < 0
                     or rect.left - self.map.camera_x > window_size[0]
                     or rect.bottom - self.map.camera_y < 0
                     or rect.top - self.map.camera_y > window_size[1]
-                ): enemy.render(screen)
+                ):
+                    enemy.render(screen)
+                    self.dirty.add_world(enemy.get_render_rect(), camera, 1)
+                    self.dirty.add(enemy.health_rect)
 
             if self.light_on:
                 self.make_dark()
@@ -189,6 +212,11 @@ class App:
             # main player
             self.main_player.update()
             self.main_player.render(screen)         
+            self.dirty.add_world(self.main_player.get_render_rect(), camera, 1)
+            if self.light_on:
+                # the light ball with its particles, its light is added by make_dark
+                light_ball = self.main_player.light_ball
+                self.dirty.add_world(self.main_player.get_rect(), camera, light_ball.R + light_ball.ballr + 64)
 
 
 
@@ -196,11 +224,13 @@ class App:
                 self.make_dark()
 
             self.main_player.render_bars(screen)
+            self.dirty.add(self.main_player.health_rect)
+            self.dirty.add(self.main_player.energy_rect)
 
             # portals
             for port in self.portals:
-                port.update()
                 port.render(screen, (self.map.camera_x, self.map.camera_y))
+                self.dirty.add_world(pygame.Rect(port.center, (0, 0)), camera, port.r_max + 10)
             
 
             if self.main_player.died:
@@ -227,36 +257,17 @@ class App:
                 ): continue
                 rb.update(self)
                 rb.render(screen, (self.map.camera_x, self.map.camera_y))
+                self.dirty.add_world(rb.get_rect(), camera, 64) # particles live up to 60 frames
 
             # explosions
             for explosion in self.finishing_effects:
-                explosion.update()
                 explosion.render(screen, (self.map.camera_x, self.map.camera_y))
-                collision = False
-                if explosion.damage != 0:
-                    collision = self.attack(explosion.get_rect(), explosion.damage, attack_main_player=True, attack_enemies=False)
-                if collision:
-                    explosion.damage = 0
-                if explosion.disable:
-                    self.finishing_effects.remove(explosion)
-                    if explosion.finish_explosion:
-                        expl = explosion.finish_explosion(explosion, self.map)
-                        if expl:
-                            self.finishing_effects.append(expl)
-
+                self.dirty.add_world(explosion.get_rect(), camera, 1)
 
             ## rigid
             for effect in self.rigid_effects:
-                effect.update()
                 effect.render(screen, (self.map.camera_x, self.map.camera_y))
-                collision = False
-                if effect.damage != 0:
-                    collision = self.attack(effect.get_rect(), effect.damage, attack_main_player=True, attack_enemies=True)
-                if self.map.get_solid_intersections(effect.get_rect()) or collision:
-                    self.rigid_effects.remove(effect)
-                    if effect.finish_explosion:
-                        expl = effect.finish_explosion(effect, self.map)
-                        self.finishing_effects.append(expl)
+                self.dirty.add_world(effect.get_rect(), camera, 1)
 
 
             for event in pygame.event.get():
@@ -286,7 +297,7 @@ class App:
                         if self.main_player.attack_energy == self.main_player.max_attack_energy:
                             center = self.main_player.get_rect().center
                             port = portal.Portal(center, 40)
-                            self.portals = [port]
+                            self.room.portals = [port]
                             self.main_player.attack_energy = 0
                     elif event.key == pygame.K_z and not self.main_player.died:
                         if self.portals and self.main_player.attack_energy > self.main_player.max_attack_energy // 3:
@@ -325,19 +336,24 @@ class App:
                         self.ctrl_pressed = False
 
             if self.come_here:
-                screen.blit(self.horn_icon, (window_size[0] - self.horn_icon.get_width() - 10, 5))
+                self.dirty.add(screen.blit(self.horn_icon, (window_size[0] - self.horn_icon.get_width() - 10, 5)))
             elif self.must_attack_enemy:
-                screen.blit(self.attack_enemy_icon, (window_size[0] - self.attack_enemy_icon.get_width() - 10, 5))
+                self.dirty.add(screen.blit(self.attack_enemy_icon, (window_size[0] - self.attack_enemy_icon.get_width() - 10, 5)))
 
             # transitions
             if self.current_transition:
                 self.current_transition.update()
                 self.current_transition.render(screen)
+                self.dirty.full()
                 if self.current_transition.finished:
                     self.current_transition = None
 
-            pygame.display.flip()
+            self.dirty.present(camera)
 
+        # the frames loaded during the game are kept for the next launch
+        animation.finish_loading()
+        utils.save_frame_cache(manifest=False)
+        self.close()
         pygame.quit()
         sys.exit()
 
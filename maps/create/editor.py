@@ -5,6 +5,7 @@ import json
 from collections import deque
 import copy
 from scripts import utils
+from scripts.spatial import SpatialHash
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
@@ -22,6 +23,7 @@ if __name__ == "__main__":
     SCREEN_HEIGHT = 600
 
     MAX_FILLED_SECTOR = 500
+    OFFGRID_CELL_SIZE = 4 # spatial hash cell side for the off-grid tiles in base tiles
 
 # 16 x 16 is the base
 class Editor:
@@ -45,7 +47,7 @@ class Editor:
         self.change_tiles_size = 16 # how much size of the tiles will be changed if zoom
         self.k = self.tile_size / self.base_tile_size
         self.tile_map = {}
-        self.nogrid_tiles = []
+        self.nogrid_tiles = SpatialHash(OFFGRID_CELL_SIZE * self.base_tile_size)
         self._load_resources()
         self.resource_names = list(self.resources.keys())
         self.current_resource = self.resource_names[0]
@@ -106,6 +108,10 @@ class Editor:
         dirpath = os.path.join(RESOURCES_DIR)
         for dirname in os.listdir(dirpath):
             self.resources[dirname] = utils.load_images(os.path.join(dirpath, dirname), self.tile_size / self.base_tile_size, (0, 0, 0))
+        # the biggest image in the units of the off-grid positions (_del_nogrid_tile measures it in pixels)
+        size = max(max(img.get_size()) for imgs in self.resources.values() for img in imgs)
+        size = max(size, size / self.k)
+        self.offgrid_margin = (size, size)
 
     def _load_resources(self):
         self.resources = {}
@@ -218,7 +224,7 @@ class Editor:
                     tile = self.tile_map[(i, j)]
                     img = self.resources[tile['resource']][tile['variant']]
                     screen.blit(img, (i * self.tile_size - self.camera[0], j * self.tile_size - self.camera[1]))
-        for tile in self.nogrid_tiles:
+        for tile in self._get_offgrid_tiles_in_area(pygame.Rect(self.camera[0], self.camera[1], SCREEN_WIDTH, SCREEN_HEIGHT)):
             if self.moving_selected_area and tile in self.moving_offgrid_tiles: continue
             img = self.resources[tile['resource']][tile['variant']]
             if tile['pos'][0] * self.k - self.camera[0] + img.get_width() < 0 or tile['pos'][0] * self.k - self.camera[0] > SCREEN_WIDTH:
@@ -305,8 +311,9 @@ class Editor:
 
     def _add_nogrid_tile(self, pos):
         pos = ((pos[0] + self.camera[0]) / self.k, (pos[1] + self.camera[1]) / self.k)
-        self.nogrid_tiles.append({'resource': self.current_resource, 'variant': self.current_variant, 'pos': pos})
-        self._add_history('add', pos, self.nogrid_tiles[-1], 'nogrid')
+        tile = {'resource': self.current_resource, 'variant': self.current_variant, 'pos': pos}
+        self.nogrid_tiles.append(tile)
+        self._add_history('add', pos, tile, 'nogrid')
 
     def _del_grid_tile(self, pos):
         i = int((pos[0] + self.camera[0]) // self.tile_size)
@@ -319,7 +326,7 @@ class Editor:
 
     def _del_nogrid_tile(self, pos):
         pos = ((pos[0] + self.camera[0]) / self.k, (pos[1] + self.camera[1]) / self.k)
-        for tile in self.nogrid_tiles:
+        for tile in self.nogrid_tiles.query((*pos, 0, 0), self.offgrid_margin):
             img = self.resources[tile['resource']][tile['variant']]
             if img.get_rect(topleft=tile['pos']).collidepoint(pos):
                 self.nogrid_tiles.remove(tile)
@@ -380,15 +387,16 @@ class Editor:
         if self.moving_offgrid_tiles:
             info['offgrid'] = self.moving_offgrid_tiles
             for tile in self.moving_offgrid_tiles:
-                tile['pos'] = (
+                self.nogrid_tiles.move(tile, (
                     (tile['pos'][0] * self.k + shiftx) / self.k,
                     (tile['pos'][1] * self.k + shifty) / self.k
-                )
+                ))
         self._add_history('move_selected_area', (shiftx, shifty), info, None)
 
     def _get_offgrid_tiles_in_area(self, rect):
         tiles = []
-        for tile in self.nogrid_tiles:
+        area = (rect.x / self.k, rect.y / self.k, rect.width / self.k, rect.height / self.k)
+        for tile in self.nogrid_tiles.query(area, self.offgrid_margin):
             tile_rect = self.resources[tile['resource']][tile['variant']].get_rect()
             tile_rect.x = tile['pos'][0] * self.k
             tile_rect.y = tile['pos'][1] * self.k
@@ -454,7 +462,7 @@ class Editor:
             json.dump(
                 {
                     'tile_map': {str((int(k[0]), int(k[1]))): v for k, v in self.tile_map.items()},
-                    'nogrid_tiles': self.nogrid_tiles,
+                    'nogrid_tiles': list(self.nogrid_tiles),
                     'base_tile_size': self.base_tile_size,
                     'tile_size': self.tile_size,
                     'camera_x': self.camera[0],
@@ -469,7 +477,7 @@ class Editor:
             with open(path, 'r') as f:
                 data = json.load(f)
                 self.tile_map = {tuple(map(int, [x.replace('(', '').replace(')', '') for x in k.split(',')])): v for k, v in data['tile_map'].items()}
-                self.nogrid_tiles = data['nogrid_tiles']
+                self.nogrid_tiles = SpatialHash(OFFGRID_CELL_SIZE * self.base_tile_size, data['nogrid_tiles'])
                 self.tile_size = data['tile_size']
                 self.camera = [data['camera_x'], data['camera_y']]
                 self.k = self.tile_size / self.base_tile_size
@@ -525,10 +533,10 @@ if __name__ == "__main__":
                     editor.tile_map[pos] = tile
                 
                 for tile in offgrid_tiles:
-                    tile['pos'] = (
+                    editor.nogrid_tiles.move(tile, (
                         (tile['pos'][0] * editor.k - shiftx) / editor.k,
                         (tile['pos'][1] * editor.k - shifty) / editor.k
-                    )
+                    ))
 
             elif action['action'] == 'remove_selected_area':
                 tiles_in_area = action['tile']['grid']
@@ -582,10 +590,10 @@ if __name__ == "__main__":
                     editor.tile_map[(x, y)] = tile
 
                 for tile in offgrid_tiles:
-                    tile['pos'] = (
+                    editor.nogrid_tiles.move(tile, (
                         (tile['pos'][0]*editor.k + shiftx) / editor.k,
                         (tile['pos'][1]*editor.k + shifty) / editor.k
-                    )
+                    ))
 
             elif action['action'] == 'remove_selected_area':
                 tiles_in_area = action['tile']['grid']
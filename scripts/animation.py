@@ -1,11 +1,144 @@
 import pygame
-from scripts import utils
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from scripts import utils, assets, consts
+from scripts.framecache import to_pixels
 import os 
 
+_loader = None
+_flipped = None
+
+
+def loader():
+    '''
+    @ return the thread which loads the frames in the background, one thread so it does not take the cores from the game
+    '''
+    global _loader
+    if _loader is None:
+        _loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='frames')
+    return _loader
+
+
+def finish_loading():
+    '''
+    Waits for the frames being loaded in the background, the frame cache can be saved then
+    '''
+    global _loader
+    if _loader is not None:
+        _loader.shutdown(wait=True)
+        _loader = None
+
+
+def flipped_cache():
+    '''
+    @ return the FlippedFrames of all animations, their budget is consts.FLIPPED_FRAMES_BUDGET
+    '''
+    global _flipped
+    if _flipped is None:
+        _flipped = FlippedFrames(consts.FLIPPED_FRAMES_BUDGET)
+    return _flipped
+
+
+def _size(frames):
+    return sum(frame.get_width() * frame.get_height() * frame.get_bytesize() for frame in frames)
+
+
+class FlippedFrames:
+    '''
+    Flipped frames of all animations, they are made the first time they are drawn and kept while they fit
+    the budget, the least recently drawn ones are dropped first. A dropped one is flipped again when it is drawn.
+    The flipped frames are kept here only, so the budget is all the memory they take
+    '''
+    def __init__(self, budget):
+        '''
+        @ budget - bytes of the pixels kept, None - no limit
+        '''
+        self.budget = budget
+        self.entries = OrderedDict() # flipped source -> [surface,], the last one is the latest drawn
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, make):
+        '''
+        @ make - function () -> [surface,] called on a miss
+        '''
+        frames = self.entries.get(key)
+        if frames is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return frames
+        self.misses += 1
+        frames = self.entries[key] = make()
+        self.size += _size(frames)
+        # the drawn ones stay even if they are bigger than the budget
+        while self.budget is not None and self.size > self.budget and len(self.entries) > 1:
+            _, dropped = self.entries.popitem(last=False)
+            self.size -= _size(dropped)
+            self.evictions += 1
+        return frames
+
+    def stats(self):
+        '''
+        @ return hits, misses, evictions, bytes kept
+        '''
+        return self.hits, self.misses, self.evictions, self.size
+
+
+class Frames:
+    '''
+    Frames of an animation, they are taken from the asset registry (see scripts/assets.py) on first use.
+    The copies of the animation share this object, so the frames are loaded once for all of them
+    '''
+    def __init__(self, kind, paths, params, make, colorkey=None):
+        '''
+        @ kind, paths, params - what the frames are made of, the key of the shared frames
+        @ make - function () -> [surface,]
+        '''
+        self.source = (kind, paths, params)
+        self.flipped_source = (f'flipped {kind}', tuple(paths), (*params, colorkey)) # the key of the flipped frames
+        self.make = make
+        self.colorkey = colorkey
+        self.frames = None
+        self.pending = None # future of the frames made in the background
+
+    def ready(self):
+        '''
+        @ return True if the frames can be taken without waiting for them to load
+        '''
+        return self.frames is not None or self.pending is not None and self.pending.done()
+
+    def prefetch(self):
+        '''
+        Makes the frames in the background, load takes them from there
+        '''
+        if self.frames is None and self.pending is None:
+            # pixels, the surfaces are made on the main thread
+            self.pending = loader().submit(lambda: [to_pixels(frame) for frame in self.make()])
+
+    def load(self):
+        if self.frames is None:
+            made = self.pending.result() if self.pending else None
+            self.pending = None
+            # the registry, the atlas and the screen format are only touched here, on the main thread
+            self.frames = assets.acquire(*self.source, (lambda: utils.build_frames(made)) if made else self.make)
+        return self.frames
+
+    def load_flipped(self):
+        return flipped_cache().get(self.flipped_source, lambda: utils.flip_frames(self.load(), self.colorkey))
+
+    def release(self):
+        if self.frames is not None:
+            assets.release(*self.source)
+        self.frames = self.pending = None
+
+
 class BaseAnimation:
     def __init__(self, frames, frame_duration, repeat=True):
-        self.frames = frames
-        self.flipped_frames = None
+        self._frames = frames
+        self._flipped_frames = None
+        self.store = None # Frames loaded on first use, the copies of the animation share it
         self.frame_duration = frame_duration
         self.repeat = repeat
 
@@ -13,14 +146,57 @@ class BaseAnimation:
         self.frame_timer = 0
         self.finished = False
 
+    def acquire(self, kind, paths, params, make, colorkey=None, lazy=True):
+        '''
+        The frames are taken from the asset registry, they are shared by all animations of the same source
+        @ lazy - they are loaded on first use, else now
+        '''
+        self.store = Frames(kind, paths, params, make, colorkey)
+        if not lazy:
+            self.store.load()
+
+    @property
+    def frames(self):
+        if self._frames is None and self.store:
+            return self.store.load()
+        return self._frames
+
+    @frames.setter
+    def frames(self, frames):
+        self._frames = frames
+
+    @property
+    def flipped_frames(self):
+        if self._flipped_frames is None and self.store:
+            return self.store.load_flipped()
+        return self._flipped_frames
+
+    @property
+    def _max_width(self):
+        return max([x.get_width() for x in self.frames])
+
+    @property
+    def _max_height(self):
+        return max([x.get_height() for x in self.frames])
+
+    def ready(self):
+        return self.store is None or self._frames is not None or self.store.ready()
+
+    def prefetch(self):
+        if self.store and self._frames is None:
+            self.store.prefetch()
+
     def make_flipped(self, colorkey=None):
-        self.flipped_frames = []
-        for frame in self.frames:
-            frame = pygame.transform.flip(frame, True, False)
-            if colorkey:
-                frame.set_colorkey(colorkey)
-            self.flipped_frames.append(frame)
-        
+        self._flipped_frames = utils.flip_frames(self.frames, colorkey)
+
+    def release(self):
+        '''
+        Gives the shared frames back to the registry. The copies of the animation share the frames too,
+        only the animation which acquired them releases them
+        '''
+        if self.store:
+            self.store.release()
+
 
     def update(self):
         self.finished = False
@@ -40,45 +216,32 @@ class BaseAnimation:
         self.frame_timer = 0
 
     def render(self, surf, pos, flip=False):
-        image = self.frames[self.current_frame]
-        if flip:
-            image = self.flipped_frames[self.current_frame]
+        # the flipped frames are made on the first flipped render
+        image = self.flipped_frames[self.current_frame] if flip else self.frames[self.current_frame]
         surf.blit(image, pos)
 
 
 class Animation(BaseAnimation):
-    def __init__(self, base_dir, anim_name, num_of_frames, frame_duration, scale=1, colorkey=None, repeat=True):
+    def __init__(self, base_dir, anim_name, num_of_frames, frame_duration, scale=1, colorkey=None, repeat=True, lazy=True):
         super().__init__(None, frame_duration, repeat)
         self.anim_name = anim_name
-        self.path = os.path.join(base_dir, anim_name)
+        self.path = path = os.path.join(base_dir, anim_name)
         self.num_of_frames = num_of_frames
-        self.frames = utils.crop_images(
-            utils.load_image(self.path, scale),
-            num_of_frames,
-            colorkey=colorkey
-        )
-        self._max_width = max([x.get_width() for x in self.frames])
-        self._max_height = max([x.get_height() for x in self.frames])
-        if colorkey:
-            for x in self.frames: x.set_colorkey(colorkey)
-        self.make_flipped(colorkey=colorkey)
+        def make():
+            frames = utils.load_sheet(path, scale, num_of_frames, colorkey=colorkey)
+            if colorkey:
+                for x in frames: x.set_colorkey(colorkey)
+            return frames
+        self.acquire('sheet', [path], (scale, num_of_frames, colorkey, True), make, colorkey, lazy)
 
         
 class ListOfFilesAnimation(BaseAnimation):
-    def __init__(self, dirpath, frame_duration, scale=1, repeat=False, colorkey=None, size=None, bounding=False):
+    def __init__(self, dirpath, frame_duration, scale=1, repeat=False, colorkey=None, size=None, bounding=False, lazy=True):
         super().__init__(None, frame_duration, repeat)
-        self.frames = utils.load_images(dirpath, scale, colorkey, size=size, bounding=bounding)
-        self.make_flipped(colorkey=colorkey)
-        self._max_width = max([x.get_width() for x in self.frames])
-        self._max_height = max([x.get_height() for x in self.frames])
+        self.acquire('images', utils.image_paths(dirpath), (scale, colorkey, size, bounding), lambda: utils.load_images(dirpath, scale, colorkey, size=size, bounding=bounding), colorkey, lazy)
         
     
 class JoinFilesAnimation(BaseAnimation):
-    def __init__(self, dirpath, pattern, frame_duration, scale=1, colorkey=None, size=None, repeat=True):
+    def __init__(self, dirpath, pattern, frame_duration, scale=1, colorkey=None, size=None, repeat=True, lazy=True):
         super().__init__(None, frame_duration, repeat)
-        self.frames = utils.join_images(dirpath, pattern, scale, size, colorkey)
-        self.make_flipped(colorkey=colorkey)
-        self._max_width = max([x.get_width() for x in self.frames])
-        self._max_height = max([x.get_height() for x in self.frames])
-
-
+        self.acquire('join', utils.joined_paths(dirpath, pattern), (scale, size, colorkey), lambda: utils.join_images(dirpath, pattern, scale, size, colorkey), colorkey, lazy)
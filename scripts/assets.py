@@ -0,0 +1,56 @@
+'''
+Process-wide registry of loaded surfaces and frame lists.
+
+An asset is loaded once per its load parameters and shared by everything which asks for it with
+the same parameters: the animations of the entity prototypes, the explosion factories of every
+entity, the maps of all rooms. The assets are reference counted, an asset is dropped when its last
+owner releases it, then it is loaded again (from the frame cache, see scripts/framecache.py) if it
+is asked for once more. The shared frames must not be drawn on.
+'''
+
+
+def _key(kind, paths, params):
+    return (kind, tuple(paths), tuple(params))
+
+
+class AssetRegistry:
+    def __init__(self):
+        self.entries = {} # key -> [asset, references]
+        self.loads = 0
+
+    def acquire(self, kind, paths, params, make):
+        '''
+        @ kind, paths, params - what the asset is made of, the key of the asset
+        @ make - function () -> asset, called if the asset is not loaded
+        @ return the asset, the caller owns a reference to it
+        '''
+        key = _key(kind, paths, params)
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = [make(), 0]
+            self.loads += 1
+        entry[1] += 1
+        return entry[0]
+
+    def release(self, kind, paths, params):
+        '''
+        Drops a reference, the asset is forgotten with the last one
+        '''
+        key = _key(kind, paths, params)
+        entry = self.entries.get(key)
+        if entry is None: return
+        entry[1] -= 1
+        if entry[1] <= 0:
+            del self.entries[key]
+
+    def references(self, kind, paths, params):
+        entry = self.entries.get(_key(kind, paths, params))
+        return entry[1] if entry else 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+registry = AssetRegistry()
+acquire = registry.acquire
+release = registry.release
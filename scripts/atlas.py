@@ -0,0 +1,142 @@
+'''
+Texture atlas of the sprite frames and the tile images.
+
+The frames made by scripts/utils.py are packed in a few big surfaces (pages) instead of a surface per frame,
+every frame is a subsurface of its page: a view with its own size and colorkey and no pixels of its own.
+The frames read from the frame cache are copied right into the pages (see FrameCache), so a launch makes
+a pixel buffer per page instead of per frame.
+
+The pages are filled with shelves (rows of frames of about the same height), the frames with per-pixel alpha
+and the ones with a colorkey are in pages of their own format. The pages are written on the main thread only,
+the frames loaded in the background are packed when the main thread takes them. The atlas keeps only
+the pages being filled, a full page lives as long as its frames (a subsurface keeps its page), the space
+of the dropped frames of a live page is not reused. The frames bigger than a page are kept as they are.
+'''
+import threading
+import pygame
+from scripts.framecache import from_pixels
+
+OPEN_PAGES = 2 # pages of a format being filled, the older ones are about full
+
+
+class Page:
+    def __init__(self, size, alpha):
+        # in the format of the converted frames (see framecache.from_pixels), made transparent
+        if alpha:
+            self.surface = pygame.Surface(size, pygame.SRCALPHA, 32)
+        else:
+            self.surface = pygame.Surface(size, 0, pygame.display.get_surface())
+        self.alpha = alpha
+        self.shelves = [] # [y, height, free x]
+        self.bottom = 0 # top of the next shelf
+
+    def place(self, width, height):
+        '''
+        Puts the area on the lowest shelf it fits in, on a new shelf if there is none
+        @ return topleft of a free area of the size or None if the page is full
+        '''
+        page_width, page_height = self.surface.get_size()
+        best = None
+        for shelf in self.shelves:
+            y, shelf_height, x = shelf
+            if height <= shelf_height and x + width <= page_width and (best is None or shelf_height < best[1]):
+                best = shelf
+        # a frame much lower than the shelf takes a new one while there is room
+        if best is None or best[1] > 2 * height and self.bottom + height <= page_height:
+            if self.bottom + height > page_height: return None
+            best = [self.bottom, height, 0]
+            self.shelves.append(best)
+            self.bottom += height
+        pos = (best[2], best[0])
+        best[2] += width
+        return pos
+
+
+class Atlas:
+    def __init__(self, page_size=(512, 512)):
+        self.page_size = tuple(page_size)
+        self.pages = {False: [], True: []} # per-pixel alpha -> pages being filled
+        self.made = 0 # pages
+        self.packed = 0 # frames put in the pages
+        self.single = 0 # frames too big for a page
+
+    def fits(self, width, height):
+        return 0 < width <= self.page_size[0] and 0 < height <= self.page_size[1]
+
+    def _area(self, width, height, alpha):
+        '''
+        @ return page, topleft of a free area of the size
+        '''
+        pages = self.pages[alpha]
+        for page in pages:
+            pos = page.place(width, height)
+            if pos is not None:
+                return page, pos
+        page = Page(self.page_size, alpha)
+        pages.append(page)
+        self.made += 1
+        if len(pages) > OPEN_PAGES:
+            pages.pop(0)
+        return page, page.place(width, height)
+
+    def writable(self):
+        '''
+        @ return True if the pages can be written: on the main thread only, the pages are locked by the blits
+        of their frames and a blit to a locked page fails
+        '''
+        return threading.current_thread() is threading.main_thread()
+
+    def _put(self, source, alpha, colorkey):
+        '''
+        Copies the surface in a page
+        @ return the subsurface of the copy
+        '''
+        size = source.get_size()
+        page, pos = self._area(*size, alpha)
+        # a new page is transparent, the alpha pixels are copied as they are
+        page.surface.blit(source, pos)
+        frame = page.surface.subsurface((pos, size))
+        if colorkey:
+            frame.set_colorkey(colorkey)
+        self.packed += 1
+        return frame
+
+    def pack(self, frames):
+        '''
+        Copies the frames in the pages
+        @ return [surface,] the subsurfaces in the order of the frames, the frames too big for a page
+        and the ones in the pages already are kept
+        '''
+        result = list(frames)
+        # the high ones first, the shelves waste less
+        for n in sorted(range(len(result)), key=lambda n: -result[n].get_height()):
+            frame = result[n]
+            if frame.get_parent() is not None: continue
+            if not self.fits(*frame.get_size()):
+                self.single += 1
+                continue
+            colorkey = frame.get_colorkey()
+            # the pixels of the colorkey are copied too
+            frame.set_colorkey(None)
+            result[n] = self._put(frame, bool(frame.get_flags() & pygame.SRCALPHA), colorkey)
+            frame.set_colorkey(colorkey)
+        return result
+
+    def from_pixels(self, width, height, fmt, colorkey, pixels):
+        '''
+        @ return subsurface with the raw pixels (see framecache.to_pixels)
+        '''
+        if not self.fits(width, height):
+            self.single += 1
+            return from_pixels(width, height, fmt, colorkey, pixels)
+        source = pygame.image.frombuffer(pixels, (width, height), fmt)
+        if fmt == 'RGBA':
+            # the blits of converted alpha surfaces are much faster
+            source = source.convert_alpha()
+        return self._put(source, fmt == 'RGBA', colorkey)
+
+    def stats(self):
+        '''
+        @ return pages made, frames in the pages, frames too big for a page, bytes of the pages
+        '''
+        return self.made, self.packed, self.single, self.made * self.page_size[0] * self.page_size[1] * 4
@@ -0,0 +1,94 @@
+import pygame
+from collections import OrderedDict
+
+
+def merge_solid(solid):
+    '''
+    Greedy merge of the solid cells into rectangles: a run along x is taken first and then
+    it is extended along y while the whole run is solid.
+    @ solid - boolean grid, solid[x, y]
+    @ return rects, owner - rects [(x, y, w, h),] in cells, owner[x][y] is the index of the rect
+    of the cell or -1
+    '''
+    grid = solid.tolist()
+    width = len(grid)
+    height = len(grid[0]) if width else 0
+    owner = [[-1] * height for _ in range(width)]
+    rects = []
+    for y in range(height):
+        for x in range(width):
+            if not grid[x][y] or owner[x][y] != -1: continue
+            w = 1
+            while x + w < width and grid[x + w][y] and owner[x + w][y] == -1:
+                w += 1
+            h = 1
+            while y + h < height and all(grid[x + k][y + h] and owner[x + k][y + h] == -1 for k in range(w)):
+                h += 1
+            for k in range(w):
+                owner[x + k][y:y + h] = [len(rects)] * h
+            rects.append((x, y, w, h))
+    return rects, owner
+
+
+class SolidColliders:
+    '''
+    Solid tiles merged into bigger rectangles, built lazily per region and rebuilt after the region changes.
+    Rectangles never cross region borders.
+    '''
+    REGION_SIZE = 16 # region side in tiles
+    MAX_REGIONS = 256 # merged regions kept in memory
+
+    def __init__(self, solid_window, tile_size):
+        '''
+        @ solid_window - function (i_start, j_start, i_end, j_end) -> boolean grid of the cells
+        '''
+        self.solid_window = solid_window
+        self.tile_size = tile_size
+        self.regions = OrderedDict() # (rx, ry) -> ([pygame.Rect,], owner)
+
+    def _region(self, rx, ry):
+        key = (rx, ry)
+        if key in self.regions:
+            self.regions.move_to_end(key)
+            return self.regions[key]
+        size = self.REGION_SIZE
+        rects, owner = merge_solid(self.solid_window(rx * size, ry * size, rx * size + size - 1, ry * size + size - 1))
+        ts = self.tile_size
+        rects = [pygame.Rect((rx * size + x) * ts, (ry * size + y) * ts, w * ts, h * ts) for x, y, w, h in rects]
+        self.regions[key] = (rects, owner)
+        if len(self.regions) > self.MAX_REGIONS:
+            self.regions.popitem(last=False)
+        return rects, owner
+
+    def invalidate(self, i_start, j_start, i_end, j_end):
+        '''
+        Drops the merged regions of the cells [i_start, i_end] x [j_start, j_end]
+        '''
+        size = self.REGION_SIZE
+        for rx in range(i_start // size, i_end // size + 1):
+            for ry in range(j_start // size, j_end // size + 1):
+                self.regions.pop((rx, ry), None)
+
+    def clear(self):
+        self.regions = OrderedDict()
+
+    def query(self, rect):
+        '''
+        @ return [pygame.Rect,] - the merged rectangles which collide with rect
+        '''
+        ts, size = self.tile_size, self.REGION_SIZE
+        i_start, i_end = rect.left // ts, rect.right // ts
+        j_start, j_end = rect.top // ts, rect.bottom // ts
+        result = []
+        for rx in range(i_start // size, i_end // size + 1):
+            for ry in range(j_start // size, j_end // size + 1):
+                rects, owner = self._region(rx, ry)
+                if not rects: continue
+                seen = set()
+                for column in owner[max(i_start - rx * size, 0):i_end - rx * size + 1]:
+                    seen.update(column[max(j_start - ry * size, 0):j_end - ry * size + 1])
+                seen.discard(-1)
+                for n in sorted(seen):
+                    if rects[n].colliderect(rect):
+                        result.append(rects[n])
+        return result
@@ -0,0 +1,110 @@
+import numpy as np
+from bisect import bisect_left, bisect_right
+
+
+class ColumnIndex:
+    '''
+    Solid runs of every map column: column x -> sorted disjoint runs [start, end] of solid cells.
+    Vertical queries are a binary search in the runs of one column.
+    '''
+    def __init__(self):
+        self.columns = {} # x -> (starts, ends)
+
+    @classmethod
+    def from_solid(cls, solid, x0=0, y0=0):
+        '''
+        @ solid - boolean grid, solid[x - x0, y - y0]
+        '''
+        index = cls()
+        index._add_runs(solid, x0, y0)
+        return index
+
+    @staticmethod
+    def _runs(solid, x0, y0):
+        '''
+        @ return xs, starts, ends - the runs of all the columns, sorted by x and start
+        '''
+        padded = np.zeros((solid.shape[0], solid.shape[1] + 2), dtype=np.int8)
+        padded[:, 1:-1] = solid
+        d = np.diff(padded, axis=1)
+        xs, starts = np.nonzero(d == 1)
+        _, ends = np.nonzero(d == -1)
+        return (xs + x0).tolist(), (starts + y0).tolist(), (ends - 1 + y0).tolist()
+
+    def _add_runs(self, solid, x0, y0):
+        for x, start, end in zip(*self._runs(solid, x0, y0)):
+            starts, ends = self.columns.setdefault(x, ([], []))
+            starts.append(start)
+            ends.append(end)
+
+    def update_block(self, x0, y0, solid):
+        '''
+        Replaces the cells [x0, x0 + w) x [y0, y0 + h) of the index
+        @ solid - boolean grid w x h, solid[x - x0, y - y0]
+        '''
+        solid = np.asarray(solid, dtype=bool)
+        y1 = y0 + solid.shape[1] - 1
+        runs = {}
+        for x, start, end in zip(*self._runs(solid, x0, y0)):
+            runs.setdefault(x, []).append((start, end))
+        for x in range(x0, x0 + solid.shape[0]):
+            starts, ends = self.columns.get(x, ([], []))
+            # runs which overlap the block or touch it (they may merge with the new ones)
+            a = bisect_left(ends, y0 - 1)
+            b = bisect_right(starts, y1 + 1)
+            new = runs.get(x, [])
+            if a < b:
+                if starts[a] < y0:
+                    new.insert(0, (starts[a], y0 - 1))
+                if ends[b - 1] > y1:
+                    new.append((y1 + 1, ends[b - 1]))
+            merged = []
+            for start, end in sorted(new):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            starts[a:b] = [start for start, _ in merged]
+            ends[a:b] = [end for _, end in merged]
+            if starts:
+                self.columns[x] = (starts, ends)
+            else:
+                self.columns.pop(x, None)
+
+    def set(self, x, y, solid):
+        self.update_block(x, y, [[solid]])
+
+    def first_solid_below(self, x, y):
+        '''
+        @ return the first solid cell y' >= y of the column or None
+        '''
+        if x not in self.columns: return None
+        starts, ends = self.columns[x]
+        i = bisect_left(ends, y)
+        if i == len(starts): return None
+        return max(starts[i], y)
+
+    def has_solid(self, x, y_start, y_end):
+        '''
+        @ return True if there is a solid cell in [y_start, y_end] of the column
+        '''
+        ground = self.first_solid_below(x, y_start)
+        return ground is not None and ground <= y_end
+
+    def cliff_depth(self, x, y, limit=None):
+        '''
+        @ return how many empty cells there are from y down to the ground, limit (or None) if there is no ground
+        '''
+        ground = self.first_solid_below(x, y)
+        if ground is None: return limit
+        depth = ground - y
+        return depth if limit is None else min(depth, limit)
+
+    def gap_width(self, x, y, direction=1, deep=1, limit=16):
+        '''
+        @ return how many columns from x in the direction (1 or -1) have no solid cell in [y, y + deep - 1], up to limit
+        '''
+        width = 0
+        while width < limit and not self.has_solid(x + width * direction, y, y + deep - 1):
+            width += 1
+        return width
@@ -1,2 +1,12 @@
 GRAVITY = .5
-window_size = (1200, 700)
\ No newline at end of file
+window_size = (1200, 700)
+MAP_PATH = 'maps/map.json' # or a binary map made by scripts/mapfile.py, or a world directory made by scripts/streaming.py
+DESCENT_SEED = None # int - the world of MAP_PATH goes down forever with regions generated from the seed (see scripts/descent.py)
+ROOMS = {} # other rooms loaded with the main map: name -> map path (App.enter_room switches to them)
+ROOM_TICK_EVERY = 4 # inactive rooms are updated every n frames, 0 - they are frozen
+DIRTY_RECTS = False # present only the changed screen areas instead of flipping every frame (see scripts/dirty.py)
+FRAME_CACHE = 'data/frames.cache' # processed sprite frames kept between launches (see scripts/framecache.py), None - off
+PRELOAD_MANIFEST = 'data/preload.json' # images of a cold launch, decoded in parallel by the next cold one (see scripts/preload.py), None - off
+PRELOAD_REPORT = False # print the decoding times of the parallel preload at start
+ATLAS_PAGE_SIZE = (512, 512) # the frames and tile images are packed in pages of the size (see scripts/atlas.py), None - a surface per frame
+FLIPPED_FRAMES_BUDGET = 16 * 1024 * 1024 # bytes of the flipped frames kept for the animations facing left (see animation.FlippedFrames), None - no limit
@@ -0,0 +1,169 @@
+'''
+Endless descent: a world directory (see scripts/streaming.py) continued downwards by generated regions.
+
+Every region below the world is generated from the seed and its position only, so it is the same
+on every visit. The regions are generated by the loader thread ahead of the camera and written to
+    <world>/generated/<seed>/x_y.bin
+so a region is generated once, later it is loaded like any other one. The enemy and coin markers
+are generated with the tiles and given to the room by Map.take_spawns when the region is loaded.
+'''
+import os
+import threading
+import numpy as np
+from scripts import mapfile
+from scripts.streaming import StreamingTileMap, _region_name
+
+WALL = ('tiles', 8)
+# spawn resource -> how many variants it has (the npc types, the enemy types of EnemiesFactory, the coin types)
+SPAWN_VARIANTS = {'npc': 2, 'entities': 6, 'coins': 2}
+HALL_HEIGHT = 4 # empty rows at the top of the first generated row, everything falling from the world lands there
+TUNNEL = 3 # width of the tunnels and height of the corridors in cells
+
+
+def _rng(seed, *key):
+    return np.random.default_rng([v % 2 ** 32 for v in (seed, *key)])
+
+
+def _openings(seed, rx, ry, size):
+    '''
+    @ return x of the tunnels through the top border of the region (rx, ry), in cells of the region
+    '''
+    rng = _rng(seed, 1, rx, ry)
+    return sorted(rng.choice(np.arange(1, size - TUNNEL), size=int(rng.integers(1, 3)), replace=False).tolist())
+
+
+def _side_opening(seed, rx, ry, size):
+    '''
+    @ return y of the corridor through the left border of the region (rx, ry), in cells of the region
+    '''
+    return int(_rng(seed, 2, rx, ry).integers(2, size - TUNNEL - 1))
+
+
+def generate_region(seed, rx, ry, size, first_row=False, left=True, right=True, depth=0):
+    '''
+    Carves a region: tunnels from the openings of the top border to a corridor and from it to the
+    openings of the bottom border, the side corridors join it too. The openings of a border depend
+    on the seed and the border only, so the neighbour regions meet.
+    @ first_row - the region is right below the world, its top rows are open
+    @ left, right - the region has neighbours on the sides
+    @ depth - how many regions below the world, more enemies deeper
+    @ return (solid, markers) - boolean grid size x size, [(resource, variant, x, y),] in cells of the region
+    '''
+    rng = _rng(seed, 0, rx, ry)
+    solid = np.ones((size, size), dtype=bool)
+    corridor = int(rng.integers(TUNNEL + 1, size - TUNNEL - 1)) # bottom row of the corridor
+    xs = []
+    for x in _openings(seed, rx, ry, size):
+        # down to the corridor, drifting sideways
+        for y in range(0, corridor + 1):
+            if y and y % TUNNEL == 0:
+                x = int(np.clip(x + rng.integers(-1, 2), 1, size - TUNNEL - 1))
+            solid[x:x + TUNNEL, y] = False
+        xs.append(x)
+    for x in _openings(seed, rx, ry + 1, size):
+        solid[x:x + TUNNEL, corridor - TUNNEL + 1:] = False
+        xs.append(x)
+    sides = []
+    if left:
+        sides.append((0, _side_opening(seed, rx, ry, size)))
+    if right:
+        sides.append((size - 1, _side_opening(seed, rx + 1, ry, size)))
+    for x, y in sides:
+        # along the border row to the middle, then down or up to the corridor
+        middle = size // 2
+        solid[min(x, middle):max(x, middle) + 1, y:y + TUNNEL] = False
+        solid[middle:middle + TUNNEL, min(y, corridor - TUNNEL + 1):max(y + TUNNEL, corridor + 1)] = False
+        xs.append(middle)
+    solid[min(xs):max(xs) + TUNNEL, corridor - TUNNEL + 1:corridor + 1] = False
+    # caves along the corridor
+    for _ in range(int(rng.integers(0, 3))):
+        w, h = (int(v) for v in rng.integers(3, 8, size=2))
+        x, y = int(rng.integers(1, size - w)), int(rng.integers(1, max(2, corridor - h + 2)))
+        solid[x:x + w, y:y + h] = False
+    if first_row:
+        solid[:, :HALL_HEIGHT] = False
+
+    markers = []
+    # the enemies stand on the floor, the coins hang anywhere in the tunnels
+    floor = ~solid[:, :-2] & ~solid[:, 1:-1] & solid[:, 2:]
+    fx, fy = np.nonzero(floor)
+    for n in rng.choice(len(fx), size=min(len(fx), 1 + depth // 2, 8), replace=False).tolist():
+        markers.append(('entities', int(rng.integers(SPAWN_VARIANTS['entities'])), int(fx[n]), int(fy[n]) + 1))
+    ex, ey = np.nonzero(~solid)
+    for n in rng.choice(len(ex), size=min(len(ex), int(rng.integers(1, 4))), replace=False).tolist():
+        markers.append(('coins', int(rng.integers(SPAWN_VARIANTS['coins'])), int(ex[n]), int(ey[n])))
+    return solid, markers
+
+
+class DescentTileMap(StreamingTileMap):
+    '''
+    Streaming tile map of a world with generated regions below it. The regions under the world columns
+    are tunnels, the columns on both sides of them are walls, so the descent goes down forever.
+    '''
+    def __init__(self, path, seed, memory_budget=32 * 1024 * 1024, radius=1, lookahead=2):
+        '''
+        @ seed - int, the same seed makes the same descent
+        @ lookahead - how many regions below the camera are generated and loaded in advance
+        '''
+        super().__init__(path, memory_budget, radius)
+        self.seed = seed
+        self.lookahead = lookahead
+        self.cache_dir = os.path.join(path, 'generated', str(seed))
+        xs = [rx for rx, _ in self.known] or [0]
+        self.span = (min(xs), max(xs)) # region columns of the tunnels
+        self.bottom = max((ry for _, ry in self.known), default=-1) # the last region row of the world
+
+    def generates(self, key):
+        return key[1] > self.bottom and self.span[0] - 1 <= key[0] <= self.span[1] + 1
+
+    def _region_path(self, key):
+        path = super()._region_path(key)
+        if self.generates(key) and not os.path.exists(path):
+            return os.path.join(self.cache_dir, _region_name(key))
+        return path
+
+    def _generate(self, key):
+        rx, ry = key
+        size = self.region_size
+        x0, y0 = rx * size, ry * size
+        if self.span[0] <= rx <= self.span[1]:
+            solid, markers = generate_region(
+                self.seed, rx, ry, size, first_row=ry == self.bottom + 1,
+                left=rx > self.span[0], right=rx < self.span[1], depth=ry - self.bottom - 1
+            )
+        else:
+            solid, markers = np.ones((size, size), dtype=bool), []
+        tiles = {(x0 + x, y0 + y): {'resource': WALL[0], 'variant': WALL[1]} for x, y in zip(*(a.tolist() for a in np.nonzero(solid)))}
+        for resource_name, variant, x, y in markers:
+            tiles[(x0 + x, y0 + y)] = {'resource': resource_name, 'variant': variant}
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = os.path.join(self.cache_dir, _region_name(key))
+        # written aside and renamed, so a region is never read half written
+        temp = f'{path}.{threading.get_ident()}.tmp'
+        mapfile.save(temp, tiles, [], self.info['base_tile_size'], self.info['tile_size'], 0, 0)
+        os.replace(temp, path)
+        return mapfile.load(path)
+
+    def _read(self, key):
+        data = super()._read(key)
+        if data is None and self.generates(key):
+            data = self._generate(key)
+        return data
+
+    def _install(self, key, data):
+        super()._install(key, data)
+        self.known[key] = int(np.count_nonzero(self.regions[key][0]))
+
+    def update(self, i_start, j_start, i_end, j_end):
+        rs = self.region_size
+        j_end += self.lookahead * rs
+        # the generated regions around the camera become known, they are solid until they are loaded
+        known = []
+        for rx in range(i_start // rs - self.radius, i_end // rs + self.radius + 1):
+            for ry in range(j_start // rs - self.radius, j_end // rs + self.radius + 1):
+                if (rx, ry) not in self.known and self.generates((rx, ry)):
+                    self.known[(rx, ry)] = 0
+                    known.append(((rx, ry), []))
+        loaded, evicted = super().update(i_start, j_start, i_end, j_end)
+        # their cells are solid now, they are reported with the loaded regions
+        return known + loaded, evicted
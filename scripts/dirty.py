@@ -0,0 +1,64 @@
+import pygame
+
+
+class DirtyRects:
+    '''
+    Collects the changed screen areas of a frame and presents only them with pygame.display.update.
+    The areas of the previous frame are presented again, so what was drawn there is cleaned.
+    The whole frame is flipped when the camera moves, when full() was called in the frame
+    or when the areas cover too much of the screen.
+    '''
+    def __init__(self, size, enabled=True, max_coverage=.5):
+        '''
+        @ enabled - if False then every frame is flipped
+        @ max_coverage - part of the screen area above which a flip is cheaper than the rects
+        '''
+        self.screen_rect = pygame.Rect((0, 0), size)
+        self.enabled = enabled
+        self.max_coverage = max_coverage
+        self.rects = []
+        self.last_rects = []
+        self.last_camera = None
+        self.full_frame = True
+
+    def add(self, rect):
+        '''
+        @ rect - changed area in screen coords
+        '''
+        rect = self.screen_rect.clip(rect)
+        if rect.width and rect.height:
+            self.rects.append(rect)
+
+    def add_world(self, rect, camera, margin=0):
+        '''
+        @ rect - changed area in map coords
+        @ margin - pixels added on every side
+        '''
+        self.add(pygame.Rect(
+            rect.left - camera[0] - margin, rect.top - camera[1] - margin,
+            rect.width + 2 * margin, rect.height + 2 * margin
+        ))
+
+    def full(self):
+        self.full_frame = True
+
+    def present(self, camera):
+        '''
+        @ camera - (x, y) of the frame: the whole frame changes when it moves
+        @ return True if the whole frame was flipped
+        '''
+        camera = tuple(camera)
+        rects = self.rects + self.last_rects
+        flip = (
+            not self.enabled or self.full_frame or camera != self.last_camera
+            or sum(r.width * r.height for r in rects) > self.max_coverage * self.screen_rect.width * self.screen_rect.height
+        )
+        if flip:
+            pygame.display.flip()
+        elif rects:
+            pygame.display.update(rects)
+        self.last_rects = self.rects
+        self.rects = []
+        self.last_camera = camera
+        self.full_frame = False
+        return flip
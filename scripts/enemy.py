@@ -6,21 +6,22 @@ import random
 
 
 class NPC(Player):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
-        self.va_width = self.app.map.tile_size
-        self.va_height = self.app.map.tile_size
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
+        self.va_width = self.map.tile_size
+        self.va_height = self.map.tile_size
         self.walking = 0
-        self.explosion_factory = explosion.ExplosionFactory((app.map.tile_size, app.map.tile_size))
+        self.explosion_factory = explosion.ExplosionFactory((map.tile_size, map.tile_size))
         # healthbar
         self.health_rect = pygame.Rect(0, 0, 50, 8)
         self.fixed_enemy = None
+        self.chase_distance = 8 * self.map.tile_size
 
 
     def render(self, surf):
         super().render(surf)
         r = self.get_rect()
-        self.health_rect.topleft = (r.centerx - self.health_rect.width // 2 - self.app.map.camera_x, r.top - self.health_rect.height - 5 - self.app.map.camera_y)
+        self.health_rect.topleft = (r.centerx - self.health_rect.width // 2 - self.map.camera_x, r.top - self.health_rect.height - 5 - self.map.camera_y)
         pygame.draw.rect(surf, (255, 0, 0), self.health_rect)
         x = self.hp * self.health_rect.width / self.max_hp
         pygame.draw.rect(surf, (0, 255, 0), (*self.health_rect.topleft, x, self.health_rect.height))
@@ -36,8 +37,9 @@ class NPC(Player):
     def get_enemies(self):
         enemies = []
         va = self.get_vision_area()
-        if not self.app.main_player.died and va.colliderect(self.app.main_player.get_rect()): enemies.append(self.app.main_player)
-        for npc in self.app.npcs:
+        player = self.room.main_player
+        if player and not player.died and va.colliderect(player.get_rect()): enemies.append(player)
+        for npc in self.room.npcs:
             if not npc.died and va.colliderect(npc.get_rect()):
                 enemies.append(npc)
         return enemies
@@ -53,16 +55,31 @@ class NPC(Player):
 
     def is_cliff(self, deep=3, length=1):
         rect = self.get_rect()
-        ahead_d = self.app.map.tile_size // 2
-        y = (rect.bottom + ahead_d) // self.app.map.tile_size
+        ahead_d = self.map.tile_size // 2
+        y = (rect.bottom + ahead_d) // self.map.tile_size
         if self.flip:
-            x = (self.pos[0] - ahead_d) // self.app.map.tile_size
+            x = (self.pos[0] - ahead_d) // self.map.tile_size
             x_set = range(x - length + 1, x + 1)
         else:
-            x = (rect.right + ahead_d) // self.app.map.tile_size
+            x = (rect.right + ahead_d) // self.map.tile_size
             x_set = range(x, x + length)
 
-        return all([(x_, y_) not in self.app.map.tile_map for x_ in x_set for y_ in range(y, y + deep)])
+        columns = self.map.columns
+        return not any(columns.has_solid(x, y, y + deep - 1) for x in x_set)
+
+    def chase(self):
+        '''
+        Goes to the fixed enemy along the navigation path while it is near
+        @ return False if the enemy is too far or unreachable
+        '''
+        rect = self.fixed_enemy.get_rect()
+        if abs(rect.centerx - self.get_rect().centerx) > self.chase_distance:
+            self.fixed_enemy = None
+            return False
+        if self.get_vision_area().colliderect(rect):
+            self.move[0] = self.move[1] = False
+            return True
+        return self.follow_path(rect)
 
     def ai(self):
         super().update()
@@ -75,6 +92,9 @@ class NPC(Player):
             self.walking = 0
             self.move = [False] * 4
             return
+        if self.fixed_enemy and self.chase():
+            self.walking = 0
+            return
         if self.walking > 0:
             if self.collisions['left'] or self.collisions['right']:
                 self.flip = not self.flip
@@ -89,8 +109,8 @@ class NPC(Player):
 
 
 class Demon(NPC):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         self.max_hp = self.hp = 200
         self.scale=1
         self.va_width = 70
@@ -120,13 +140,13 @@ class Demon(NPC):
         if self.flip:
             x = self.pos[0] + self.base_rect.width - width
         attack_rect = pygame.Rect(x, y, width, height)
-        self.app.attack(attack_rect, 20, attack_main_player=True, attack_enemies=False, delay=50, intensity=100)
+        self.room.attack(attack_rect, 20, attack_main_player=True, attack_enemies=False, delay=50, intensity=100)
         # return attack_rect
     
 
 class Dragon(NPC):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         self.max_hp = self.hp = 500
         self.scale=1.2
         self.va_width = 110
@@ -157,13 +177,13 @@ class Dragon(NPC):
         y = self.pos[1]
         erect.topleft = (x, y)
         fire_attack_expl = self.explosion_factory.make_explosion('dragon_fire', erect.topleft, (0, 0), 30, self.flip)
-        self.app.finishing_effects.append(fire_attack_expl)
-        self.app.attack(erect, 50, attack_main_player=True, attack_enemies=False, delay=50, intensity=140)
+        self.room.finishing_effects.append(fire_attack_expl)
+        self.room.attack(erect, 50, attack_main_player=True, attack_enemies=False, delay=50, intensity=140)
 
 
 class Jinn(NPC):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         self.max_hp = self.hp = 120
         self.scale=1
         self.va_width = 200
@@ -197,11 +217,11 @@ class Jinn(NPC):
         else:
             x = self.pos[0] + self.base_rect.width
         fball_expl = self.explosion_factory.make_explosion('jinn_ball', (x, y), (speed, 0), 30, self.flip)
-        self.app.finishing_effects.append(fball_expl)
+        self.room.finishing_effects.append(fball_expl)
 
 class Lizard(NPC):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         self.max_hp = self.hp = 100
         self.scale=1.3
         self.va_width = 70
@@ -231,12 +251,12 @@ class Lizard(NPC):
         if self.flip:
             x = self.pos[0] + self.base_rect.width - width
         attack_rect = pygame.Rect(x, y, width, height)
-        self.app.attack(attack_rect, 20, attack_main_player=True, attack_enemies=False, delay=50, intensity=60)
+        self.room.attack(attack_rect, 20, attack_main_player=True, attack_enemies=False, delay=50, intensity=60)
 
 
 class Medusa(NPC):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         self.max_hp = self.hp = 100
         self.scale=1.3
         self.va_width = 70
@@ -267,17 +287,21 @@ class Medusa(NPC):
             if self.flip:
                 x = self.pos[0] + self.base_rect.width - width
             attack_rect = pygame.Rect(x, y, width, height)
-            self.app.attack(attack_rect, 70, attack_main_player=True, attack_enemies=False, delay=50, intensity=150)
-            if self.app.main_player.died:
-                self.app.main_player.death_animation = 'death_stone'
+            self.room.attack(attack_rect, 70, attack_main_player=True, attack_enemies=False, delay=50, intensity=150)
+            player = self.room.main_player
+            if player and player.died:
+                player.death_animation = 'death_stone'
         self.callback = real_attack
         self.callback_timer = self.animations['attack_1'].frame_duration * 3
 
 class SmallDragon(Dragon):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         self.max_hp = self.hp = 60
         base_dir = 'data/spritesheets/enemies/small_dragon'
+        # the animations of the dragon are replaced, their frames are given back
+        for anim in self.animations.values():
+            anim.release()
         self.animations = {
             'idle': animation.JoinFilesAnimation(base_dir, 'Idle', frame_duration=14, scale=self.scale, colorkey=(0,) * 3),
             'walk': animation.JoinFilesAnimation(base_dir, 'Walk', frame_duration=7, scale=self.scale, colorkey=(0,) * 3),
@@ -303,26 +327,33 @@ class SmallDragon(Dragon):
         y = self.pos[1]
         erect.topleft = (x, y)
         fire_attack_expl = self.explosion_factory.make_explosion('small_dragon_fire', erect.topleft, (speed, 0), 30, self.flip)
-        self.app.finishing_effects.append(fire_attack_expl)
-        self.app.attack(erect, 10, attack_main_player=True, attack_enemies=False, delay=30, intensity=40)
+        self.room.finishing_effects.append(fire_attack_expl)
+        self.room.attack(erect, 10, attack_main_player=True, attack_enemies=False, delay=30, intensity=40)
         
 
 
 class EnemiesFactory:
-    def __init__(self, app):
+    def __init__(self, app, map: map.Map):
         self.enemies = {
-            'demon': Demon(app, [0, 0], [0, 0]),
-            'dragon': Dragon(app, [0, 0], [0, 0]),
-            'jinn': Jinn(app, [0, 0], [0, 0]),
-            'lizard': Lizard(app, [0, 0], [0, 0]),
-            'medusa': Medusa(app, [0, 0], [0, 0]),
-            'small_dragon': SmallDragon(app, [0, 0], [0, 0]),
+            'demon': Demon(app, [0, 0], [0, 0], map),
+            'dragon': Dragon(app, [0, 0], [0, 0], map),
+            'jinn': Jinn(app, [0, 0], [0, 0], map),
+            'lizard': Lizard(app, [0, 0], [0, 0], map),
+            'medusa': Medusa(app, [0, 0], [0, 0], map),
+            'small_dragon': SmallDragon(app, [0, 0], [0, 0], map),
         }
 
-    def make_enemy(self, enemy_name, pos, vel):
+    def release(self):
+        for enemy in self.enemies.values():
+            enemy.release()
+
+    def make_enemy(self, enemy_name, pos, vel, room=None):
         enemy = copy.copy(self.enemies[enemy_name])
         enemy.animations = {k: copy.copy(v) for k, v in enemy.animations.items()}
         enemy.move = list(enemy.move)
         enemy.pos = list(pos)
         enemy.vel = list(vel)
+        enemy.prefetch()
+        if room:
+            enemy.bind(room)
         return enemy
\ No newline at end of file
@@ -1,13 +1,15 @@
 import pygame
-from . import consts, animation, explosion, map, light
+from . import consts, animation, explosion, map, light, navigation
 from abc import ABC, abstractmethod
 import copy
 import random
 
 class PhysicsEntity(ABC):
     
-    def __init__(self, app, pos, vel, max_speed=8, surf=None):
+    def __init__(self, app, pos, vel, map: map.Map, max_speed=8, surf=None):
         self.app = app
+        self.map = map
+        self.room = None # set by bind
         self.pos = list(pos)
         self.vel = list(vel)
         self.max_speed = max_speed
@@ -18,9 +20,9 @@ class PhysicsEntity(ABC):
         self.collisions['left'] = self.collisions['right'] = False
         self.pos[0] += self.vel[0]
         rect = self.get_rect()
-        intersections = self.app.map.get_solid_intersections(rect)
+        intersections = self.map.get_solid_colliders(rect)
         for tile_rect in intersections:
-            # pygame.draw.rect(self.app.screen, (255, 255, 0), (tile_rect.x - self.app.map.camera_x, tile_rect.y - self.app.map.camera_y, *tile_rect.size), 2)
+            # pygame.draw.rect(self.app.screen, (255, 255, 0), (tile_rect.x - self.map.camera_x, tile_rect.y - self.map.camera_y, *tile_rect.size), 2)
             if self.vel[0] > 0:
                 self.collisions['right'] = True
                 rect.right = tile_rect.left
@@ -35,9 +37,9 @@ class PhysicsEntity(ABC):
         self.vel[1] = min(self.vel[1] + consts.GRAVITY, self.max_speed)
         self.pos[1] += self.vel[1]
         rect = self.get_rect()
-        intersections = self.app.map.get_solid_intersections(rect)
+        intersections = self.map.get_solid_colliders(rect)
         for tile_rect in intersections:
-            # pygame.draw.rect(self.app.screen, (255, 0, 0), (tile_rect.x - self.app.map.camera_x, tile_rect.y - self.app.map.camera_y, *tile_rect.size), 2)
+            # pygame.draw.rect(self.app.screen, (255, 0, 0), (tile_rect.x - self.map.camera_x, tile_rect.y - self.map.camera_y, *tile_rect.size), 2)
             if self.vel[1] > 0:
                 self.collisions['bottom'] = True
                 rect.bottom = tile_rect.top
@@ -51,13 +53,20 @@ class PhysicsEntity(ABC):
         self._move_x()
         self._move_y()
 
+    def bind(self, room):
+        '''
+        Makes the entity live in the room: it collides with the room map and sees the room entities
+        '''
+        self.room = room
+        self.map = room.map
+
     @abstractmethod
     def get_rect(self):
         pass
 
 class Player(PhysicsEntity):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         self.scale = 1.2
         self.current_state = 'idle'
         self.last_state = None
@@ -80,6 +89,7 @@ class Player(PhysicsEntity):
         self.hurting = 0
         # move or run
         self.running = False
+        self.landing = None # x of the end of the navigation edge while it is in the air
         self.walk_speed = 3
         self.run_speed = 5
         # died
@@ -91,6 +101,8 @@ class Player(PhysicsEntity):
             'death_stone': animation.JoinFilesAnimation(base_dir, 'Stone', frame_duration=12, scale=1, colorkey=(0,) * 3, repeat=False)
         }
         self.death_animation = 'dead'
+        # the animations are loaded on first use, these ones are loaded in the background when the player is made
+        self.prefetch_hint = ['walk', 'jump', 'attack_1']
 
         # callbacks
         self.callback_timer = 0
@@ -100,6 +112,26 @@ class Player(PhysicsEntity):
         for k, v in self.special_animations.items():
             self.animations[k] = v
 
+    def release(self):
+        '''
+        Gives the shared frames of the animations and explosions back to the asset registry
+        (see scripts/assets.py). Only the prototypes of the factories release them, the copies share them
+        '''
+        unique = {id(anim): anim for anim in [*self.animations.values(), *self.special_animations.values()]}
+        for anim in unique.values():
+            anim.release()
+        if getattr(self, 'explosion_factory', None):
+            self.explosion_factory.release()
+
+    def prefetch(self, names=None):
+        '''
+        Loads the animations in the background
+        @ names - names of the animations, prefetch_hint by default
+        '''
+        for name in self.prefetch_hint if names is None else names:
+            if name in self.animations:
+                self.animations[name].prefetch()
+
     def update(self):
         self.last_state = self.current_state
         self.attack_timer = max(0, self.attack_timer - 1)
@@ -118,11 +150,12 @@ class Player(PhysicsEntity):
             super().move()
         elif self.attacking:
             state = f'attack_{self.attack_type}'
-            if self.animations[state].finished:
+            # an animation which is not loaded yet does not play, it is not waited for
+            if self.animations[state].finished or not self.animations[state].ready():
                 self.attacking = False
         elif self.hurting > 0:
             state = 'hurt'
-            if self.animations['hurt'].finished:
+            if self.animations['hurt'].finished or not self.animations['hurt'].ready():
                 self.hurting = 0
         else:
             state = 'idle'
@@ -143,18 +176,33 @@ class Player(PhysicsEntity):
                 state = 'jump'
         
         if self.current_state != state:
-            self.current_state = state
-            self.animations[self.current_state].reset()
+            if self.animations[state].ready():
+                self.current_state = state
+                self.animations[self.current_state].reset()
+            else:
+                # the old animation goes on while the new one is loaded in the background
+                self.animations[state].prefetch()
         self.animations[self.current_state].update()
     
-    def render(self, surf):
+    def _frame_pos(self):
+        frame = self.animations[self.current_state].get_current_frame()
         if self.flip:
-            width = self.animations[self.current_state].get_current_frame().get_width()
-            x = self.pos[0] - (width - self.base_rect.width)
+            x = self.pos[0] - (frame.get_width() - self.base_rect.width)
         else:
             x = self.pos[0]
-        y = self.pos[1] + self.base_rect.height - self.animations[self.current_state].get_current_frame().get_height()
-        self.animations[self.current_state].render(surf, (x - self.app.map.camera_x, y - self.app.map.camera_y), self.flip)
+        y = self.pos[1] + self.base_rect.height - frame.get_height()
+        return x, y, frame
+
+    def get_render_rect(self):
+        '''
+        @ return rect of the current frame in map coords
+        '''
+        x, y, frame = self._frame_pos()
+        return frame.get_rect(topleft=(x, y))
+
+    def render(self, surf):
+        x, y, _ = self._frame_pos()
+        self.animations[self.current_state].render(surf, (x - self.map.camera_x, y - self.map.camera_y), self.flip)
 
     def get_rect(self):
         rect = self.base_rect.copy()
@@ -162,6 +210,49 @@ class Player(PhysicsEntity):
         rect.top = self.pos[1]
         return rect
 
+    def steer(self, x):
+        '''
+        Walks to x in map coords, stops there
+        '''
+        rect = self.get_rect()
+        if abs(x - rect.centerx) <= (self.run_speed if self.running else self.walk_speed):
+            self.move[0] = self.move[1] = False
+            return
+        self.flip = x < rect.centerx
+        self.move[0] = self.flip
+        self.move[1] = not self.flip
+
+    def follow_path(self, target_rect, running=False):
+        '''
+        Goes to the target along the navigation path of the map, jumps on the jump edges.
+        The path is taken from the cache of the map until the map changes
+        @ return False if there is no path
+        '''
+        if not self.collisions['bottom']:
+            # in the air it goes to the landing of the edge
+            if self.landing is not None:
+                self.steer(self.landing)
+            return True
+        self.landing = None
+        rect = self.get_rect()
+        path = self.map.navigation.path(rect, target_rect)
+        if path is None: return False
+        self.running = running
+        if not path:
+            self.steer(target_rect.centerx)
+            return True
+        kind, _, takeoff, landing = path[0]
+        ts = self.map.tile_size
+        if rect.left // ts <= takeoff <= (rect.right - 1) // ts:
+            self.landing = (landing + .5) * ts
+            self.steer(self.landing)
+            if kind == navigation.JUMP:
+                self.running = True
+                self.jump()
+        else:
+            self.steer((takeoff + .5) * ts)
+        return True
+
     def jump(self):
         if self.jumps < self.max_jumps:
             self.jumps += 1
@@ -184,8 +275,8 @@ class Player(PhysicsEntity):
             self.died = True
 
 class MainPlayer(Player):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         # healthbar
         self.health_rect = pygame.Rect(10, 10, 120, 20)
         # energybar
@@ -195,7 +286,7 @@ class MainPlayer(Player):
     def render(self, surf):
         super().render(surf)
         if self.app.light_on:
-            self.light_ball.render(surf, (self.app.map.camera_x, self.app.map.camera_y))
+            self.light_ball.render(surf, (self.map.camera_x, self.map.camera_y))
 
     def render_bars(self, surf):
         pygame.draw.rect(surf, (255, 0, 0), self.health_rect)
@@ -214,14 +305,14 @@ class MainPlayer(Player):
 
     def hurt(self, damage, delay, intensity):
         super().hurt(damage)
-        self.app.map.shake_screen(delay=delay, intensity=intensity)
+        self.map.shake_screen(delay=delay, intensity=intensity)
 
 
 class NPC(Player):
-    def __init__(self, app, pos, vel, vision_radius=900, attack_distance=None):
-        super().__init__(app, pos, vel)
-        self.vision_area = pygame.Rect(0, 0, vision_radius, app.map.tile_size)
-        self.attack_distance = attack_distance if attack_distance else app.map.tile_size
+    def __init__(self, app, pos, vel, map: map.Map, vision_radius=900, attack_distance=None):
+        super().__init__(app, pos, vel, map)
+        self.vision_area = pygame.Rect(0, 0, vision_radius, map.tile_size)
+        self.attack_distance = attack_distance if attack_distance else map.tile_size
         self.fixed_enemy = None
         self.health_rect = pygame.Rect(0, 0, 50, 8)
         self.come = False
@@ -243,7 +334,7 @@ class NPC(Player):
     def get_enemies(self):
         rect = self.get_vision_area()
         result = []
-        for enemy in self.app.enemies:
+        for enemy in self.room.enemies:
             if not enemy.died and enemy.get_rect().colliderect(rect):
                 result.append(enemy)
         return result
@@ -269,38 +360,49 @@ class NPC(Player):
 
     def is_cliff(self, deep=3, length=1):
         rect = self.get_rect()
-        ahead_d = self.app.map.tile_size // 2
-        y = (rect.bottom + ahead_d) // self.app.map.tile_size
+        ahead_d = self.map.tile_size // 2
+        y = (rect.bottom + ahead_d) // self.map.tile_size
         if self.flip:
-            x = (self.pos[0] - ahead_d) // self.app.map.tile_size
+            x = (self.pos[0] - ahead_d) // self.map.tile_size
             x_set = range(x - length + 1, x + 1)
         else:
-            x = (rect.right + ahead_d) // self.app.map.tile_size
+            x = (rect.right + ahead_d) // self.map.tile_size
             x_set = range(x, x + length)
 
-        return all([(x_, y_) not in self.app.map.tile_map for x_ in x_set for y_ in range(y, y + deep)])
+        columns = self.map.columns
+        return not any(columns.has_solid(x, y, y + deep - 1) for x in x_set)
 
     def follow_main_player(self, running=False):
-        player_rect = self.app.main_player.get_rect()
+        player = self.room.main_player
+        if player is None:
+            # the main player is in another room
+            self.move = [False] * 4
+            self.running = False
+            return
+        player_rect = player.get_rect()
         if abs(player_rect.x - self.pos[0]) < self.near_distance: 
             self.move = [False] * 4
             self.running = False
             return
-        if abs(player_rect.x - self.pos[0]) > self.panic_distance:
+        far = abs(player_rect.x - self.pos[0]) > self.panic_distance
+        if (far or self.move[0] or self.move[1]) and self.follow_path(player_rect, True if running else player.running):
+            return
+        # no path: straight to the player
+        if far:
             if player_rect.x < self.pos[0]:
                 self.move[0] = True
                 self.move[1] = False
                 self.flip = True
-                self.running = True if running else self.app.main_player.running
+                self.running = True if running else player.running
             else:
                 self.move[0] = False
                 self.move[1] = True
                 self.flip = False
-                self.running = True if running else self.app.main_player.running
+                self.running = True if running else player.running
         if self.collisions['left'] or self.collisions['right']:
             self.jump()
 
-        if player_rect.top > self.pos[1] + 2 * self.app.map.tile_size: return
+        if player_rect.top > self.pos[1] + 2 * self.map.tile_size: return
         cliff3 = self.is_cliff(length=3)
         if cliff3:
             self.move = [False] * 4
@@ -313,7 +415,7 @@ class NPC(Player):
         if self.come:
             self.follow_main_player(running=True)
             return
-        player_rect = self.app.main_player.get_rect()
+        player = self.room.main_player
         self.set_enemy_aim()
         if self.fixed_enemy:
             renemy = self.fixed_enemy.get_rect()
@@ -334,7 +436,7 @@ class NPC(Player):
                 self.flip = self.fixed_enemy.pos[0] < self.pos[0]
                 self.attack()
         else:
-            if abs(self.pos[0] - player_rect.x) > self.far_distance:
+            if player is None or abs(self.pos[0] - player.get_rect().x) > self.far_distance:
                 self.move = [False] * 4
                 self.running = False
                 return
@@ -347,15 +449,15 @@ class NPC(Player):
     def render(self, surf):
         super().render(surf)
         r = self.get_rect()
-        self.health_rect.topleft = (r.centerx - self.health_rect.width // 2 - self.app.map.camera_x, r.top - self.health_rect.height - 5 - self.app.map.camera_y)
+        self.health_rect.topleft = (r.centerx - self.health_rect.width // 2 - self.map.camera_x, r.top - self.health_rect.height - 5 - self.map.camera_y)
         pygame.draw.rect(surf, (255, 0, 0), self.health_rect)
         x = self.hp * self.health_rect.width / self.max_hp
         pygame.draw.rect(surf, (0, 255, 0), (*self.health_rect.topleft, x, self.health_rect.height))
 
 
 class Wizard(MainPlayer):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map)
         base_dir = 'data/spritesheets/entities/Wizard'
         self.animations = {
             'idle': animation.Animation(base_dir, 'Idle.png', 6, frame_duration=10, scale=self.scale, colorkey=(0,) * 3),
@@ -383,7 +485,7 @@ class Wizard(MainPlayer):
         self.max_attack_energy = max(self.attack_energies[1:])
         self.attack_energy = self.max_attack_energy
         # explosions
-        self.explosion_factory = explosion.ExplosionFactory((app.map.tile_size, app.map.tile_size))
+        self.explosion_factory = explosion.ExplosionFactory((map.tile_size, map.tile_size))
 
         # lightning
         self.light_ball = light.LightBall(self)
@@ -398,8 +500,8 @@ class Wizard(MainPlayer):
         if self.flip:
             spawnx = r.left - r.width * 4 - efrect.width
         expl = self.explosion_factory.make_explosion('lightning 1', (spawnx ,spawny), [0, speedy])
-        self.app.finishing_effects.append(expl)
-        # self.app.rigid_effects.append(expl)
+        self.room.finishing_effects.append(expl)
+        # self.room.rigid_effects.append(expl)
 
     def attack_2(self):
         speedx = 10
@@ -411,7 +513,7 @@ class Wizard(MainPlayer):
             spawnx = r.left - r.width * 1.5
         spawny = (r.centery + r.y) // 2
         expl = self.explosion_factory.make_explosion('wizard attack 1', (spawnx ,spawny), [speedx, 0])
-        self.app.rigid_effects.append(expl)
+        self.room.rigid_effects.append(expl)
 
     def attack_1(self):
         attack_width = self.animations['attack_1']._max_width
@@ -419,13 +521,13 @@ class Wizard(MainPlayer):
             attack_area = pygame.Rect(self.pos[0] - attack_width, self.pos[1], attack_width, self.base_rect.height)
         else:
             attack_area = pygame.Rect(self.pos[0] + self.base_rect.width, self.pos[1], attack_width, self.base_rect.height)
-        self.app.attack(attack_area, 20, attack_main_player=False, attack_enemies=True)
+        self.room.attack(attack_area, 20, attack_main_player=False, attack_enemies=True)
 
 
 
 class Swordsman(NPC):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel, vision_radius=800, attack_distance=50)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map, vision_radius=800, attack_distance=50)
         base_dir = 'data/spritesheets/entities/Swordsman'
         self.animations = {
             'idle': animation.Animation(base_dir, 'Idle.png', 8, frame_duration=10, scale=self.scale, colorkey=(0,) * 3),
@@ -454,7 +556,7 @@ class Swordsman(NPC):
         self.attack_energy = self.max_attack_energy
         self.attack_period = 40
         # explosions
-        self.explosion_factory = explosion.ExplosionFactory((app.map.tile_size, app.map.tile_size))
+        self.explosion_factory = explosion.ExplosionFactory((map.tile_size, map.tile_size))
 
 
     def attack_1(self, damage=20):
@@ -463,7 +565,7 @@ class Swordsman(NPC):
             attack_area = pygame.Rect(self.pos[0] - attack_width, self.pos[1], attack_width, self.base_rect.height)
         else:
             attack_area = pygame.Rect(self.pos[0] + self.base_rect.width, self.pos[1], attack_width, self.base_rect.height)
-        self.app.attack(attack_area, damage, attack_main_player=False, attack_enemies=True)
+        self.room.attack(attack_area, damage, attack_main_player=False, attack_enemies=True)
 
     def attack_2(self):
         self.attack_1(damage=40)
@@ -474,8 +576,8 @@ class Swordsman(NPC):
 
 
 class Archer(NPC):
-    def __init__(self, app, pos, vel):
-        super().__init__(app, pos, vel, vision_radius=900, attack_distance=900)
+    def __init__(self, app, pos, vel, map: map.Map):
+        super().__init__(app, pos, vel, map, vision_radius=900, attack_distance=900)
         base_dir = 'data/spritesheets/entities/Archer'
         attack_anim = animation.Animation(base_dir, 'Attack_1.png', 4, frame_duration=6, scale=self.scale, colorkey=(0,) * 3)
         self.animations = {
@@ -504,7 +606,7 @@ class Archer(NPC):
         self.max_attack_energy = max(self.attack_energies[1:])
         self.attack_energy = self.max_attack_energy
         # explosions
-        self.explosion_factory = explosion.ExplosionFactory((app.map.tile_size, app.map.tile_size))
+        self.explosion_factory = explosion.ExplosionFactory((map.tile_size, map.tile_size))
 
 
     def attack_1(self):
@@ -517,20 +619,27 @@ class Archer(NPC):
             spawnx = r.left - r.width * 1.5
         spawny = (r.centery + r.y) // 2
         expl = self.explosion_factory.make_explosion('arrow', (spawnx ,spawny), [speedx, 0])
-        self.app.rigid_effects.append(expl)
+        self.room.rigid_effects.append(expl)
 
 class EntityFactory:
-    def __init__(self, app):
+    def __init__(self, app, map: map.Map):
         self.players = {
-            'wizard': Wizard(app, [0, 0], [0, 0]),
-            'swordsman': Swordsman(app, [0, 0], [0, 0]),
-            'archer': Archer(app, [0, 0], [0, 0])
+            'wizard': Wizard(app, [0, 0], [0, 0], map),
+            'swordsman': Swordsman(app, [0, 0], [0, 0], map),
+            'archer': Archer(app, [0, 0], [0, 0], map)
         }
 
-    def make_player(self, player_name, pos, vel):
+    def release(self):
+        for player in self.players.values():
+            player.release()
+
+    def make_player(self, player_name, pos, vel, room=None):
         player = copy.copy(self.players[player_name])
         player.animations = {k: copy.copy(v) for k, v in player.animations.items()}
         player.move = list(player.move)
         player.pos = list(pos)
         player.vel = list(vel)
+        player.prefetch()
+        if room:
+            player.bind(room)
         return player
\ No newline at end of file
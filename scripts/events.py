@@ -0,0 +1,93 @@
+'''
+Map change events. Every change of the map is emitted with the box of the cells it touches,
+so derived data (render cache, colliders, column index, navigation, light) updates only those cells.
+'''
+TILE_SET = 'tile set'
+TILE_REMOVED = 'tile removed'
+OFFGRID_ADDED = 'offgrid added'
+OFFGRID_REMOVED = 'offgrid removed'
+REGION_LOADED = 'region loaded' # streamed region was installed or a generated one became known
+REGION_EVICTED = 'region evicted' # streamed region was dropped, its cells are solid until it is loaded again
+
+TILE_EVENTS = (TILE_SET, TILE_REMOVED, REGION_LOADED, REGION_EVICTED) # events which change the grid cells
+OFFGRID_EVENTS = (OFFGRID_ADDED, OFFGRID_REMOVED)
+
+
+class MapEvent:
+    __slots__ = ('kind', 'area', 'tile')
+
+    def __init__(self, kind, area, tile=None):
+        '''
+        @ area - (i_start, j_start, i_end, j_end) cells, ends included
+        @ tile - the new tile for TILE_SET, the off-grid tile for off-grid events
+        '''
+        self.kind = kind
+        self.area = area
+        self.tile = tile
+
+    def overlaps(self, area):
+        return not (
+            self.area[2] < area[0] or self.area[0] > area[2]
+            or self.area[3] < area[1] or self.area[1] > area[3]
+        )
+
+    def __repr__(self):
+        return f'MapEvent({self.kind!r}, {self.area})'
+
+
+class Subscription:
+    __slots__ = ('callback', 'kinds', 'area', 'batched')
+
+    def __init__(self, callback, kinds, area, batched):
+        self.callback = callback
+        self.kinds = kinds
+        self.area = area
+        self.batched = batched
+
+    def accepts(self, event):
+        return (self.kinds is None or event.kind in self.kinds) and (self.area is None or event.overlaps(self.area))
+
+
+class EventBus:
+    '''
+    Immediate subscribers get every event as soon as it is emitted,
+    batched ones get all the events of a frame when flush is called (Map.update does it).
+    '''
+    def __init__(self):
+        self.subscribers = []
+        self.pending = []
+
+    def subscribe(self, callback, kinds=None, area=None, batched=False):
+        '''
+        @ callback - function ([MapEvent,])
+        @ kinds - event kinds to get, None - all
+        @ area - (i_start, j_start, i_end, j_end) cells, only events which touch them are delivered. None - everywhere
+        @ return subscription for unsubscribe
+        '''
+        subscription = Subscription(callback, kinds, area, batched)
+        self.subscribers.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self.subscribers.remove(subscription)
+
+    def emit(self, kind, area, tile=None):
+        event = MapEvent(kind, area, tile)
+        batched = False
+        for subscription in self.subscribers:
+            if subscription.batched:
+                batched = True
+            elif subscription.accepts(event):
+                subscription.callback([event])
+        if batched:
+            self.pending.append(event)
+        return event
+
+    def flush(self):
+        events, self.pending = self.pending, []
+        if not events: return
+        for subscription in self.subscribers:
+            if not subscription.batched: continue
+            accepted = [event for event in events if subscription.accepts(event)]
+            if accepted:
+                subscription.callback(accepted)
@@ -64,9 +64,14 @@ def finish_explosion8_maker(explfactory, lightning, map):
     x = lrect.centerx - explrect.width // 2
     real_width = 4
     physical_lrect = pygame.Rect(lrect.centerx - real_width // 2, lrect.top, real_width, lrect.height)
-    intersections = map.get_solid_intersections(physical_lrect)
-    if not intersections: return None
-    bottom = min([r.y for r in intersections]) if len(intersections) > 0 else lrect.bottom
+    # the first ground in the columns of the lightning
+    grounds = []
+    for i in range(physical_lrect.left // map.tile_size, (physical_lrect.right - 1) // map.tile_size + 1):
+        j = map.columns.first_solid_below(i, physical_lrect.top // map.tile_size)
+        if j is not None and j * map.tile_size < physical_lrect.bottom:
+            grounds.append(j * map.tile_size)
+    if not grounds: return None
+    bottom = min(grounds)
     y = bottom - explrect.height + explrect.width // 3
     return explfactory.make_explosion('blue explosion 8', (x, y), (0, 0))
 
@@ -168,6 +173,13 @@ class ExplosionFactory:
             ),
         }
 
+    def release(self):
+        '''
+        Gives the shared frames of the explosions back to the asset registry
+        '''
+        for base_explosion in self.base_explosions.values():
+            base_explosion.animation.release()
+
     def make_explosion(self, explosion_name, pos, vel, damage=0, flip=False):
         explosion = copy.copy(self.base_explosions[explosion_name])
         explosion.pos = list(pos)
@@ -0,0 +1,198 @@
+'''
+On-disk cache of processed sprite frames.
+
+The frames made by scripts/utils.py (decoded, scaled, cropped to the bounding rect) are kept
+as raw pixels in one file, so a warm launch converts its surfaces right from the memory-mapped file
+without decoding and transforming the images again. Only the pages of the used frames are read.
+
+    header      MAGIC, version, index length
+    index       utf-8 json: key -> [[width, height, format, colorkey or null, offset],] per frame
+    pixels      8-byte aligned, raw pixels of the frames, format 'RGBA' or 'RGBX', the offsets are from here
+
+A key has the source path and its modification time in it, a changed image gets a new key.
+The entries of changed or removed images are dropped when the cache is saved, the other ones are kept
+even if the launch did not use them (the animations are loaded on first use, a launch may not show them).
+'''
+import json
+import mmap
+import os
+import struct
+import threading
+import pygame
+
+MAGIC = b'FRMC'
+VERSION = 2 # the files of version 1 have the flipped frames too
+HEADER = struct.Struct('<4sHI')
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def source_key(kind, paths, *params):
+    '''
+    @ kind - what was made of the sources
+    @ paths - source files, their modification times are in the key
+    @ params - everything the frames depend on: scale, size, colorkey...
+    '''
+    stamps = [f'{path}@{os.stat(path).st_mtime_ns}' for path in paths]
+    return '|'.join([kind, *stamps, *map(repr, params)])
+
+
+def _current(key):
+    '''
+    @ return False if a source of the key (see source_key) was changed or removed
+    '''
+    for part in key.split('|')[1:]:
+        path, at, stamp = part.rpartition('@')
+        if not at or not stamp.isdigit(): continue
+        try:
+            if os.stat(path).st_mtime_ns != int(stamp): return False
+        except OSError:
+            return False
+    return True
+
+
+def on_main_thread():
+    '''
+    @ return True on the main thread, the only one which converts surfaces to the format of the screen
+    '''
+    return threading.current_thread() is threading.main_thread()
+
+
+def to_pixels(frame):
+    '''
+    @ return (width, height, format, colorkey, raw pixels) of the surface
+    '''
+    fmt = 'RGBA' if frame.get_flags() & pygame.SRCALPHA else 'RGBX'
+    colorkey = frame.get_colorkey()
+    return (*frame.get_size(), fmt, list(colorkey[:3]) if colorkey else None, pygame.image.tobytes(frame, fmt))
+
+
+def from_pixels(width, height, fmt, colorkey, pixels):
+    '''
+    @ return the surface of the raw pixels (see to_pixels) in the format of the screen,
+    off the main thread in the format of the pixels
+    '''
+    frame = pygame.image.frombuffer(pixels, (width, height), fmt)
+    # to the format of the screen like the decoded images, the blits are fast then
+    if on_main_thread():
+        frame = frame.convert_alpha() if fmt == 'RGBA' else frame.convert()
+    if colorkey is not None:
+        frame.set_colorkey(colorkey)
+    return frame
+
+
+class FrameCache:
+    def __init__(self, path, atlas=None):
+        '''
+        @ path - the cache file, it is made by save
+        @ atlas - Atlas the frames are packed in (see scripts/atlas.py), None - a surface per frame
+        '''
+        self.path = path
+        self.atlas = atlas
+        self.data = None
+        self.index = {}
+        self.used = set()
+        self.new = {} # key -> [pixels,] (see to_pixels) frames made in this launch
+        self.hits = 0
+        self.misses = 0
+        self.saved = None # (new, used) counts of the last save
+        try:
+            with open(path, 'rb') as f:
+                # private copy-on-write mapping, frombuffer needs a writable buffer
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+            magic, version, index_length = HEADER.unpack_from(data, 0)
+            if magic == MAGIC and version == VERSION:
+                self.index = json.loads(bytes(data[HEADER.size:HEADER.size + index_length]).decode('utf-8'))
+                self.data = data
+                self.start = _align(HEADER.size + index_length)
+        except (OSError, ValueError, struct.error):
+            # no cache or a broken one, it is made again
+            self.index = {}
+
+    def get(self, key):
+        '''
+        @ return [surface,] frames of the key or None
+        '''
+        atlas = self._atlas()
+        build = atlas.from_pixels if atlas else from_pixels
+        if key in self.new:
+            self.hits += 1
+            return [build(*pixels) for pixels in self.new[key]]
+        entry = self.index.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.used.add(key)
+        frames = []
+        view = memoryview(self.data)[self.start:]
+        for width, height, fmt, colorkey, offset in entry:
+            frames.append(build(width, height, fmt, colorkey, view[offset:offset + width * height * 4]))
+        return frames
+
+    def _atlas(self):
+        # the frames loaded in the background are surfaces of their own (see Atlas.writable)
+        return self.atlas if self.atlas and self.atlas.writable() else None
+
+    def put(self, key, frames):
+        # pixels, the frames of the atlas are not read off the main thread
+        self.new[key] = [to_pixels(frame) for frame in frames]
+        atlas = self._atlas()
+        return atlas.pack(frames) if atlas else frames
+
+    def load(self, key, make):
+        '''
+        @ make - function () -> [surface,] called on a miss
+        @ return [surface,] frames of the key
+        '''
+        frames = self.get(key)
+        if frames is None:
+            frames = self.put(key, make())
+        return frames
+
+    def save(self):
+        '''
+        Writes the new frames and the ones of the unchanged images, nothing is written if nothing changed
+        '''
+        # copies, the frames loaded in the background may be added meanwhile
+        new, used = dict(self.new), set(self.used)
+        if self.saved == (len(new), len(used)): return
+        kept = [key for key in self.index if key in used or _current(key)]
+        if not new and len(kept) == len(self.index): return
+        index = {}
+        chunks = []
+        offset = 0
+        def add(key, frames):
+            nonlocal offset
+            index[key] = []
+            for width, height, fmt, colorkey, pixels in frames:
+                index[key].append([width, height, fmt, colorkey, offset])
+                padding = _align(len(pixels)) - len(pixels)
+                chunks.append(pixels + b'\0' * padding)
+                offset += len(pixels) + padding
+        for key in kept:
+            if key in new: continue
+            add(key, [
+                (width, height, fmt, colorkey, bytes(self.data[self.start + start:self.start + start + width * height * 4]))
+                for width, height, fmt, colorkey, start in self.index[key]
+            ])
+        for key, frames in new.items():
+            add(key, frames)
+        text = json.dumps(index).encode('utf-8')
+        header = HEADER.pack(MAGIC, VERSION, len(text)) + text
+        start = _align(len(header))
+        temp = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(temp, 'wb') as f:
+                f.write(header + b'\0' * (start - len(header)))
+                f.write(b''.join(chunks))
+            # written aside and renamed, the old file stays mapped by this launch
+            os.replace(temp, self.path)
+            self.saved = (len(new), len(used))
+        except OSError:
+            # the cache only saves time, the game goes on without it
+            if os.path.exists(temp):
+                os.remove(temp)
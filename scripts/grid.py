@@ -0,0 +1,194 @@
+import numpy as np
+from collections.abc import MutableMapping
+
+
+def solid_hits(solid, x0, y0, boxes, tile_size):
+    '''
+    @ solid - boolean grid, solid[x - x0, y - y0]
+    @ boxes - int array N x 4 of (left, top, right, bottom) in pixels
+    @ return hits, i_start, j_start - hits[n, i, j] is True if cell (i_start[n] + i, j_start[n] + j)
+    is solid and overlaps the n-th box
+    '''
+    left, top, right, bottom = boxes.T
+    i_start, j_start = left // tile_size, top // tile_size
+    i_end, j_end = right // tile_size, bottom // tile_size
+    di = np.arange((i_end - i_start).max() + 1)[None, :, None]
+    dj = np.arange((j_end - j_start).max() + 1)[None, None, :]
+    i = i_start[:, None, None] + di
+    j = j_start[:, None, None] + dj
+    i, j = np.broadcast_arrays(i, j)
+    # the same test as pygame.Rect.colliderect with the tile rect
+    hits = (
+        (i * tile_size < right[:, None, None]) & ((i + 1) * tile_size > left[:, None, None])
+        & (j * tile_size < bottom[:, None, None]) & ((j + 1) * tile_size > top[:, None, None])
+    )
+    gx, gy = i - x0, j - y0
+    hits &= (gx >= 0) & (gx < solid.shape[0]) & (gy >= 0) & (gy < solid.shape[1])
+    hits[hits] = solid[gx[hits], gy[hits]]
+    return hits, i_start, j_start
+
+
+class TileGrid(MutableMapping):
+    '''
+    Dense storage for Map.tile_map.
+    Cells are kept as compact tile ids in an int array over the map bounds (0 - empty cell),
+    the palette maps ids back to (resource, variant). A boolean solidity grid is kept next to it.
+    Arrays are indexed as [x - x0, y - y0].
+    It is still a mapping (x, y) -> {'resource', 'variant'}, but the returned dicts are copies:
+    change tiles with grid[pos] = tile.
+    '''
+    def __init__(self, resource_props, x0=0, y0=0, width=0, height=0):
+        self.resource_props = resource_props
+        self.palette = [None]
+        self.palette_ids = {}
+        self.solid_lut = np.zeros(1, dtype=bool)
+        self.x0 = x0
+        self.y0 = y0
+        self.width = width
+        self.height = height
+        self.ids = np.zeros((width, height), dtype=np.uint16)
+        self.solid = np.zeros((width, height), dtype=bool)
+        self.count = 0
+
+    @classmethod
+    def from_tiles(cls, tile_map, resource_props):
+        if not tile_map:
+            return cls(resource_props)
+        xs = [pos[0] for pos in tile_map]
+        ys = [pos[1] for pos in tile_map]
+        grid = cls(resource_props, min(xs), min(ys), max(xs) - min(xs) + 1, max(ys) - min(ys) + 1)
+        for pos, tile in tile_map.items():
+            grid[pos] = tile
+        return grid
+
+    @classmethod
+    def from_arrays(cls, ids, palette, x0, y0, resource_props=None):
+        '''
+        @ ids - array of tile ids (it is used without copying)
+        @ palette - [None, (resource, variant),] for the ids
+        @ resource_props - can be given later with set_resource_props
+        '''
+        grid = cls(resource_props, x0, y0)
+        for resource_name, variant in palette[1:]:
+            grid.tile_id(resource_name, variant)
+        grid.ids = ids
+        grid.width, grid.height = ids.shape
+        grid.solid = grid.solid_lut[ids]
+        grid.count = int(np.count_nonzero(ids))
+        return grid
+
+    def _issolid_tile(self, resource_name, variant):
+        if self.resource_props is None: return False
+        props = self.resource_props.get(resource_name, {})
+        return 'solid' in props and props['solid'][variant]
+
+    def set_resource_props(self, resource_props):
+        '''
+        Rebuilds the solidity grid for new resource props
+        '''
+        self.resource_props = resource_props
+        self.solid_lut = np.array([False] + [self._issolid_tile(*key) for key in self.palette[1:]], dtype=bool)
+        self.solid = self.solid_lut[self.ids]
+
+    def tile_id(self, resource_name, variant):
+        key = (resource_name, variant)
+        if key not in self.palette_ids:
+            self.palette_ids[key] = len(self.palette)
+            self.palette.append(key)
+            self.solid_lut = np.append(self.solid_lut, self._issolid_tile(resource_name, variant))
+        return self.palette_ids[key]
+
+    def _inside(self, x, y):
+        return 0 <= x - self.x0 < self.width and 0 <= y - self.y0 < self.height
+
+    def _grow(self, x, y, margin=16):
+        x0 = x - margin if x < self.x0 else self.x0
+        y0 = y - margin if y < self.y0 else self.y0
+        x1 = self.x0 + self.width
+        y1 = self.y0 + self.height
+        x1 = x + margin + 1 if x >= x1 else x1
+        y1 = y + margin + 1 if y >= y1 else y1
+        if not self.ids.size:
+            x0, y0, x1, y1 = x, y, x + 1, y + 1
+        ids = np.zeros((x1 - x0, y1 - y0), dtype=self.ids.dtype)
+        solid = np.zeros((x1 - x0, y1 - y0), dtype=bool)
+        dx, dy = self.x0 - x0, self.y0 - y0
+        ids[dx:dx + self.width, dy:dy + self.height] = self.ids
+        solid[dx:dx + self.width, dy:dy + self.height] = self.solid
+        self.ids, self.solid, self.x0, self.y0 = ids, solid, x0, y0
+        self.width, self.height = ids.shape
+
+    def cell(self, x, y):
+        x -= self.x0
+        y -= self.y0
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.ids[x, y]
+        return 0
+
+    def issolid_cell(self, x, y):
+        x -= self.x0
+        y -= self.y0
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return bool(self.solid[x, y])
+        return False
+
+    def _window(self, array, i_start, j_start, i_end, j_end):
+        '''
+        @ return array[i_start:i_end + 1, j_start:j_end + 1] in grid coords, zero outside the bounds
+        '''
+        a0, b0 = i_start - self.x0, j_start - self.y0
+        if a0 >= 0 and b0 >= 0 and i_end - self.x0 < self.width and j_end - self.y0 < self.height:
+            return array[a0:i_end - self.x0 + 1, b0:j_end - self.y0 + 1]
+        result = np.zeros((i_end - i_start + 1, j_end - j_start + 1), dtype=array.dtype)
+        a0, b0 = max(i_start, self.x0), max(j_start, self.y0)
+        a1 = min(i_end + 1, self.x0 + self.width)
+        b1 = min(j_end + 1, self.y0 + self.height)
+        if a0 < a1 and b0 < b1:
+            result[a0 - i_start:a1 - i_start, b0 - j_start:b1 - j_start] = array[a0 - self.x0:a1 - self.x0, b0 - self.y0:b1 - self.y0]
+        return result
+
+    def solid_window(self, i_start, j_start, i_end, j_end):
+        return self._window(self.solid, i_start, j_start, i_end, j_end)
+
+    def solid_hits(self, boxes, tile_size):
+        return solid_hits(self.solid, self.x0, self.y0, boxes, tile_size)
+
+    def positions(self, resource_name, variant):
+        '''
+        @ return [(x, y),] of the cells with the given tile
+        '''
+        if (resource_name, variant) not in self.palette_ids: return []
+        xs, ys = np.nonzero(self.ids == self.palette_ids[(resource_name, variant)])
+        return list(zip((xs + self.x0).tolist(), (ys + self.y0).tolist()))
+
+    def __getitem__(self, pos):
+        tile_id = self.cell(*pos)
+        if tile_id == 0: raise KeyError(pos)
+        resource_name, variant = self.palette[tile_id]
+        return {'resource': resource_name, 'variant': variant}
+
+    def __setitem__(self, pos, tile):
+        x, y = pos
+        if not self._inside(x, y):
+            self._grow(x, y)
+        tile_id = self.tile_id(tile['resource'], tile['variant'])
+        if self.ids[x - self.x0, y - self.y0] == 0:
+            self.count += 1
+        self.ids[x - self.x0, y - self.y0] = tile_id
+        self.solid[x - self.x0, y - self.y0] = self.solid_lut[tile_id]
+
+    def __delitem__(self, pos):
+        if self.cell(*pos) == 0: raise KeyError(pos)
+        self.ids[pos[0] - self.x0, pos[1] - self.y0] = 0
+        self.solid[pos[0] - self.x0, pos[1] - self.y0] = False
+        self.count -= 1
+
+    def __contains__(self, pos):
+        return self.cell(*pos) != 0
+
+    def __iter__(self):
+        xs, ys = np.nonzero(self.ids)
+        return zip((xs + self.x0).tolist(), (ys + self.y0).tolist())
+
+    def __len__(self):
+        return self.count
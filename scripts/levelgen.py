@@ -0,0 +1,249 @@
+'''
+Level generator: seeded tunnel and cave grids written in the map format of the game.
+
+    python -m scripts.levelgen maps/generated.bin --size 1000 1000 --kind caves --seed 7
+
+The grids are x-major boolean arrays (solid[x, y]) built with numpy only, so big levels take
+a fraction of a second:
+    tunnels - a maze going down (like lab.py): every room opens to the room below it or to the
+              side the row leans to, so all of it is one tree joined at the bottom
+    caves   - cellular automaton caves cut into the maze, the maze keeps them connected
+The walls are autotiled with the rules of the editor (maps/create/editor.py): grass near the
+surface, stone deeper. Spawn markers of the npcs, enemies and coins are put in the grid.
+'''
+import argparse
+import json
+import numpy as np
+from scripts import mapfile
+from scripts.grid import TileGrid
+from scripts.descent import SPAWN_VARIANTS
+
+# the autotile rules of the editor: sorted neighbours of the same material -> variant
+TRANSFORM_RULES = {
+    ((1, 0),): 0,
+    ((-1, 0), (1, 0)): 1,
+    ((-1, 0),): 2,
+    ((0, -1), (0, 1), (-1, 0)): 3,
+    ((0, -1), (-1, 0)): 4,
+    ((0, -1), (-1, 0), (1, 0)): 5,
+    ((0, -1), (1, 0)): 6,
+    ((0, -1), (1, 0), (0, 1)): 7,
+    ((0, -1), (0, 1), (1, 0), (-1, 0)): 5,
+}
+NEIGHBOURS = ((-1, 0), (1, 0), (0, -1), (0, 1)) # bit n of the neighbour mask
+MATERIALS = ('grass', 'stone')
+# editor variant -> variant of the game tiles (data/resources/tiles), the game has no grass and stone images
+GAME_TILES = {
+    'grass': (2, 2, 2, 10, 63, 64, 63, 9, 64),
+    'stone': (14, 14, 14, 4, 4, 4, 4, 4, 4),
+}
+
+
+def _autotile_table():
+    '''
+    @ return variants for the 16 neighbour masks, a mask without a rule gets the rule
+    of its biggest subset like in Editor.transform, the top variant if there is none
+    '''
+    table = np.ones(16, dtype=np.uint8)
+    for mask in range(16):
+        situation = tuple(sorted(d for n, d in enumerate(NEIGHBOURS) if mask >> n & 1))
+        suits = [rule for rule in TRANSFORM_RULES if all(d in situation for d in rule)]
+        if suits:
+            table[mask] = TRANSFORM_RULES[max(suits, key=len)]
+    return table
+
+
+AUTOTILE = _autotile_table()
+
+
+def tunnels(width, height, rng, tunnel=3, wall=1, down=0.7):
+    '''
+    @ tunnel - width of the tunnels in cells
+    @ wall - thickness of the walls between them
+    @ down - chance of a room to open down, else it opens to the side of its row
+    @ return boolean grid width x height, True is solid
+    '''
+    pitch = tunnel + wall
+    cw, ch = max(1, (width - wall) // pitch), max(1, (height - wall) // pitch)
+    # rooms at the odd cells, walls at the even ones
+    maze = np.ones((2 * cw + 1, 2 * ch + 1), dtype=bool)
+    maze[1::2, 1::2] = False
+    goes_down = rng.random((cw, ch)) < down
+    right = rng.random(ch) < 0.5 # the side every row leans to
+    # the last room of a row in its side goes down, the last row goes to its side to the root
+    goes_down[-1, right] = True
+    goes_down[0, ~right] = True
+    goes_down[:, -1] = False
+    root = cw - 1 if right[-1] else 0
+    side = ~goes_down
+    side[root, -1] = False
+    maze[1::2, 2::2][goes_down] = False
+    maze[2::2, 1::2][side & right] = False
+    maze[0:-1:2, 1::2][side & ~right] = False
+    # walls and rooms are scaled to their sizes
+    rx = np.tile((wall, tunnel), cw + 1)[:2 * cw + 1]
+    ry = np.tile((wall, tunnel), ch + 1)[:2 * ch + 1]
+    grid = np.repeat(np.repeat(maze, rx, axis=0), ry, axis=1)
+    solid = np.ones((width, height), dtype=bool)
+    w, h = min(width, grid.shape[0]), min(height, grid.shape[1])
+    solid[:w, :h] = grid[:w, :h]
+    return solid
+
+
+def caves(width, height, rng, fill=0.5, steps=4):
+    '''
+    Cellular automaton: a cell becomes solid if 5 or more of its 8 neighbours are solid,
+    a solid one stays solid with 4
+    @ fill - chance of a cell to be solid at start
+    @ return boolean grid width x height, True is solid
+    '''
+    solid = rng.random((width, height)) < fill
+    for _ in range(steps):
+        padded = np.pad(solid, 1, constant_values=True).astype(np.uint8)
+        count = np.zeros((width, height), dtype=np.uint8)
+        for dx in range(3):
+            for dy in range(3):
+                if dx == 1 and dy == 1: continue
+                count += padded[dx:dx + width, dy:dy + height]
+        solid = (count >= 5) | solid & (count == 4)
+    return solid
+
+
+def autotile(solid, material):
+    '''
+    @ material - int grid of the material index of every cell
+    @ return uint8 grid of the editor variants, meaningless at the empty cells
+    '''
+    # outside of the level is the same material, the borders are tiled as the inside
+    same = np.pad(solid, 1, mode='edge')
+    kind = np.pad(material, 1, mode='edge')
+    w, h = solid.shape
+    mask = np.zeros(solid.shape, dtype=np.uint8)
+    for n, (dx, dy) in enumerate(NEIGHBOURS):
+        neighbour = same[1 + dx:1 + dx + w, 1 + dy:1 + dy + h] & (kind[1 + dx:1 + dx + w, 1 + dy:1 + dy + h] == material)
+        mask |= neighbour.astype(np.uint8) << n
+    return AUTOTILE[mask]
+
+
+def floors(solid):
+    '''
+    @ return xs, ys - int arrays of the cells one can stand in: the cell and the one above it are empty,
+    the one below it is solid
+    '''
+    floor = np.zeros(solid.shape, dtype=bool)
+    floor[:, 1:-1] = ~solid[:, :-2] & ~solid[:, 1:-1] & solid[:, 2:]
+    return np.nonzero(floor)
+
+
+def spawns(solid, rng, start, npcs=2, enemies=0, coins=0, safe_distance=12):
+    '''
+    The npcs stand on the floors closest to the start, the enemies on the floors
+    farther than safe_distance from it, the coins hang anywhere in the tunnels
+    @ return [(resource, variant, x, y),]
+    '''
+    markers = []
+    fx, fy = floors(solid)
+    distance = np.abs(fx - start[0]) + np.abs(fy - start[1])
+    for n in np.argsort(distance, kind='stable')[:npcs].tolist():
+        markers.append(('npc', int(rng.integers(SPAWN_VARIANTS['npc'])), int(fx[n]), int(fy[n])))
+    far = np.nonzero(distance > safe_distance)[0]
+    for n in rng.choice(far, size=min(len(far), enemies), replace=False).tolist():
+        markers.append(('entities', int(rng.integers(SPAWN_VARIANTS['entities'])), int(fx[n]), int(fy[n])))
+    ex, ey = np.nonzero(~solid)
+    for n in rng.choice(len(ex), size=min(len(ex), coins), replace=False).tolist():
+        markers.append(('coins', int(rng.integers(SPAWN_VARIANTS['coins'])), int(ex[n]), int(ey[n])))
+    return markers
+
+
+def generate(width, height, seed=None, kind='tunnels', tunnel=3, wall=1, down=0.7, grass_depth=8,
+             npcs=2, enemies=None, coins=None, editor=False):
+    '''
+    @ kind - 'tunnels' or 'caves'
+    @ grass_depth - rows of grass under the top, stone below them
+    @ enemies, coins - how many, about one per 2000 and per 1000 cells by default
+    @ editor - the tiles are the grass and stone of the editor instead of the game tiles
+    @ return dict with ids (uint16 grid width x height, x-major), palette ([None, (resource, variant),]),
+    solid and start (the cell the player starts in)
+    '''
+    rng = np.random.default_rng(seed)
+    if kind == 'tunnels':
+        solid = tunnels(width, height, rng, tunnel, wall, down)
+    elif kind == 'caves':
+        # a sparse maze through the caves, so every cave it touches is reachable
+        solid = tunnels(width, height, rng, tunnel, max(wall, 2 * tunnel), down) & caves(width, height, rng)
+    else:
+        raise ValueError(f'unknown level kind {kind}')
+    # the frame keeps everything inside
+    solid[[0, -1], :] = True
+    solid[:, [0, -1]] = True
+    # the player starts in the top empty row nearest to the middle
+    rows = np.nonzero((~solid).any(axis=0))[0]
+    y = int(rows[0]) if len(rows) else 1
+    top = np.nonzero(~solid[:, y])[0]
+    start = (int(top[np.argmin(np.abs(top - width // 2))]) if len(top) else width // 2, y)
+    solid[start] = False
+
+    material = (np.arange(height) >= grass_depth).astype(np.uint8)[None, :].repeat(width, axis=0)
+    variant = autotile(solid, material)
+    palette = [None]
+    tile_ids = {}
+    def tile_id(key):
+        if key not in tile_ids:
+            tile_ids[key] = len(palette)
+            palette.append(key)
+        return tile_ids[key]
+
+    # (material, variant) -> tile id, the game tiles of some variants are the same
+    lut = np.zeros((len(MATERIALS), 9), dtype=np.uint16)
+    for m, name in enumerate(MATERIALS):
+        for v in range(9):
+            lut[m, v] = tile_id((name, v) if editor else ('tiles', GAME_TILES[name][v]))
+    ids = np.where(solid, lut[material, variant], 0).astype(np.uint16)
+    cells = width * height
+    markers = spawns(solid, rng, start, npcs, cells // 2000 if enemies is None else enemies, cells // 1000 if coins is None else coins)
+    for resource_name, v, x, y in markers:
+        ids[x, y] = tile_id((resource_name, v))
+    return {'ids': ids, 'palette': palette, 'solid': solid, 'start': start}
+
+
+def save(path, level, base_tile_size=48, tile_size=72, nogrid_tiles=(), meta=None):
+    '''
+    Writes the level as a binary map (.bin) or a json map, the camera is at the start
+    @ level - dict like the one of generate, x0 and y0 of the ids are 0 if it has none
+    @ meta - json serializable dict kept in the map
+    '''
+    x0, y0 = level.get('x0', 0), level.get('y0', 0)
+    camera_x, camera_y = (level['start'][0] + x0) * tile_size, (level['start'][1] + y0) * tile_size
+    if path.endswith('.bin'):
+        grid = TileGrid.from_arrays(level['ids'], level['palette'], x0, y0)
+        mapfile.save(path, grid, list(nogrid_tiles), base_tile_size, tile_size, camera_x, camera_y, meta)
+        return
+    palette = level['palette']
+    xs, ys = np.nonzero(level['ids'])
+    tile_map = {
+        f'({x + x0}, {y + y0})': {'resource': palette[tile][0], 'variant': palette[tile][1]}
+        for x, y, tile in zip(xs.tolist(), ys.tolist(), level['ids'][xs, ys].tolist())
+    }
+    data = {
+        'tile_map': tile_map, 'nogrid_tiles': list(nogrid_tiles), 'base_tile_size': base_tile_size,
+        'tile_size': tile_size, 'camera_x': camera_x, 'camera_y': camera_y
+    }
+    if meta:
+        data['meta'] = meta
+    with open(path, 'w') as f:
+        json.dump(data, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generates a level')
+    parser.add_argument('path', help='.bin or .json map')
+    parser.add_argument('--size', type=int, nargs=2, default=(200, 200), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--kind', choices=('tunnels', 'caves'), default='tunnels')
+    parser.add_argument('--tunnel', type=int, default=3)
+    parser.add_argument('--enemies', type=int)
+    parser.add_argument('--coins', type=int)
+    parser.add_argument('--editor', action='store_true', help='grass and stone tiles of the editor')
+    args = parser.parse_args()
+    level = generate(*args.size, seed=args.seed, kind=args.kind, tunnel=args.tunnel, enemies=args.enemies, coins=args.coins, editor=args.editor)
+    save(args.path, level)
@@ -0,0 +1,157 @@
+import pygame
+import numpy as np
+from collections import OrderedDict
+from scripts import events
+
+
+# light levels of the sources, a level is how many cells the light goes
+MAX_LEVEL = 8
+PLAYER_LEVEL = 8
+PORTAL_LEVEL = 7
+FIRE_LEVEL = 5
+COIN_LEVEL = 3
+
+
+def propagate(levels, solid, steps):
+    '''
+    Flood fill of the light over the grid: every step a cell gets the level of its brightest neighbour
+    minus one. Solid cells are lit, but they do not pass the light on
+    @ levels - int grid of the source levels, it is changed in place
+    @ solid - boolean grid of the same shape
+    @ steps - the highest level of the sources
+    @ return levels
+    '''
+    spread = np.empty_like(levels)
+    for _ in range(steps):
+        passing = np.where(solid, 0, levels)
+        spread.fill(0)
+        spread[1:] = passing[:-1]
+        np.maximum(spread[:-1], passing[1:], out=spread[:-1])
+        np.maximum(spread[:, 1:], passing[:, :-1], out=spread[:, 1:])
+        np.maximum(spread[:, :-1], passing[:, 1:], out=spread[:, :-1])
+        np.maximum(levels, spread - 1, out=levels)
+    return levels
+
+
+class LightMap:
+    '''
+    Light of a map on its tile grid. The light of the static sources (coins, portals) is filled
+    once per region and cached until the sources or the tiles of the region change, the dynamic
+    sources (the player, fireballs, explosions) are filled every frame on the visible cells only.
+    The light is drawn as a darkness layer with one pixel per cell, scaled to the screen.
+    '''
+    REGION_SIZE = 16
+    MAX_REGIONS = 128
+
+    def __init__(self, map):
+        self.map = map
+        self.tile_size = map.tile_size
+        self.static = set() # {(i, j, level),}
+        self.sources = {} # (rx, ry) -> [(i, j, level),] static sources of the region
+        self.regions = OrderedDict() # (rx, ry) -> int grid of the static light or None if it is dark
+        self.layers = {} # shape in cells -> (screen layer, smoothed layer)
+        map.events.subscribe(self._on_changes, kinds=events.TILE_EVENTS)
+
+    def _on_changes(self, changes):
+        for event in changes:
+            self.invalidate(*event.area)
+
+    def invalidate(self, i_start, j_start, i_end, j_end):
+        '''
+        Drops the static light of the regions which the light through the cells can reach
+        '''
+        size = self.REGION_SIZE
+        for rx in range((i_start - MAX_LEVEL) // size, (i_end + MAX_LEVEL) // size + 1):
+            for ry in range((j_start - MAX_LEVEL) // size, (j_end + MAX_LEVEL) // size + 1):
+                self.regions.pop((rx, ry), None)
+
+    def set_static(self, sources):
+        '''
+        @ sources - [(x, y, level),] static sources in map coords
+        @ return True if they changed
+        '''
+        ts = self.tile_size
+        static = {(int(x // ts), int(y // ts), level) for x, y, level in sources}
+        if static == self.static: return False
+        for i, j, _ in static ^ self.static:
+            self.invalidate(i, j, i, j)
+        self.static = static
+        size = self.REGION_SIZE
+        self.sources = {}
+        for i, j, level in static:
+            self.sources.setdefault((i // size, j // size), []).append((i, j, level))
+        return True
+
+    def _fill(self, i_start, j_start, i_end, j_end, sources):
+        '''
+        @ return int grid of the light of the sources in the cells [i_start, i_end] x [j_start, j_end]
+        '''
+        m = MAX_LEVEL
+        levels = np.zeros((i_end - i_start + 1 + 2 * m, j_end - j_start + 1 + 2 * m), dtype=np.int16)
+        steps = 0
+        for i, j, level in sources:
+            x, y = i - i_start + m, j - j_start + m
+            if 0 <= x < levels.shape[0] and 0 <= y < levels.shape[1] and level > levels[x, y]:
+                levels[x, y] = level
+                steps = max(steps, level)
+        if steps == 0: return None
+        solid = self.map._solid_window(i_start - m, j_start - m, i_end + m, j_end + m)
+        return propagate(levels, solid, steps)[m:-m, m:-m]
+
+    def _region(self, rx, ry):
+        key = (rx, ry)
+        if key in self.regions:
+            self.regions.move_to_end(key)
+            return self.regions[key]
+        size = self.REGION_SIZE
+        sources = [s for dx in (-1, 0, 1) for dy in (-1, 0, 1) for s in self.sources.get((rx + dx, ry + dy), ())]
+        levels = self._fill(rx * size, ry * size, rx * size + size - 1, ry * size + size - 1, sources)
+        self.regions[key] = levels
+        if len(self.regions) > self.MAX_REGIONS:
+            self.regions.popitem(last=False)
+        return levels
+
+    def levels(self, i_start, j_start, i_end, j_end, dynamic=()):
+        '''
+        @ dynamic - [(x, y, level),] dynamic sources in map coords
+        @ return int grid of the light in the cells [i_start, i_end] x [j_start, j_end]
+        '''
+        size = self.REGION_SIZE
+        levels = np.zeros((i_end - i_start + 1, j_end - j_start + 1), dtype=np.int16)
+        for rx in range(i_start // size, i_end // size + 1):
+            for ry in range(j_start // size, j_end // size + 1):
+                region = self._region(rx, ry)
+                if region is None: continue
+                x0, y0 = max(i_start, rx * size), max(j_start, ry * size)
+                x1, y1 = min(i_end, rx * size + size - 1), min(j_end, ry * size + size - 1)
+                levels[x0 - i_start:x1 - i_start + 1, y0 - j_start:y1 - j_start + 1] = \
+                    region[x0 - rx * size:x1 - rx * size + 1, y0 - ry * size:y1 - ry * size + 1]
+        ts = self.tile_size
+        light = self._fill(i_start, j_start, i_end, j_end, [(int(x // ts), int(y // ts), level) for x, y, level in dynamic])
+        if light is not None:
+            np.maximum(levels, light, out=levels)
+        return levels
+
+    def render(self, surf, camera, darkness, dynamic=()):
+        '''
+        Darkens surf everywhere but in the light
+        @ darkness - alpha of the unlit cells
+        @ dynamic - [(x, y, level),] dynamic sources in map coords
+        '''
+        ts = self.tile_size
+        i_start, j_start = int(camera[0] // ts), int(camera[1] // ts)
+        i_end, j_end = int((camera[0] + surf.get_width()) // ts), int((camera[1] + surf.get_height()) // ts)
+        levels = self.levels(i_start, j_start, i_end, j_end, dynamic)
+        layer = pygame.Surface(levels.shape, pygame.SRCALPHA)
+        layer.fill((0, 0, 0, 0))
+        alpha = pygame.surfarray.pixels_alpha(layer)
+        alpha[:] = int(darkness) * (MAX_LEVEL - np.minimum(levels, MAX_LEVEL)) // MAX_LEVEL
+        del alpha
+        # smooth at a quarter of the screen resolution, then a cheap scale up
+        w, h = levels.shape
+        if levels.shape not in self.layers:
+            self.layers = {levels.shape: (pygame.Surface((w * ts, h * ts), pygame.SRCALPHA), pygame.Surface((w * ts // 4, h * ts // 4), pygame.SRCALPHA))}
+        big, smooth = self.layers[levels.shape]
+        pygame.transform.smoothscale(layer, smooth.get_size(), smooth)
+        pygame.transform.scale(smooth, big.get_size(), big)
+        surf.blit(big, (i_start * ts - camera[0], j_start * ts - camera[1]))
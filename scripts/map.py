@@ -1,15 +1,57 @@
 import pygame
 import json
+import os
 from scripts import utils
 from scripts import consts
+from scripts import mapfile
+from scripts.grid import TileGrid
+from scripts.streaming import StreamingTileMap
+from scripts.descent import DescentTileMap
+from scripts.spatial import SpatialHash
+from scripts.colliders import SolidColliders
+from scripts.columns import ColumnIndex
+from scripts.navigation import Navigation
+from scripts import events
+from collections import OrderedDict
+import numpy as np
 import random
+from types import MappingProxyType
 
 class Map:
-    def __init__(self, tile_size=None):
+    CHUNK_SIZE = 6 # chunk side in tiles
+    MAX_CHUNKS = 64 # baked chunks kept in memory
+    OFFGRID_CELL_SIZE = 4 # spatial hash cell side for the off-grid tiles in tiles
+    SPAWN_RESOURCES = ('npc', 'entities', 'coins') # marker tiles, moved to the spawn table at load
+
+    def __init__(self, tile_size=None, grid=False, path='maps/map.json', descent_seed=None):
+        '''
+        @ grid - if True then tile_map is stored as a dense TileGrid (fast solidity queries)
+        @ path - json map, binary map (.bin, see scripts/mapfile.py) or a world directory (see scripts/streaming.py).
+        Worlds are always dense and their regions are loaded around the camera in update
+        @ descent_seed - if not None then the world goes down forever with regions generated from the seed (see scripts/descent.py)
+        '''
         self.tile_size = tile_size
-        self.load_map('maps/map.json')
+        self.descent_seed = descent_seed
+        self.load_map(path)
         self.k = self.tile_size / self.base_tile_size
         self.resources, self.resource_props = utils.load_resources('data/resources', self.k, (255, 255, 255))
+        self.dense = grid
+        self.streaming = isinstance(self.tile_map, StreamingTileMap)
+        if self.streaming:
+            self.dense = True
+            self.tile_map.set_resource_props(self.resource_props)
+        elif isinstance(self.tile_map, TileGrid):
+            self.tile_map.set_resource_props(self.resource_props)
+            if not self.dense:
+                self.tile_map = dict(self.tile_map.items())
+        elif self.dense:
+            self.tile_map = TileGrid.from_tiles(self.tile_map, self.resource_props)
+        self._build_index()
+        self.columns = self._build_columns()
+        # runtime changes over the loaded map: pos -> tile before the first change (None - empty cell)
+        self.changes = {}
+        self.offgrid_changes = {} # id(tile) -> (tile, True if the tile was on the loaded map)
+        self.start_camera = (self.camera_x, self.camera_y)
         # screen shaking
         self.screen_start_shaking = 0
         self.screen_shaking = 0
@@ -18,11 +60,116 @@ class Map:
 
         # background
         self.background_tile = utils.load_image('data/resources/tiles/tile16.png', self.k)
+        self.background_color = (20,) * 3
+
+        # render cache: (cx, cy) -> baked surface or None for empty chunks
+        self.chunks = OrderedDict()
+        # collision cache: solid tiles merged into bigger rects
+        self.colliders = SolidColliders(self._solid_window, self.tile_size)
+        # platform graph and path cache for the ai
+        self.navigation = Navigation(self._solid_window, self.columns, self.tile_size)
+        max_img_size = max(max(img.get_size()) for imgs in self.resources.values() for img in imgs)
+        self.tile_overflow = -(-max_img_size // self.tile_size) - 1 # how many tiles the biggest image covers beyond its own
+        self.offgrid_margin = (max_img_size / self.k,) * 2 # the biggest image in the units of the off-grid positions
+
+        # every change of the map goes through the bus, the caches of the map are its first subscribers
+        self.events = events.EventBus()
+        self.events.subscribe(self._on_render_changes)
+        self.events.subscribe(self._on_solid_changes, kinds=events.TILE_EVENTS)
 
     def shake_screen(self, delay=30, intensity=1):
         self.screen_start_shaking = self.screen_shaking = delay
         self.shake_intensity = intensity
 
+    def _grouped_tiles(self):
+        '''
+        @ return {(resource, variant): [(x, y),]} of all the tiles in one pass
+        '''
+        groups = {}
+        if self.streaming:
+            # only the markers: the regions are not loaded yet
+            for pos, key in self.tile_map.markers.items():
+                groups.setdefault(key, []).append(pos)
+        elif self.dense:
+            xs, ys = np.nonzero(self.tile_map.ids)
+            ids = self.tile_map.ids[xs, ys]
+            order = np.argsort(ids, kind='stable')
+            ids, xs, ys = ids[order], (xs[order] + self.tile_map.x0).tolist(), (ys[order] + self.tile_map.y0).tolist()
+            bounds = np.flatnonzero(np.diff(ids)) + 1
+            for start, end in zip([0] + bounds.tolist(), bounds.tolist() + [len(ids)]):
+                groups[self.tile_map.palette[ids[start]]] = list(zip(xs[start:end], ys[start:end]))
+        else:
+            for pos, tile in self.tile_map.items():
+                groups.setdefault((tile['resource'], tile['variant']), []).append(pos)
+        return groups
+
+    def _build_index(self):
+        '''
+        Moves the spawn markers from the map to the spawn table and indexes the other tiles by (resource, variant)
+        '''
+        spawns = {}
+        self.tile_index = {} # (resource, variant) -> {(x, y): None}, in the order of the tiles
+        for key, positions in self._grouped_tiles().items():
+            if key[0] in self.SPAWN_RESOURCES:
+                spawns[key] = tuple(positions)
+                for pos in positions:
+                    del self.tile_map[pos]
+            else:
+                self.tile_index[key] = dict.fromkeys(positions)
+        offgrid_spawns = {}
+        for tile in list(self.offgrid_tiles):
+            if tile['resource'] in self.SPAWN_RESOURCES:
+                offgrid_spawns.setdefault((tile['resource'], tile['variant']), []).append(tuple(tile['pos']))
+                self.offgrid_tiles.remove(tile)
+        # read only
+        self.spawns = MappingProxyType(spawns)
+        self.offgrid_spawns = MappingProxyType({key: tuple(positions) for key, positions in offgrid_spawns.items()})
+
+    def _build_columns(self):
+        '''
+        @ return ColumnIndex of the solid cells
+        '''
+        if self.streaming:
+            # regions which are not loaded are solid
+            columns = ColumnIndex()
+            rs = self.tile_map.region_size
+            for rx, ry in self.tile_map.known:
+                columns.update_block(rx * rs, ry * rs, np.ones((rs, rs), dtype=bool))
+            return columns
+        if self.dense:
+            return ColumnIndex.from_solid(self.tile_map.solid, self.tile_map.x0, self.tile_map.y0)
+        if not self.tile_map:
+            return ColumnIndex()
+        x0 = min(x for x, _ in self.tile_map)
+        y0 = min(y for _, y in self.tile_map)
+        x1 = max(x for x, _ in self.tile_map)
+        y1 = max(y for _, y in self.tile_map)
+        return ColumnIndex.from_solid(self._solid_window(x0, y0, x1, y1), x0, y0)
+
+    def get_spawns(self, resource_name, variant, absolute=True):
+        '''
+        @ absolute - if True then returns absolute coords. Otherwise it returns relative (grid coords)
+        @ return [pos,] of the spawn markers
+        '''
+        positions = self.spawns.get((resource_name, variant), ())
+        if absolute:
+            return [(x * self.tile_size, y * self.tile_size) for x, y in positions]
+        return list(positions)
+
+    def take_spawns(self):
+        '''
+        @ return [(resource, variant, pos),] spawn markers of the regions loaded since the last call
+        (generated regions have them), pos is in absolute coords
+        '''
+        if not self.streaming: return []
+        return [(resource_name, variant, (x * self.tile_size, y * self.tile_size)) for resource_name, variant, x, y in self.tile_map.take_spawns()]
+
+    def get_offgrid_spawns(self, resource_name, variant):
+        '''
+        @ return [pos,] of the off-grid spawn markers, in the base tile pixels like the off-grid tiles
+        '''
+        return list(self.offgrid_spawns.get((resource_name, variant), ()))
+
     def get_offgrid_tiles(self, resource_name, variant, keep=False):
         '''
         @ return [(pos, tile),]
@@ -34,7 +181,7 @@ class Map:
                 results.append((pos, tile))
         if not keep:
             for _, tile in results:
-                self.offgrid_tiles.remove(tile)
+                self.remove_offgrid_tile(tile)
         return results
 
     def get_tiles(self, resource_name, variant, absolute=True,keep=False):
@@ -43,22 +190,127 @@ class Map:
         @ return [(pos, tile),]
         '''
         results = []
-        for pos, tile in self.tile_map.items():
-            if tile['resource'] == resource_name and tile['variant'] == variant:
-                if absolute:
-                    pos = (pos[0] * self.tile_size, pos[1] * self.tile_size)
-                results.append((pos, tile))
+        if self.streaming:
+            # the loaded regions change all the time, they are scanned instead
+            positions = self.tile_map.positions(resource_name, variant)
+        else:
+            positions = list(self.tile_index.get((resource_name, variant), ()))
+        for pos in positions:
+            tile = {'resource': resource_name, 'variant': variant}
+            if absolute:
+                pos = (pos[0] * self.tile_size, pos[1] * self.tile_size)
+            results.append((pos, tile))
         if not keep:
             for pos, tile in results:
                 if absolute:
                     pos = (pos[0] // self.tile_size, pos[1] // self.tile_size)
-                del self.tile_map[pos]
+                self.remove_tile(pos)
         return results
 
+    def _unindex(self, pos):
+        if pos in self.tile_map:
+            tile = self.tile_map[pos]
+            self.tile_index.get((tile['resource'], tile['variant']), {}).pop(pos, None)
+
+    def _put_tile(self, pos, tile):
+        '''
+        @ tile - None removes the tile
+        '''
+        self._unindex(pos)
+        if tile is None:
+            self.tile_map.pop(pos, None)
+        else:
+            self.tile_map[pos] = tile
+            self.tile_index.setdefault((tile['resource'], tile['variant']), {})[pos] = None
+        self.events.emit(events.TILE_REMOVED if tile is None else events.TILE_SET, (*pos, *pos), tile)
+
+    def _record_tile(self, pos):
+        if pos not in self.changes:
+            self.changes[pos] = self.tile_map[pos] if pos in self.tile_map else None
+
+    def set_tile(self, pos, tile):
+        self._record_tile(pos)
+        self._put_tile(pos, tile)
+
+    def remove_tile(self, pos):
+        self._record_tile(pos)
+        self._put_tile(pos, None)
+
+    def _put_offgrid_tile(self, tile, present):
+        if present:
+            self.offgrid_tiles.append(tile)
+            if self.streaming:
+                self.tile_map.add_offgrid(tile)
+        else:
+            self.offgrid_tiles.remove(tile)
+            if self.streaming:
+                self.tile_map.remove_offgrid(tile)
+        self.events.emit(events.OFFGRID_ADDED if present else events.OFFGRID_REMOVED, self._offgrid_tile_area(tile), tile)
+
+    def _record_offgrid_tile(self, tile, present):
+        if id(tile) in self.offgrid_changes:
+            # back to the loaded state
+            del self.offgrid_changes[id(tile)]
+        else:
+            self.offgrid_changes[id(tile)] = (tile, not present)
+
+    def add_offgrid_tile(self, tile):
+        self._record_offgrid_tile(tile, True)
+        self._put_offgrid_tile(tile, True)
+
+    def remove_offgrid_tile(self, tile):
+        self._record_offgrid_tile(tile, False)
+        self._put_offgrid_tile(tile, False)
+
+    def reset(self):
+        '''
+        Drops the runtime changes: the map is as it was loaded. O(number of changes), the render cache
+        is kept for the unchanged chunks
+        '''
+        for pos, tile in self.changes.items():
+            self._put_tile(pos, tile)
+        for tile, present in self.offgrid_changes.values():
+            if present != (tile in self.offgrid_tiles):
+                self._put_offgrid_tile(tile, present)
+        self.changes = {}
+        self.offgrid_changes = {}
+        self.camera_x, self.camera_y = self.start_camera
+        self.screen_start_shaking = self.screen_shaking = 0
+        self.screen_offset = [0, 0]
+        if self.streaming:
+            self.tile_map.forget_spawns()
+
+    def snapshot(self):
+        '''
+        @ return the runtime changes and the camera, for restore. O(number of changes)
+        '''
+        tiles = {pos: self.tile_map[pos] if pos in self.tile_map else None for pos in self.changes}
+        offgrid = [(tile, tile in self.offgrid_tiles) for tile, _ in self.offgrid_changes.values()]
+        return tiles, offgrid, (self.camera_x, self.camera_y)
+
+    def restore(self, snapshot):
+        tiles, offgrid, camera = snapshot
+        self.reset()
+        for pos, tile in tiles.items():
+            if tile is not None:
+                self.set_tile(pos, tile)
+            elif pos in self.tile_map:
+                self.remove_tile(pos)
+        for tile, present in offgrid:
+            if present == (tile in self.offgrid_tiles):
+                continue
+            if present:
+                self.add_offgrid_tile(tile)
+            else:
+                self.remove_offgrid_tile(tile)
+        self.camera_x, self.camera_y = camera
+
 
     def issolid(self, x, y):
         tx = x // self.tile_size
         ty = y // self.tile_size
+        if self.dense:
+            return self.tile_map.issolid_cell(tx, ty)
         if (tx, ty) not in self.tile_map: return False
         tile = self.tile_map[(tx, ty)]
         resource_name = tile['resource']
@@ -72,6 +324,15 @@ class Map:
         i_end = rect.right // self.tile_size
         j_start = rect.top // self.tile_size
         j_end = rect.bottom // self.tile_size
+        if self.dense:
+            # windows are a few cells big, plain lists are faster than numpy calls here
+            for i, column in enumerate(self.tile_map.solid_window(i_start, j_start, i_end, j_end).tolist(), i_start):
+                for j, solid in enumerate(column, j_start):
+                    if solid:
+                        tile_rect = pygame.Rect(i * self.tile_size, j * self.tile_size, self.tile_size, self.tile_size)
+                        if tile_rect.colliderect(rect):
+                            intersections.append(tile_rect)
+            return intersections
         for i in range(i_start, i_end + 1):
             for j in range(j_start, j_end + 1):
                 if self.issolid(i * self.tile_size, j * self.tile_size):
@@ -82,44 +343,312 @@ class Map:
                         intersections.append(tile_rect)
         return intersections
 
+    def _rect_boxes(self, rects):
+        return np.array([(rect.left, rect.top, rect.right, rect.bottom) for rect in rects], dtype=np.int64).reshape(-1, 4)
+
+    def collide_solid_batch(self, rects):
+        '''
+        @ rects - [pygame.Rect,]
+        @ return [bool,] - True for every rect which intersects a solid tile. No tile rects are made.
+        '''
+        if not self.dense or not rects:
+            return [bool(self.get_solid_intersections(rect)) for rect in rects]
+        hits, _, _ = self.tile_map.solid_hits(self._rect_boxes(rects), self.tile_size)
+        return hits.any(axis=(1, 2)).tolist()
+
+    def _solid_window(self, i_start, j_start, i_end, j_end):
+        if self.dense:
+            return self.tile_map.solid_window(i_start, j_start, i_end, j_end)
+        return np.array([
+            [self.issolid(i * self.tile_size, j * self.tile_size) for j in range(j_start, j_end + 1)]
+            for i in range(i_start, i_end + 1)
+        ], dtype=bool)
+
+    def get_solid_colliders(self, rect):
+        '''
+        @ return [pygame.Rect,] - merged solid rects which intersect rect. Every solid tile which
+        intersects rect is covered by one of them, but they can be bigger than the tiles
+        '''
+        return self.colliders.query(rect)
+
+    def _issolid_cell(self):
+        if self.dense:
+            return self.tile_map.issolid_cell
+        return lambda i, j: self.issolid(i * self.tile_size, j * self.tile_size)
+
+    def raycast(self, origin, direction, max_dist):
+        '''
+        Walks the grid cells along the ray (DDA)
+        @ origin - (x, y) in pixels
+        @ direction - (dx, dy), does not have to be normalized
+        @ max_dist - in pixels
+        @ return (distance, (i, j), normal) of the first solid cell on the ray or None.
+        normal is the side of the cell which was hit, (0, 0) if the origin is inside a solid cell
+        '''
+        dx, dy = direction
+        length = (dx * dx + dy * dy) ** .5
+        if length == 0: return None
+        dx, dy = dx / length, dy / length
+        ts = self.tile_size
+        issolid = self._issolid_cell()
+        x, y = origin
+        i, j = int(x // ts), int(y // ts)
+        if issolid(i, j): return 0, (i, j), (0, 0)
+        inf = float('inf')
+        step_i = 1 if dx > 0 else -1
+        step_j = 1 if dy > 0 else -1
+        # distance along the ray to the next vertical and horizontal cell borders
+        t_max_x = ((i + (dx > 0)) * ts - x) / dx if dx else inf
+        t_max_y = ((j + (dy > 0)) * ts - y) / dy if dy else inf
+        t_delta_x = ts / abs(dx) if dx else inf
+        t_delta_y = ts / abs(dy) if dy else inf
+        while True:
+            if t_max_x < t_max_y:
+                t = t_max_x
+                i += step_i
+                t_max_x += t_delta_x
+                normal = (-step_i, 0)
+            else:
+                t = t_max_y
+                j += step_j
+                t_max_y += t_delta_y
+                normal = (0, -step_j)
+            if t > max_dist: return None
+            if issolid(i, j): return t, (i, j), normal
+
+    def sweep(self, rect, velocity):
+        '''
+        Moves rect by velocity and finds the first solid tile on the way (swept AABB)
+        @ return (t, (i, j), normal) or None - t in [0, 1) is the part of velocity made before the hit,
+        normal is the side of the tile which was hit, (0, 0) if rect already intersects it
+        '''
+        vx, vy = velocity
+        ts = self.tile_size
+        left, top, right, bottom = rect.left, rect.top, rect.right, rect.bottom
+        i_start = int(min(left, left + vx) // ts)
+        j_start = int(min(top, top + vy) // ts)
+        i_end = int(max(right, right + vx) // ts)
+        j_end = int(max(bottom, bottom + vy) // ts)
+        inf = float('inf')
+        best = None
+        for i, column in enumerate(self._solid_window(i_start, j_start, i_end, j_end).tolist(), i_start):
+            # time span of the overlap along x, the same test as colliderect
+            if vx > 0: tx0, tx1 = (i * ts - right) / vx, ((i + 1) * ts - left) / vx
+            elif vx < 0: tx0, tx1 = ((i + 1) * ts - left) / vx, (i * ts - right) / vx
+            elif left < (i + 1) * ts and right > i * ts: tx0, tx1 = -inf, inf
+            else: continue
+            for j, solid in enumerate(column, j_start):
+                if not solid: continue
+                if vy > 0: ty0, ty1 = (j * ts - bottom) / vy, ((j + 1) * ts - top) / vy
+                elif vy < 0: ty0, ty1 = ((j + 1) * ts - top) / vy, (j * ts - bottom) / vy
+                elif top < (j + 1) * ts and bottom > j * ts: ty0, ty1 = -inf, inf
+                else: continue
+                t0, t1 = max(tx0, ty0), min(tx1, ty1)
+                if t0 >= t1 or t0 >= 1 or t1 <= 0: continue
+                if t0 < 0:
+                    hit = (0, (i, j), (0, 0))
+                elif tx0 > ty0:
+                    hit = (t0, (i, j), (-1 if vx > 0 else 1, 0))
+                else:
+                    hit = (t0, (i, j), (0, -1 if vy > 0 else 1))
+                if best is None or hit[0] < best[0]:
+                    best = hit
+        return best
+
+    def collide_solid_moved(self, old_rects, rects):
+        '''
+        @ return [bool,] - True for every rect which intersects a solid tile or passed through one
+        on the way from its old rect (fast projectiles do not tunnel through thin walls)
+        '''
+        hits = self.collide_solid_batch(rects)
+        for n, (old, rect) in enumerate(zip(old_rects, rects)):
+            if not hits[n] and old is not None:
+                hits[n] = self.sweep(old, (rect.x - old.x, rect.y - old.y)) is not None
+        return hits
+
 
     def load_map(self, path):
+        if os.path.isdir(path):
+            self._load_world(path)
+            return
+        if path.endswith('.bin'):
+            self._load_binary_map(path)
+            return
         with open(path, 'r') as f:
             data = json.load(f)
             self.tile_map = {
                 tuple(map(int, k[1:-1].split(','))): v
                 for k, v in data['tile_map'].items()
             }
-            self.offgrid_tiles = data['nogrid_tiles']
             self.base_tile_size = data['base_tile_size']
+            # off-grid positions are in pixels of the base tile size
+            self.offgrid_tiles = SpatialHash(self.OFFGRID_CELL_SIZE * self.base_tile_size, data['nogrid_tiles'])
             self.tile_size = data['tile_size']
             self.k = self.tile_size / self.base_tile_size
             self.camera_x = data['camera_x'] #// self.k_last * self.k  # * self.tile_size
             self.camera_y = data['camera_y'] #// self.k_last * self.k # * self.tile_size
+            self.meta = data.get('meta', {})
+
+    def _load_binary_map(self, path):
+        data = mapfile.load(path)
+        # the tile ids are used as they are, solidity is added when the resources are loaded
+        self.tile_map = TileGrid.from_arrays(data['ids'], data['palette'], data['x0'], data['y0'])
+        self.base_tile_size = data['base_tile_size']
+        self.offgrid_tiles = SpatialHash(self.OFFGRID_CELL_SIZE * self.base_tile_size, data['nogrid_tiles'])
+        self.tile_size = data['tile_size']
+        self.k = self.tile_size / self.base_tile_size
+        self.camera_x = data['camera_x']
+        self.camera_y = data['camera_y']
+        self.meta = data['meta']
+
+    def _load_world(self, path):
+        self.tile_map = StreamingTileMap(path) if self.descent_seed is None else DescentTileMap(path, self.descent_seed)
+        info = self.tile_map.info
+        self.base_tile_size = info['base_tile_size']
+        # region off-grid tiles are added as their regions are loaded
+        self.offgrid_tiles = SpatialHash(self.OFFGRID_CELL_SIZE * self.base_tile_size, info['offgrid_markers'])
+        self.tile_size = info['tile_size']
+        self.k = self.tile_size / self.base_tile_size
+        self.camera_x = info['camera_x']
+        self.camera_y = info['camera_y']
+        self.meta = info.get('meta', {})
+
+    def close(self):
+        '''
+        Stops the region loader of a streamed map and gives the tile images back to the asset registry,
+        call it when the map is dropped
+        '''
+        if self.streaming:
+            self.tile_map.close()
+        utils.release_resources('data/resources', self.k, (255, 255, 255))
+
+    def _stream_regions(self):
+        i_start = int(self.camera_x // self.tile_size)
+        j_start = int(self.camera_y // self.tile_size)
+        i_end = int((self.camera_x + consts.window_size[0]) // self.tile_size)
+        j_end = int((self.camera_y + consts.window_size[1]) // self.tile_size)
+        loaded, evicted = self.tile_map.update(i_start, j_start, i_end, j_end)
+        rs = self.tile_map.region_size
+        for key, offgrid in evicted:
+            for tile in offgrid:
+                if tile in self.offgrid_tiles:
+                    self.offgrid_tiles.remove(tile)
+            self.events.emit(events.REGION_EVICTED, (key[0] * rs, key[1] * rs, key[0] * rs + rs - 1, key[1] * rs + rs - 1))
+        for key, offgrid in loaded:
+            for tile in offgrid:
+                if tile not in self.offgrid_tiles:
+                    self.offgrid_tiles.append(tile)
+            self.events.emit(events.REGION_LOADED, (key[0] * rs, key[1] * rs, key[0] * rs + rs - 1, key[1] * rs + rs - 1))
 
     def _render_background(self, surf):
-        surf.fill((20,) * 3)
-
-    def render(self, surf):   
-        self._render_background(surf) 
-        i_start = int(self.camera_x // self.tile_size) - 1
-        i_end = int((self.camera_x + surf.get_width()) // self.tile_size) + 1
-        j_start = int(self.camera_y // self.tile_size) - 1
-        j_end = int((self.camera_y + surf.get_height()) // self.tile_size) + 1
-        for i in range(i_start, i_end + 1):
-            for j in range(j_start, j_end + 1):
+        surf.fill(self.background_color)
+
+    def _offgrid_tile_rect(self, tile):
+        img = self.resources[tile['resource']][tile['variant']]
+        return img.get_rect(topleft=(tile['pos'][0] * self.k, tile['pos'][1] * self.k))
+
+    def _invalidate_rect(self, rect):
+        chunk_px = self.CHUNK_SIZE * self.tile_size
+        for cx in range(int(rect.left // chunk_px), int((rect.right - 1) // chunk_px) + 1):
+            for cy in range(int(rect.top // chunk_px), int((rect.bottom - 1) // chunk_px) + 1):
+                self.chunks.pop((cx, cy), None)
+
+    def _offgrid_tile_area(self, tile):
+        rect = self._offgrid_tile_rect(tile)
+        return (
+            int(rect.left // self.tile_size), int(rect.top // self.tile_size),
+            int((rect.right - 1) // self.tile_size), int((rect.bottom - 1) // self.tile_size)
+        )
+
+    def invalidate_area(self, area):
+        '''
+        Drops the baked chunks of the cells, with the tiles they overflow to
+        '''
+        i_start, j_start, i_end, j_end = area
+        # images bigger than a tile spill over to the right and down
+        self._invalidate_rect(pygame.Rect(
+            i_start * self.tile_size, j_start * self.tile_size,
+            (i_end - i_start + 1 + self.tile_overflow) * self.tile_size,
+            (j_end - j_start + 1 + self.tile_overflow) * self.tile_size
+        ))
+
+    def invalidate_offgrid_tile(self, tile):
+        self._invalidate_rect(self._offgrid_tile_rect(tile))
+
+    def _on_render_changes(self, changes):
+        for event in changes:
+            if event.kind in events.OFFGRID_EVENTS:
+                self.invalidate_offgrid_tile(event.tile)
+            else:
+                self.invalidate_area(event.area)
+
+    def _on_solid_changes(self, changes):
+        for event in changes:
+            i_start, j_start, i_end, j_end = event.area
+            self.colliders.invalidate(i_start, j_start, i_end, j_end)
+            self.navigation.invalidate(i_start, j_start, i_end, j_end)
+            self.columns.update_block(i_start, j_start, self._solid_window(i_start, j_start, i_end, j_end))
+
+    def invalidate_chunks(self):
+        self.chunks = OrderedDict()
+
+    def _bake_chunk(self, cx, cy):
+        '''
+        @ return surface with the tiles and the off-grid tiles of the chunk or None if it is empty
+        '''
+        chunk_px = self.CHUNK_SIZE * self.tile_size
+        chunk_rect = pygame.Rect(cx * chunk_px, cy * chunk_px, chunk_px, chunk_px)
+        tiles = []
+        for i in range(cx * self.CHUNK_SIZE - self.tile_overflow, (cx + 1) * self.CHUNK_SIZE):
+            for j in range(cy * self.CHUNK_SIZE - self.tile_overflow, (cy + 1) * self.CHUNK_SIZE):
                 if (i, j) in self.tile_map:
                     tile = self.tile_map[(i, j)]
-                    img = self.resources[tile['resource']][tile['variant']]
-                    surf.blit(img, (i * self.tile_size - self.camera_x, j * self.tile_size - self.camera_y))
-        for tile in self.offgrid_tiles:
-            x = tile['pos'][0] * self.k - self.camera_x
-            y = tile['pos'][1] * self.k - self.camera_y
-            if 0 <= x <= surf.get_width() and 0 <= y <= surf.get_height():
-                img = self.resources[tile['resource']][tile['variant']]
-                surf.blit(img, (x, y))
+                    tiles.append((self.resources[tile['resource']][tile['variant']], (i * self.tile_size - chunk_rect.x, j * self.tile_size - chunk_rect.y)))
+        area = (chunk_rect.x / self.k, chunk_rect.y / self.k, chunk_px / self.k, chunk_px / self.k)
+        for tile in self.offgrid_tiles.query(area, self.offgrid_margin):
+            rect = self._offgrid_tile_rect(tile)
+            if rect.colliderect(chunk_rect):
+                x = tile['pos'][0] * self.k - chunk_rect.x
+                y = tile['pos'][1] * self.k - chunk_rect.y
+                tiles.append((self.resources[tile['resource']][tile['variant']], (x, y)))
+        if not tiles: return None
+        surf = pygame.Surface(chunk_rect.size).convert()
+        self._render_background(surf)
+        # the images are views of the atlas pages (see scripts/atlas.py), blitted in one call
+        surf.blits(tiles, doreturn=False)
+        return surf
+
+    def _get_chunk(self, cx, cy):
+        key = (cx, cy)
+        if key in self.chunks:
+            self.chunks.move_to_end(key)
+            return self.chunks[key]
+        surf = self._bake_chunk(cx, cy)
+        self.chunks[key] = surf
+        if len(self.chunks) > self.MAX_CHUNKS:
+            self.chunks.popitem(last=False)
+        return surf
+
+    def render(self, surf):
+        chunk_px = self.CHUNK_SIZE * self.tile_size
+        cx_start = int(self.camera_x // chunk_px)
+        cx_end = int((self.camera_x + surf.get_width()) // chunk_px)
+        cy_start = int(self.camera_y // chunk_px)
+        cy_end = int((self.camera_y + surf.get_height()) // chunk_px)
+        for cx in range(cx_start, cx_end + 1):
+            for cy in range(cy_start, cy_end + 1):
+                chunk = self._get_chunk(cx, cy)
+                pos = (cx * chunk_px - self.camera_x, cy * chunk_px - self.camera_y)
+                if chunk is not None:
+                    surf.blit(chunk, pos)
+                else:
+                    surf.fill(self.background_color, (pos, (chunk_px, chunk_px)))
 
     def update(self):
+        if self.streaming:
+            self._stream_regions()
+        # the batched subscribers get the changes of the frame
+        self.events.flush()
         self.screen_shaking = max(0, self.screen_shaking - 1)
         if self.screen_shaking > 0:
             self.screen_offset = [
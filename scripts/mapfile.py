@@ -0,0 +1,159 @@
+'''
+Binary level format.
+
+    header      MAGIC, version, base_tile_size, tile_size, camera_x, camera_y,
+                x0, y0, width, height, palette size, off-grid tiles count
+    palette     (name length, resource name utf-8, variant) per tile id, id 0 is an empty cell
+    ids         width x height uint16 tile ids, x-major (ids[x - x0, y - y0]), 8-byte aligned
+    off-grid    table of (tile id, x, y) records
+    meta        optional, 8-byte aligned: META_MAGIC, json length, utf-8 json of what made the map
+
+Convert a json map:
+    python -m scripts.mapfile maps/map.json maps/map.bin
+'''
+import json
+import mmap
+import struct
+import sys
+import numpy as np
+from scripts.grid import TileGrid
+
+MAGIC = b'MGMP'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHddiiIIHI')
+PALETTE_ENTRY = struct.Struct('<B')
+VARIANT = struct.Struct('<H')
+OFFGRID_DTYPE = np.dtype([('tile', '<u2'), ('x', '<f8'), ('y', '<f8')])
+META_MAGIC = b'META'
+META_HEADER = struct.Struct('<4sI')
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def load(path):
+    '''
+    @ return dict with base_tile_size, tile_size, camera_x, camera_y, x0, y0,
+    ids (uint16 array width x height), palette ([None, (resource, variant),]), nogrid_tiles and meta ({} if there is none)
+    '''
+    with open(path, 'rb') as f:
+        # private copy-on-write mapping: the tile ids are used in place and can still be changed
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+    magic, version, base_tile_size, tile_size, camera_x, camera_y, x0, y0, width, height, palette_size, offgrid_count = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f'{path} is not a binary map')
+    if version != VERSION:
+        raise ValueError(f'{path}: unsupported map version {version}')
+    offset = HEADER.size
+    palette = [None]
+    for _ in range(palette_size):
+        name_length, = PALETTE_ENTRY.unpack_from(data, offset)
+        offset += PALETTE_ENTRY.size
+        name = bytes(data[offset:offset + name_length]).decode('utf-8')
+        offset += name_length
+        variant, = VARIANT.unpack_from(data, offset)
+        offset += VARIANT.size
+        palette.append((name, variant))
+    offset = _align(offset)
+    ids = np.frombuffer(data, dtype='<u2', count=width * height, offset=offset).reshape(width, height)
+    offset = _align(offset + ids.nbytes)
+    offgrid = np.frombuffer(data, dtype=OFFGRID_DTYPE, count=offgrid_count, offset=offset)
+    offset = _align(offset + offgrid.nbytes)
+    meta = {}
+    if offset + META_HEADER.size <= len(data):
+        meta_magic, meta_length = META_HEADER.unpack_from(data, offset)
+        if meta_magic == META_MAGIC:
+            offset += META_HEADER.size
+            meta = json.loads(bytes(data[offset:offset + meta_length]).decode('utf-8'))
+    nogrid_tiles = [
+        {'resource': palette[tile][0], 'variant': palette[tile][1], 'pos': (x, y)}
+        for tile, x, y in offgrid.tolist()
+    ]
+    return {
+        'base_tile_size': base_tile_size,
+        'tile_size': tile_size,
+        'camera_x': camera_x,
+        'camera_y': camera_y,
+        'x0': x0,
+        'y0': y0,
+        'ids': ids,
+        'palette': palette,
+        'nogrid_tiles': nogrid_tiles,
+        'meta': meta,
+    }
+
+
+def save(path, tile_map, nogrid_tiles, base_tile_size, tile_size, camera_x, camera_y, meta=None):
+    '''
+    @ tile_map - {(x, y): {'resource', 'variant'}} or a TileGrid
+    @ meta - json serializable dict kept in the file, e.g. the parameters of a generated map
+    '''
+    palette = [None]
+    palette_ids = {}
+    def tile_id(resource_name, variant):
+        if (resource_name, variant) not in palette_ids:
+            palette_ids[(resource_name, variant)] = len(palette)
+            palette.append((resource_name, variant))
+        return palette_ids[(resource_name, variant)]
+
+    if isinstance(tile_map, TileGrid):
+        # the grid is written as it is
+        for key in tile_map.palette[1:]:
+            tile_id(*key)
+        x0, y0 = tile_map.x0, tile_map.y0
+        width, height = tile_map.width, tile_map.height
+        ids = tile_map.ids.astype('<u2')
+    else:
+        positions = list(tile_map.keys())
+        if positions:
+            xs, ys = zip(*positions)
+            x0, y0 = min(xs), min(ys)
+            width, height = max(xs) - x0 + 1, max(ys) - y0 + 1
+        else:
+            x0 = y0 = width = height = 0
+        ids = np.zeros((width, height), dtype='<u2')
+        for (x, y), tile in tile_map.items():
+            ids[x - x0, y - y0] = tile_id(tile['resource'], tile['variant'])
+    offgrid = np.array(
+        [(tile_id(tile['resource'], tile['variant']), tile['pos'][0], tile['pos'][1]) for tile in nogrid_tiles],
+        dtype=OFFGRID_DTYPE
+    )
+
+    chunks = [HEADER.pack(
+        MAGIC, VERSION, base_tile_size, tile_size, camera_x, camera_y,
+        x0, y0, width, height, len(palette) - 1, len(offgrid)
+    )]
+    for resource_name, variant in palette[1:]:
+        name = resource_name.encode('utf-8')
+        chunks.append(PALETTE_ENTRY.pack(len(name)) + name + VARIANT.pack(variant))
+    def pad():
+        size = sum(len(chunk) for chunk in chunks)
+        chunks.append(b'\0' * (_align(size) - size))
+    pad()
+    chunks.append(ids.tobytes())
+    pad()
+    chunks.append(offgrid.tobytes())
+    if meta:
+        pad()
+        text = json.dumps(meta).encode('utf-8')
+        chunks.append(META_HEADER.pack(META_MAGIC, len(text)) + text)
+    with open(path, 'wb') as f:
+        f.write(b''.join(chunks))
+
+
+def convert(json_path, path):
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+    tile_map = {
+        tuple(map(int, k[1:-1].split(','))): v
+        for k, v in data['tile_map'].items()
+    }
+    save(path, tile_map, data['nogrid_tiles'], data['base_tile_size'], data['tile_size'], data['camera_x'], data['camera_y'], data.get('meta'))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python -m scripts.mapfile <map.json> <map.bin>')
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
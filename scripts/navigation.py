@@ -0,0 +1,210 @@
+from heapq import heappush, heappop
+from collections import OrderedDict
+
+
+WALK = 'walk'
+FALL = 'fall'
+JUMP = 'jump'
+
+
+class Navigation:
+    '''
+    Navigation graph of the solid grid. The nodes are platform segments - horizontal runs of cells
+    (i_start, i_end, j) where an entity can stand: the cells are empty, the cells below them are solid
+    and there is clearance above them. The edges are walks to the next segment, falls from the ends
+    and jumps. Edges are tuples (kind, target segment, takeoff x, landing x) in cells.
+    Segments are found per region lazily, paths are searched with A* and cached until the map changes.
+    '''
+    REGION_SIZE = 16
+    MAX_REGIONS = 256
+    MAX_PATHS = 256
+    MAX_EXPANDED = 2000 # A* gives up after so many segments, the path is None then
+    COST = {WALK: 0, FALL: 1, JUMP: 2} # added to the horizontal distance
+
+    def __init__(self, solid_window, columns, tile_size, clearance=2, jump_height=1, jump_length=2, fall_limit=16):
+        '''
+        @ solid_window - function (i_start, j_start, i_end, j_end) -> boolean grid of the cells, ends included
+        @ columns - ColumnIndex of the map
+        @ clearance - how many empty cells an entity needs above the ground
+        @ jump_height - how many cells a jump rises
+        @ jump_length - how wide a gap a jump crosses
+        @ fall_limit - the deepest fall which is an edge
+        '''
+        self.solid_window = solid_window
+        self.columns = columns
+        self.tile_size = tile_size
+        self.clearance = clearance
+        self.jump_height = jump_height
+        self.jump_length = jump_length
+        self.fall_limit = fall_limit
+        self.regions = OrderedDict() # (rx, ry) -> {j: [segment,]}
+        self.edges = {} # segment -> [edge,]
+        self.paths = OrderedDict() # (start, goal) -> [edge,] or None
+
+    def _build_region(self, rx, ry):
+        size = self.REGION_SIZE
+        cl = self.clearance
+        i0, j0 = rx * size, ry * size
+        # rows j0 - cl + 1 .. j0 + size: the clearance of the top row and the ground of the bottom one
+        solid = self.solid_window(i0, j0 - cl + 1, i0 + size - 1, j0 + size)
+        free = ~solid
+        stand = solid[:, cl:cl + size].copy()
+        for k in range(cl):
+            stand &= free[:, k:k + size]
+        rows = {}
+        for t, column in enumerate(stand.T.tolist()):
+            start = None
+            for x, s in enumerate(column + [False]):
+                if s and start is None:
+                    start = x
+                elif not s and start is not None:
+                    rows.setdefault(j0 + t, []).append((i0 + start, i0 + x - 1, j0 + t))
+                    start = None
+        return rows
+
+    def _region(self, rx, ry):
+        key = (rx, ry)
+        rows = self.regions.get(key)
+        if rows is None:
+            rows = self.regions[key] = self._build_region(rx, ry)
+            if len(self.regions) > self.MAX_REGIONS:
+                self.regions.popitem(last=False)
+        else:
+            self.regions.move_to_end(key)
+        return rows
+
+    def segment_at(self, i, j):
+        '''
+        @ return the segment of the cell or None if one can not stand there
+        '''
+        size = self.REGION_SIZE
+        for segment in self._region(i // size, j // size).get(j, ()):
+            if segment[0] <= i <= segment[1]:
+                return segment
+        return None
+
+    def segments_in(self, i_start, j_start, i_end, j_end):
+        '''
+        @ return the segments which touch the cells [i_start, i_end] x [j_start, j_end]
+        '''
+        size = self.REGION_SIZE
+        result = []
+        for rx in range(i_start // size, i_end // size + 1):
+            for ry in range(j_start // size, j_end // size + 1):
+                for j, segments in self._region(rx, ry).items():
+                    if not j_start <= j <= j_end: continue
+                    result.extend(s for s in segments if s[1] >= i_start and s[0] <= i_end)
+        return result
+
+    def segment_under(self, rect):
+        '''
+        @ return the segment the rect stands on or the one it falls to, None if there is no ground
+        '''
+        ts = self.tile_size
+        j = (rect.bottom - 1) // ts
+        for i in (rect.centerx // ts, rect.left // ts, (rect.right - 1) // ts):
+            segment = self.segment_at(i, j)
+            if segment: return segment
+        i = rect.centerx // ts
+        ground = self.columns.first_solid_below(i, j + 1)
+        if ground is None: return None
+        return self.segment_at(i, ground - 1)
+
+    def _clear(self, x, j_start, j_end):
+        return not self.columns.has_solid(x, j_start, j_end)
+
+    def _edges(self, segment):
+        edges = self.edges.get(segment)
+        if edges is not None: return edges
+        i_start, i_end, j = segment
+        cl = self.clearance
+        edges = []
+        # walks and falls from the ends
+        for x, takeoff in ((i_start - 1, i_start), (i_end + 1, i_end)):
+            if not self._clear(x, j - cl + 1, j): continue
+            ground = self.columns.first_solid_below(x, j)
+            if ground is None or ground - 1 - j > self.fall_limit: continue
+            target = self.segment_at(x, ground - 1)
+            if target:
+                edges.append((WALK if ground - 1 == j else FALL, target, takeoff, x))
+        # jumps over gaps and up the steps
+        reach = self.jump_length + 1
+        for target in self.segments_in(i_start - reach, j - self.jump_height, i_end + reach, j + self.jump_length):
+            if target[0] > i_end:
+                takeoff, landing, step = i_end, target[0], 1
+            elif target[1] < i_start:
+                takeoff, landing, step = i_start, target[1], -1
+            else:
+                continue
+            # the arc needs the rise above the heads only for the jumps up
+            top = min(j, target[2]) - cl + 1 - (self.jump_height if target[2] < j else 0)
+            bottom = min(j, target[2])
+            if not self._clear(takeoff, top, j) or not self._clear(landing, top, target[2]): continue
+            if all(self._clear(x, top, bottom) for x in range(takeoff + step, landing, step)):
+                edges.append((JUMP, target, takeoff, landing))
+        self.edges[segment] = edges
+        return edges
+
+    def find_path(self, start, goal):
+        '''
+        @ return [edge,] from the start segment to the goal one, [] if they are the same,
+        None if the goal is unreachable
+        '''
+        key = (start, goal)
+        if key in self.paths:
+            self.paths.move_to_end(key)
+            return self.paths[key]
+        path = self._search(start, goal)
+        self.paths[key] = path
+        if len(self.paths) > self.MAX_PATHS:
+            self.paths.popitem(last=False)
+        return path
+
+    def _search(self, start, goal):
+        goal_x = (goal[0] + goal[1]) / 2
+        center = lambda s: (s[0] + s[1]) / 2
+        costs = {start: 0}
+        came = {start: None}
+        opened = [(abs(center(start) - goal_x), 0, start)]
+        expanded = 0
+        while opened:
+            _, cost, segment = heappop(opened)
+            if segment == goal:
+                path = []
+                while came[segment]:
+                    segment, edge = came[segment]
+                    path.append(edge)
+                return path[::-1]
+            if cost > costs[segment]: continue
+            expanded += 1
+            if expanded > self.MAX_EXPANDED: break
+            for edge in self._edges(segment):
+                target = edge[1]
+                new_cost = cost + abs(center(target) - center(segment)) + self.COST[edge[0]]
+                if new_cost < costs.get(target, float('inf')):
+                    costs[target] = new_cost
+                    came[target] = (segment, edge)
+                    heappush(opened, (new_cost + abs(center(target) - goal_x), new_cost, target))
+        return None
+
+    def path(self, rect, target_rect):
+        '''
+        @ return [edge,] from the segment of rect to the one of target_rect or None
+        '''
+        start = self.segment_under(rect)
+        goal = self.segment_under(target_rect)
+        if start is None or goal is None: return None
+        return self.find_path(start, goal)
+
+    def invalidate(self, i_start, j_start, i_end, j_end):
+        '''
+        Drops the segments which depend on the cells [i_start, i_end] x [j_start, j_end], all the edges and paths
+        '''
+        size = self.REGION_SIZE
+        # a cell is the ground of the row above it and the clearance of the rows below it
+        j_start, j_end = j_start - 1, j_end + self.clearance - 1
+        for rx in range(i_start // size, i_end // size + 1):
+            for ry in range(j_start // size, j_end // size + 1):
+                self.regions.pop((rx, ry), None)
+        self.edges.clear()
+        self.paths.clear()
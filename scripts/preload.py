@@ -0,0 +1,99 @@
+'''
+Parallel image decoding for cold starts.
+
+The images a launch decodes are written down as jobs (the parameters of utils.load_image) in a manifest.
+When the frame cache is cold the next launch gives all the jobs of the manifest to a pool of threads
+(decoding and scaling release the GIL), every job gives raw pixels back and the surfaces are made of them
+on the main thread when utils asks for them. The jobs missing from the manifest are decoded as before.
+'''
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from scripts.framecache import to_pixels, from_pixels
+
+
+def _job_key(job):
+    # tuples and lists of the parameters are the same key
+    return json.dumps(list(job))
+
+
+class Preloader:
+    def __init__(self, path):
+        '''
+        @ path - json manifest of the jobs, it is written by save
+        '''
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.jobs = json.load(f)
+        except (OSError, ValueError):
+            self.jobs = []
+        self.recorded = {} # job key -> job, the jobs of this launch in order
+        self.ready = {} # job key -> pixels from the pool
+        self.serial_time = 0 # how long the decoding took in the workers
+        self.wall_time = 0 # how long the pool took
+        self.build_time = 0 # how long the surfaces of the pool took on the main thread
+        self.workers = 0
+
+    def run(self, decode, workers=None):
+        '''
+        Decodes the jobs of the manifest on a thread pool
+        @ decode - function (*job) -> surface
+        @ workers - threads, the core count by default
+        '''
+        if not self.jobs: return
+        def work(job):
+            # cpu time of the thread, the wall time of a job grows with the threads waiting for a core
+            start = time.thread_time()
+            surface = decode(*job)
+            seconds = time.thread_time() - start
+            return job, to_pixels(surface), seconds
+        self.workers = workers or os.cpu_count() or 1
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for job, pixels, seconds in pool.map(work, self.jobs):
+                self.ready[_job_key(job)] = pixels
+                self.serial_time += seconds
+        self.wall_time = time.perf_counter() - start
+
+    def take(self, job):
+        '''
+        Writes the job down
+        @ return the surface of the job if the pool decoded it, else None
+        '''
+        key = _job_key(job)
+        self.recorded.setdefault(key, list(job))
+        pixels = self.ready.pop(key, None)
+        if pixels is None: return None
+        start = time.perf_counter()
+        surface = from_pixels(*pixels)
+        self.build_time += time.perf_counter() - start
+        return surface
+
+    def saved_time(self):
+        '''
+        @ return wall time saved by the pool in seconds: the jobs one after another minus the pool
+        and the surfaces made of its pixels
+        '''
+        return self.serial_time - self.wall_time - self.build_time
+
+    def report(self):
+        return (f'decoded {len(self.jobs)} images on {self.workers} threads in {self.wall_time:.2f}s '
+                f'({self.serial_time:.2f}s of work), saved {self.saved_time():.2f}s')
+
+    def save(self):
+        '''
+        Writes the jobs of this launch as the manifest if they are not the same
+        '''
+        # the pixels of the jobs nobody asked for
+        self.ready.clear()
+        jobs = list(self.recorded.values())
+        if not jobs or jobs == self.jobs: return
+        try:
+            with open(self.path, 'w') as f:
+                # a job per line
+                f.write('[\n' + ',\n'.join(json.dumps(job) for job in jobs) + '\n]\n')
+            self.jobs = jobs
+        except OSError:
+            pass
@@ -49,7 +49,7 @@ class DynamicRigidBody:
     def movex(self, rigidBodies: list[pygame.Rect]):
         self.collision['left'] = self.collision['right'] = False
         self.rect.x += self.vel[0]
-        self._correctPositionx(self.map.get_solid_intersections(self.rect))
+        self._correctPositionx(self.map.get_solid_colliders(self.rect))
         self._correctPositionx(rigidBodies)
         
 
@@ -66,7 +66,7 @@ class DynamicRigidBody:
     def movey(self, rigidBodies: list[pygame.Rect]):
         self.collision['up'] = self.collision['down'] = False
         self.rect.y += self.vel[1]
-        self._correctPositiony(self.map.get_solid_intersections(self.rect))
+        self._correctPositiony(self.map.get_solid_colliders(self.rect))
         self._correctPositiony(rigidBodies)
 
     def update(self, rigidBodies: list[pygame.Rect]=[]):
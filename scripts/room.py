@@ -0,0 +1,184 @@
+import pygame
+from scripts import coin, lighting, events
+
+COINS = [coin.EnergyCoin, coin.HealthCoin] # by the variant of the coin markers
+
+
+class Room:
+    '''
+    A loaded level with everything which lives in it. The App keeps several rooms at once,
+    only the active one is rendered, the others are ticked every tick_every frames or frozen.
+    '''
+    def __init__(self, app, map, tick_every=0):
+        '''
+        @ tick_every - how often the room is updated while it is not active, 0 - it is frozen
+        '''
+        self.app = app
+        self.map = map
+        self.tick_every = tick_every
+        self.lights = lighting.LightMap(map)
+        map.events.subscribe(self._on_evicted, kinds=(events.REGION_EVICTED,))
+        self.clear()
+
+    def clear(self):
+        self.npcs = []
+        self.enemies = []
+        self.rigidbodies = []
+        self.finishing_effects = []
+        self.rigid_effects = []
+        self.portals = []
+        self.streamed = [] # spawned from the markers of streamed regions, they go away with their regions
+
+    def close(self):
+        '''
+        The room is dropped with its map
+        '''
+        self.map.close()
+
+    @property
+    def main_player(self):
+        '''
+        The main player if it is in this room, otherwise None
+        '''
+        player = self.app.main_player
+        return player if player.room is self else None
+
+    def light_sources(self):
+        '''
+        @ return static, dynamic - [(x, y, level),] light sources of the room in map coords
+        '''
+        static = [(*rb.pos, lighting.COIN_LEVEL) for rb in self.rigidbodies if isinstance(rb, coin.EnergyCoin)]
+        static += [(*port.center, lighting.PORTAL_LEVEL) for port in self.portals]
+        dynamic = [(*effect.get_rect().center, lighting.FIRE_LEVEL) for effect in self.rigid_effects + self.finishing_effects]
+        return static, dynamic
+
+    def populate(self, entity_factory, enemies_factory):
+        '''
+        Makes npcs, enemies and coins from the spawn table of the map
+        '''
+        for i, npc_name in enumerate(sorted(entity_factory.players.keys())):
+            for pos in self.map.get_spawns('npc', i):
+                self.npcs.append(entity_factory.make_player(npc_name, pos, (0, 0), room=self))
+        for i, enemy_name in enumerate(sorted(enemies_factory.enemies.keys())):
+            for pos in self.map.get_spawns('entities', i):
+                self.enemies.append(enemies_factory.make_enemy(enemy_name, pos, (0, 0), room=self))
+        for variant, cclass in enumerate(COINS):
+            for pos in self.map.get_spawns('coins', variant):
+                self.rigidbodies.append(cclass(pos, 10))
+            for pos in self.map.get_offgrid_spawns('coins', variant):
+                self.rigidbodies.append(cclass((pos[0] * self.map.k, pos[1] * self.map.k), 10))
+
+    def spawn_streamed(self, entity_factory, enemies_factory):
+        '''
+        Makes npcs, enemies and coins from the markers of the regions loaded since the last call
+        '''
+        for resource_name, variant, pos in self.map.take_spawns():
+            if resource_name == 'npc':
+                body = entity_factory.make_player(sorted(entity_factory.players.keys())[variant], pos, (0, 0), room=self)
+                self.npcs.append(body)
+            elif resource_name == 'entities':
+                body = enemies_factory.make_enemy(sorted(enemies_factory.enemies.keys())[variant], pos, (0, 0), room=self)
+                self.enemies.append(body)
+            else:
+                body = COINS[variant](pos, 10)
+                self.rigidbodies.append(body)
+            self.streamed.append(body)
+
+    def _on_evicted(self, changes):
+        ts = self.map.tile_size
+        for event in changes:
+            i_start, j_start, i_end, j_end = event.area
+            area = pygame.Rect(i_start * ts, j_start * ts, (i_end - i_start + 1) * ts, (j_end - j_start + 1) * ts)
+            kept = []
+            for body in self.streamed:
+                if not area.collidepoint(body.get_rect().center):
+                    kept.append(body)
+                    continue
+                for bodies in (self.npcs, self.enemies, self.rigidbodies):
+                    if body in bodies:
+                        bodies.remove(body)
+            self.streamed = kept
+
+    def reset(self, entity_factory, enemies_factory):
+        '''
+        The room as it was loaded
+        '''
+        self.map.reset()
+        self.clear()
+        self.populate(entity_factory, enemies_factory)
+
+    def attack(self, rect, damage, attack_main_player=True, attack_enemies=True, attack_npc=True, delay=60, intensity=80):
+        def fattack_main_player(rect, damage):
+            player = self.main_player
+            if player and player.get_rect().colliderect(rect):
+                player.hurt(damage, delay=delay, intensity=intensity)
+                return True
+            return False
+        def fattack_enemies(rect, damage):
+            for enemy in self.enemies:
+                if not enemy.died and enemy.get_rect().colliderect(rect):
+                    enemy.hurt(damage)
+                    return True
+            return False
+        def fattack_npc(rect, damage):
+            for npc in self.npcs:
+                if not npc.died and npc.get_rect().colliderect(rect):
+                    npc.hurt(damage)
+                    return True
+            return False
+
+        collision = False
+        if attack_main_player:
+            collision = fattack_main_player(rect, damage) or collision
+        if attack_enemies:
+            collision = fattack_enemies(rect, damage) or collision
+        if attack_npc:
+            collision = fattack_npc(rect, damage) or collision
+        return collision
+
+    def update(self):
+        '''
+        A frame of the npcs, enemies, portals and effects of the room, without rendering.
+        The map and the main player are updated by their owners
+        '''
+        for npc in list(self.npcs):
+            npc.ai()
+            npc.update()
+            if npc.died and npc.dieing > npc.died_time:
+                self.npcs.remove(npc)
+        for enemy in list(self.enemies):
+            enemy.ai()
+            if enemy.died and enemy.dieing > enemy.died_time:
+                self.enemies.remove(enemy)
+        for port in self.portals:
+            port.update()
+        for explosion in list(self.finishing_effects):
+            explosion.update()
+            if explosion.damage != 0 and self.attack(explosion.get_rect(), explosion.damage, attack_main_player=True, attack_enemies=False):
+                explosion.damage = 0
+            if explosion.disable:
+                self.finishing_effects.remove(explosion)
+                if explosion.finish_explosion:
+                    expl = explosion.finish_explosion(explosion, self.map)
+                    if expl:
+                        self.finishing_effects.append(expl)
+        old_rects = [effect.get_rect() for effect in self.rigid_effects]
+        for effect in self.rigid_effects:
+            effect.update()
+        # all the effects are checked against the map at once
+        solid_hits = self.map.collide_solid_moved(old_rects, [effect.get_rect() for effect in self.rigid_effects])
+        for effect, solid_hit in zip(list(self.rigid_effects), solid_hits):
+            collision = False
+            if effect.damage != 0:
+                collision = self.attack(effect.get_rect(), effect.damage, attack_main_player=True, attack_enemies=True)
+            if solid_hit or collision:
+                self.rigid_effects.remove(effect)
+                if effect.finish_explosion:
+                    self.finishing_effects.append(effect.finish_explosion(effect, self.map))
+
+    def tick(self):
+        '''
+        Update of the room while it is not active
+        '''
+        self.map.update()
+        self.update()
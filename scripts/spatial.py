@@ -0,0 +1,78 @@
+class SpatialHash:
+    '''
+    Uniform bucket grid for the off-grid tiles. A tile is kept in the bucket of the cell of tile['pos'].
+    It replaces the plain list of tiles: append, extend, remove, `in`, len and iteration
+    (in insertion order) work the same, but removal is O(1) and area queries only touch
+    the buckets which overlap the area.
+    Tiles are dicts, so they are tracked by identity.
+    '''
+    def __init__(self, cell_size, tiles=()):
+        self.cell_size = cell_size
+        self.buckets = {} # cell -> {id(tile): tile}
+        self.tiles = {} # id(tile) -> (order, tile)
+        self.counter = 0
+        self.extend(tiles)
+
+    def _cell(self, pos):
+        return (int(pos[0] // self.cell_size), int(pos[1] // self.cell_size))
+
+    def append(self, tile):
+        self.tiles[id(tile)] = (self.counter, tile)
+        self.counter += 1
+        self.buckets.setdefault(self._cell(tile['pos']), {})[id(tile)] = tile
+
+    def extend(self, tiles):
+        for tile in tiles:
+            self.append(tile)
+
+    def _unbucket(self, tile):
+        cell = self._cell(tile['pos'])
+        bucket = self.buckets[cell]
+        del bucket[id(tile)]
+        if not bucket:
+            del self.buckets[cell]
+
+    def remove(self, tile):
+        if id(tile) not in self.tiles:
+            raise ValueError('tile is not in the spatial hash')
+        self._unbucket(tile)
+        del self.tiles[id(tile)]
+
+    def move(self, tile, pos):
+        '''
+        Changes tile['pos'] and keeps the tile in the right bucket
+        '''
+        self._unbucket(tile)
+        tile['pos'] = pos
+        self.buckets.setdefault(self._cell(pos), {})[id(tile)] = tile
+
+    def query(self, rect, margin=(0, 0)):
+        '''
+        @ rect - (x, y, w, h) in the units of tile['pos']
+        @ margin - (w, h) of the biggest tile: tiles which start up to margin before the rect may still overlap it
+        @ return [tile,] - the tiles which pos lies in the rect extended by margin, in insertion order
+        '''
+        x0, y0 = rect[0] - margin[0], rect[1] - margin[1]
+        x1, y1 = rect[0] + rect[2], rect[1] + rect[3]
+        cx0, cy0 = self._cell((x0, y0))
+        cx1, cy1 = self._cell((x1, y1))
+        result = []
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self.buckets):
+            cells = [cell for cell in self.buckets if cx0 <= cell[0] <= cx1 and cy0 <= cell[1] <= cy1]
+        else:
+            cells = [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1) if (cx, cy) in self.buckets]
+        for cell in cells:
+            for tile in self.buckets[cell].values():
+                if x0 <= tile['pos'][0] <= x1 and y0 <= tile['pos'][1] <= y1:
+                    result.append(tile)
+        result.sort(key=lambda tile: self.tiles[id(tile)][0])
+        return result
+
+    def __contains__(self, tile):
+        return id(tile) in self.tiles
+
+    def __iter__(self):
+        return iter([tile for _, tile in self.tiles.values()])
+
+    def __len__(self):
+        return len(self.tiles)
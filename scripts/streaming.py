@@ -0,0 +1,421 @@
+'''
+Region-paged maps for very large worlds.
+
+A world is a directory:
+    world.json          sizes, camera, region size, known regions and spawn markers (grid and off-grid)
+    regions/x_y.bin     one binary map (scripts/mapfile.py) per region of region_size x region_size tiles
+
+Regions near the camera are loaded by a background thread, far ones are evicted
+when the loaded regions take more than the memory budget.
+
+Split a map into regions:
+    python -m scripts.streaming maps/map.json maps/world
+'''
+import json
+import os
+import queue
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import numpy as np
+from collections.abc import MutableMapping
+from scripts import mapfile
+from scripts.grid import TileGrid, solid_hits
+
+VERSION = 1
+UNKNOWN = 0xFFFF # tile id of the known but not loaded cells
+MARKER_RESOURCES = ('npc', 'entities', 'coins')
+
+
+def _region_name(key):
+    return f'{key[0]}_{key[1]}.bin'
+
+
+def split(map_path, out_dir, region_size=32, markers=MARKER_RESOURCES):
+    '''
+    Writes the map (json or .bin) as a world directory.
+    @ markers - resources of the spawn markers: they are kept in world.json instead of the regions
+    '''
+    if map_path.endswith('.bin'):
+        data = mapfile.load(map_path)
+        tile_map = TileGrid.from_arrays(data['ids'], data['palette'], data['x0'], data['y0'])
+    else:
+        with open(map_path, 'r') as f:
+            data = json.load(f)
+        tile_map = {
+            tuple(map(int, k[1:-1].split(','))): v
+            for k, v in data['tile_map'].items()
+        }
+    regions = {}
+    spawn_markers = []
+    offgrid_markers = []
+    for (x, y), tile in tile_map.items():
+        if tile['resource'] in markers:
+            spawn_markers.append([tile['resource'], tile['variant'], x, y])
+            continue
+        regions.setdefault((x // region_size, y // region_size), {})[(x, y)] = tile
+    offgrid = {}
+    region_px = region_size * data['base_tile_size']
+    for tile in data['nogrid_tiles']:
+        if tile['resource'] in markers:
+            offgrid_markers.append(tile)
+            continue
+        key = (int(tile['pos'][0] // region_px), int(tile['pos'][1] // region_px))
+        regions.setdefault(key, {})
+        offgrid.setdefault(key, []).append(tile)
+
+    os.makedirs(os.path.join(out_dir, 'regions'), exist_ok=True)
+    for key, tiles in regions.items():
+        mapfile.save(
+            os.path.join(out_dir, 'regions', _region_name(key)), tiles, offgrid.get(key, []),
+            data['base_tile_size'], data['tile_size'], data['camera_x'], data['camera_y']
+        )
+    with open(os.path.join(out_dir, 'world.json'), 'w') as f:
+        json.dump({
+            'version': VERSION,
+            'base_tile_size': data['base_tile_size'],
+            'tile_size': data['tile_size'],
+            'camera_x': data['camera_x'],
+            'camera_y': data['camera_y'],
+            'region_size': region_size,
+            'regions': {str(key): len(tiles) for key, tiles in regions.items()},
+            'markers': spawn_markers,
+            'offgrid_markers': offgrid_markers,
+            'meta': data.get('meta', {}),
+        }, f)
+
+
+class StreamingTileMap(MutableMapping):
+    '''
+    tile_map of a world directory, with the same array queries as TileGrid.
+    Only loaded regions are iterated and rendered. Solidity queries treat the known
+    regions which are not loaded yet as solid, so nothing falls through them.
+    Spawn markers live in a separate list and are always available.
+    '''
+    def __init__(self, path, memory_budget=32 * 1024 * 1024, radius=1):
+        '''
+        @ memory_budget - bytes of the loaded regions arrays
+        @ radius - how many regions around the camera are loaded
+        '''
+        self.path = path
+        with open(os.path.join(path, 'world.json'), 'r') as f:
+            self.info = json.load(f)
+        self.region_size = self.info['region_size']
+        self.known = {tuple(map(int, k[1:-1].split(','))): count for k, count in self.info['regions'].items()}
+        self.markers = {(x, y): (resource_name, variant) for resource_name, variant, x, y in self.info['markers']}
+        self.memory_budget = memory_budget
+        self.radius = radius
+
+        self.resource_props = None
+        self.palette = [None]
+        self.palette_ids = {}
+        self.solid_lut = np.zeros(1, dtype=bool)
+        self.regions = {} # key -> [ids, solid, offgrid tiles]
+        self.dirty = set()
+        # spawn markers found in the regions (generated ones have them): key -> [(resource, variant, x, y),]
+        self.region_markers = {}
+        self.spawned = set() # regions whose markers were taken since they were loaded
+        self.new_spawns = []
+        # modified regions are written here when they are evicted
+        self.scratch_dir = tempfile.mkdtemp(prefix='magician-regions-')
+
+        self.pending = {} # key -> ticket of the request, a result with another ticket is stale
+        self.tickets = 0
+        self.installed = [] # regions loaded right away by edits, reported by the next update
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self.worker = threading.Thread(target=self._work, daemon=True)
+        self.worker.start()
+
+    def close(self):
+        '''
+        Stops the loader thread and removes the evicted changes, the map is not used after it
+        '''
+        if self.worker is None: return
+        self.requests.put(None)
+        self.worker.join()
+        self.worker = None
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+
+    # palette
+    def _issolid_tile(self, resource_name, variant):
+        if self.resource_props is None: return False
+        props = self.resource_props.get(resource_name, {})
+        return 'solid' in props and props['solid'][variant]
+
+    def set_resource_props(self, resource_props):
+        self.resource_props = resource_props
+        self.solid_lut = np.array([False] + [self._issolid_tile(*key) for key in self.palette[1:]], dtype=bool)
+        for region in self.regions.values():
+            region[1] = self.solid_lut[region[0]]
+
+    def tile_id(self, resource_name, variant):
+        key = (resource_name, variant)
+        if key not in self.palette_ids:
+            self.palette_ids[key] = len(self.palette)
+            self.palette.append(key)
+            self.solid_lut = np.append(self.solid_lut, self._issolid_tile(resource_name, variant))
+        return self.palette_ids[key]
+
+    # loading
+    def _region_path(self, key):
+        scratch = os.path.join(self.scratch_dir, _region_name(key))
+        if os.path.exists(scratch): return scratch
+        return os.path.join(self.path, 'regions', _region_name(key))
+
+    def _read(self, key):
+        '''
+        @ return the region data as mapfile.load returns it or None. It runs in the worker thread
+        '''
+        try:
+            return mapfile.load(self._region_path(key))
+        except (OSError, ValueError, IndexError, struct.error):
+            # a missing or broken file is an empty region
+            return None
+
+    def _work(self):
+        while True:
+            request = self.requests.get()
+            if request is None: return
+            key, ticket = request
+            self.results.put((key, ticket, self._read(key)))
+
+    def _install(self, key, data):
+        ids = np.zeros((self.region_size, self.region_size), dtype=np.uint16)
+        offgrid = []
+        if data is not None:
+            lut = np.array([0] + [self.tile_id(*entry) for entry in data['palette'][1:]], dtype=np.uint16)
+            # marker tiles are taken out of the grid
+            marks = [n for n, entry in enumerate(data['palette']) if entry and entry[0] in MARKER_RESOURCES]
+            if marks:
+                xs, ys = np.nonzero(np.isin(data['ids'], marks))
+                markers = [
+                    (*data['palette'][tile], x, y)
+                    for tile, x, y in zip(data['ids'][xs, ys].tolist(), (xs + data['x0']).tolist(), (ys + data['y0']).tolist())
+                ]
+                self.region_markers.setdefault(key, markers)
+                lut[marks] = 0
+            dx = data['x0'] - key[0] * self.region_size
+            dy = data['y0'] - key[1] * self.region_size
+            w, h = data['ids'].shape
+            ids[dx:dx + w, dy:dy + h] = lut[data['ids']]
+            offgrid = data['nogrid_tiles']
+        self.regions[key] = [ids, self.solid_lut[ids], offgrid]
+        if key in self.region_markers and key not in self.spawned:
+            self.spawned.add(key)
+            self.new_spawns.extend(self.region_markers[key])
+
+    def take_spawns(self):
+        '''
+        @ return [(resource, variant, x, y),] markers of the regions loaded since the last call
+        '''
+        spawns, self.new_spawns = self.new_spawns, []
+        return spawns
+
+    def forget_spawns(self):
+        '''
+        The markers of the loaded regions are given by take_spawns again, the others when they are loaded
+        '''
+        self.spawned = {key for key in self.regions if key in self.region_markers}
+        self.new_spawns = [marker for key in self.spawned for marker in self.region_markers[key]]
+
+    def _load_now(self, key):
+        # the result of a request in flight was read before the changes which come now
+        self.pending.pop(key, None)
+        self._install(key, self._read(key))
+        self.installed.append((key, self.regions[key][2]))
+
+    def _evict(self, key):
+        ids, _, offgrid = self.regions.pop(key)
+        self.spawned.discard(key)
+        if key in self.dirty:
+            grid = TileGrid.from_arrays(ids, self.palette, key[0] * self.region_size, key[1] * self.region_size)
+            path = os.path.join(self.scratch_dir, _region_name(key))
+            # written aside and renamed, the loader thread can be reading the region
+            temp = f'{path}.tmp'
+            mapfile.save(temp, grid, offgrid, self.info['base_tile_size'], self.info['tile_size'], 0, 0)
+            os.replace(temp, path)
+            self.dirty.discard(key)
+        return offgrid
+
+    def _offgrid_region(self, tile):
+        region_px = self.region_size * self.info['base_tile_size']
+        key = (int(tile['pos'][0] // region_px), int(tile['pos'][1] // region_px))
+        if key not in self.regions:
+            if key in self.known:
+                self._load_now(key)
+            else:
+                self._install(key, None)
+                self.known[key] = 0
+        return key
+
+    def add_offgrid(self, tile):
+        key = self._offgrid_region(tile)
+        self.regions[key][2].append(tile)
+        self.dirty.add(key)
+
+    def remove_offgrid(self, tile):
+        '''
+        Forgets an off-grid tile of a region, so it does not come back when the region is reloaded
+        '''
+        key = self._offgrid_region(tile)
+        offgrid = self.regions[key][2]
+        for n, other in enumerate(offgrid):
+            if other is tile:
+                del offgrid[n]
+                self.dirty.add(key)
+                return
+
+    def memory(self):
+        return sum(ids.nbytes + solid.nbytes for ids, solid, _ in self.regions.values())
+
+    def update(self, i_start, j_start, i_end, j_end):
+        '''
+        Requests the regions around the visible cells, installs the loaded ones and evicts far regions.
+        @ return loaded, evicted - [(region_key, offgrid tiles),] for both
+        '''
+        rs = self.region_size
+        r0, r1 = i_start // rs - self.radius, i_end // rs + self.radius
+        q0, q1 = j_start // rs - self.radius, j_end // rs + self.radius
+        needed = {(rx, ry) for rx in range(r0, r1 + 1) for ry in range(q0, q1 + 1) if (rx, ry) in self.known}
+        for key in needed:
+            if key not in self.regions and key not in self.pending:
+                self.tickets += 1
+                self.pending[key] = self.tickets
+                self.requests.put((key, self.tickets))
+
+        loaded, self.installed = self.installed, []
+        while True:
+            try:
+                key, ticket, data = self.results.get_nowait()
+            except queue.Empty:
+                break
+            if self.pending.get(key) != ticket: continue
+            del self.pending[key]
+            self._install(key, data)
+            loaded.append((key, self.regions[key][2]))
+
+        evicted = []
+        if self.memory() > self.memory_budget:
+            center = ((r0 + r1) / 2, (q0 + q1) / 2)
+            far = sorted(
+                (key for key in self.regions if key not in needed),
+                key=lambda key: -((key[0] - center[0]) ** 2 + (key[1] - center[1]) ** 2)
+            )
+            for key in far:
+                if self.memory() <= self.memory_budget: break
+                evicted.append((key, self._evict(key)))
+        return loaded, evicted
+
+    # queries
+    def _split(self, x, y):
+        rs = self.region_size
+        return (x // rs, y // rs), x % rs, y % rs
+
+    def cell(self, x, y):
+        key, i, j = self._split(x, y)
+        if key in self.regions:
+            return self.regions[key][0][i, j]
+        return UNKNOWN if key in self.known else 0
+
+    def issolid_cell(self, x, y):
+        key, i, j = self._split(x, y)
+        if key in self.regions:
+            return bool(self.regions[key][1][i, j])
+        return key in self.known
+
+    def _window(self, index, fill, i_start, j_start, i_end, j_end, dtype):
+        result = np.zeros((i_end - i_start + 1, j_end - j_start + 1), dtype=dtype)
+        rs = self.region_size
+        for rx in range(i_start // rs, i_end // rs + 1):
+            for ry in range(j_start // rs, j_end // rs + 1):
+                a0, b0 = max(i_start, rx * rs), max(j_start, ry * rs)
+                a1, b1 = min(i_end + 1, (rx + 1) * rs), min(j_end + 1, (ry + 1) * rs)
+                target = result[a0 - i_start:a1 - i_start, b0 - j_start:b1 - j_start]
+                if (rx, ry) in self.regions:
+                    target[...] = self.regions[(rx, ry)][index][a0 - rx * rs:a1 - rx * rs, b0 - ry * rs:b1 - ry * rs]
+                elif (rx, ry) in self.known:
+                    target[...] = fill
+        return result
+
+    def solid_window(self, i_start, j_start, i_end, j_end):
+        return self._window(1, True, i_start, j_start, i_end, j_end, bool)
+
+    def solid_hits(self, boxes, tile_size):
+        i_start, j_start = boxes[:, :2].min(axis=0) // tile_size
+        i_end, j_end = boxes[:, 2:].max(axis=0) // tile_size
+        solid = self.solid_window(i_start, j_start, i_end, j_end)
+        return solid_hits(solid, i_start, j_start, boxes, tile_size)
+
+    def positions(self, resource_name, variant):
+        '''
+        @ return [(x, y),] of the spawn markers and the tiles of the loaded regions
+        '''
+        result = [pos for pos, tile in self.markers.items() if tile == (resource_name, variant)]
+        if (resource_name, variant) not in self.palette_ids: return result
+        tile_id = self.palette_ids[(resource_name, variant)]
+        for (rx, ry), (ids, _, _) in self.regions.items():
+            xs, ys = np.nonzero(ids == tile_id)
+            result.extend(zip((xs + rx * self.region_size).tolist(), (ys + ry * self.region_size).tolist()))
+        return result
+
+    # mapping of the loaded tiles and markers
+    def __getitem__(self, pos):
+        if pos in self.markers:
+            resource_name, variant = self.markers[pos]
+            return {'resource': resource_name, 'variant': variant}
+        key, i, j = self._split(*pos)
+        if key not in self.regions or self.regions[key][0][i, j] == 0: raise KeyError(pos)
+        resource_name, variant = self.palette[self.regions[key][0][i, j]]
+        return {'resource': resource_name, 'variant': variant}
+
+    def __setitem__(self, pos, tile):
+        key, i, j = self._split(*pos)
+        if key not in self.regions:
+            if key in self.known:
+                self._load_now(key)
+            else:
+                self._install(key, None)
+                self.known[key] = 0
+        ids, solid, _ = self.regions[key]
+        if ids[i, j] == 0:
+            self.known[key] += 1
+        ids[i, j] = self.tile_id(tile['resource'], tile['variant'])
+        solid[i, j] = self.solid_lut[ids[i, j]]
+        self.dirty.add(key)
+
+    def __delitem__(self, pos):
+        if pos in self.markers:
+            del self.markers[pos]
+            return
+        key, i, j = self._split(*pos)
+        if key not in self.regions and key in self.known:
+            self._load_now(key)
+        if key not in self.regions or self.regions[key][0][i, j] == 0: raise KeyError(pos)
+        self.regions[key][0][i, j] = 0
+        self.regions[key][1][i, j] = False
+        self.known[key] -= 1
+        self.dirty.add(key)
+
+    def __contains__(self, pos):
+        if pos in self.markers: return True
+        key, i, j = self._split(*pos)
+        return key in self.regions and self.regions[key][0][i, j] != 0
+
+    def __iter__(self):
+        yield from list(self.markers)
+        for (rx, ry), (ids, _, _) in list(self.regions.items()):
+            xs, ys = np.nonzero(ids)
+            yield from zip((xs + rx * self.region_size).tolist(), (ys + ry * self.region_size).tolist())
+
+    def __len__(self):
+        return len(self.markers) + sum(self.known.values())
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print('usage: python -m scripts.streaming <map.json|map.bin> <world dir>')
+        sys.exit(1)
+    split(sys.argv[1], sys.argv[2])
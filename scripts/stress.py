@@ -0,0 +1,177 @@
+'''
+Stress levels for benchmarks: a map (maps/map.json by default) or a generated grid (scripts/levelgen.py)
+filled with as many enemies, coins and off-grid decorations as asked, with open areas or caves cut in it.
+The parameters are kept in the meta of the map (Map.meta), so a measurement can name what it ran on.
+
+    python -m scripts.stress maps/stress/my.bin --enemies 10 --coins 500 --open 2 --radius 30
+    python -m scripts.stress --preset crowd         writes maps/stress/crowd.bin
+    python -m scripts.stress --preset all
+
+The presets are fixed by their seeds, so the same preset is the same level on every machine.
+'''
+import argparse
+import json
+import os
+import numpy as np
+from scripts import levelgen
+from scripts import mapfile
+from scripts.grid import TileGrid
+from scripts.streaming import MARKER_RESOURCES
+from scripts.descent import WALL, SPAWN_VARIANTS
+
+STRESS_DIR = 'maps/stress'
+# the enemy markers are indices into the sorted names of EnemiesFactory.enemies, the same as the images of the resource
+ENEMY_TYPES = ('demon', 'dragon', 'jinn', 'lizard', 'medusa', 'small_dragon')
+DECOR_VARIANTS = (31, 33, 36, 66, 77, 113, 115) # game tiles drawn as off-grid decorations
+PRESETS = {
+    'crowd': dict(enemies=8, open_areas=1, radius=20, seed=1), # every enemy type on the first screen
+    'coins': dict(coins=2000, seed=2),
+    'decor': dict(decor=5000, seed=3),
+    'open': dict(size=(400, 200), kind='tunnels', open_areas=40, enemies=4, coins=300, decor=1000, seed=4),
+    'caves': dict(size=(1000, 1000), kind='caves', cave_areas=200, enemies=40, coins=3000, decor=3000, seed=5),
+}
+
+
+def _load_base(path):
+    '''
+    @ return level dict (ids, palette, x0, y0, start), nogrid_tiles, base_tile_size, tile_size
+    '''
+    if path.endswith('.bin'):
+        data = mapfile.load(path)
+        grid = TileGrid.from_arrays(np.array(data['ids']), data['palette'], data['x0'], data['y0'])
+    else:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        grid = TileGrid.from_tiles({tuple(map(int, k[1:-1].split(','))): v for k, v in data['tile_map'].items()}, None)
+    ts = data['tile_size']
+    start = (int(data['camera_x'] // ts) - grid.x0, int(data['camera_y'] // ts) - grid.y0)
+    level = {'ids': grid.ids, 'palette': grid.palette, 'x0': grid.x0, 'y0': grid.y0, 'start': start}
+    return level, list(data['nogrid_tiles']), data['base_tile_size'], ts
+
+
+def build(base='maps/map.json', size=None, kind='tunnels', seed=0, enemies=0, coins=0, decor=0,
+          open_areas=0, cave_areas=0, area=(24, 12), radius=None, clear=False, name=None):
+    '''
+    @ base - the map the level is made of, it is not used if size is given
+    @ size - (width, height) of a generated grid of the kind ('tunnels' or 'caves')
+    @ enemies - how many enemies of every type
+    @ coins, decor - how many coins and off-grid decorations
+    @ open_areas, cave_areas - how many empty rooms and caves of the area size (width, height) are cut in the level,
+    the first one is around the start
+    @ radius - everything is put within so many cells of the start, anywhere in the level if None
+    @ clear - the spawn markers of the base are removed
+    @ return level dict (see levelgen.generate), nogrid_tiles, base_tile_size, tile_size, meta
+    '''
+    params = dict(
+        base=None if size else base, size=list(size) if size else None, kind=kind if size else None, seed=seed,
+        enemies={enemy_name: enemies for enemy_name in ENEMY_TYPES}, coins=coins, decor=decor,
+        open_areas=open_areas, cave_areas=cave_areas, area=list(area), radius=radius, clear=clear
+    )
+    rng = np.random.default_rng(seed)
+    if size:
+        level = levelgen.generate(*size, seed=seed, kind=kind, enemies=0, coins=0)
+        level['x0'] = level['y0'] = 0
+        nogrid_tiles, base_tile_size, tile_size = [], 48, 72
+    else:
+        level, nogrid_tiles, base_tile_size, tile_size = _load_base(base)
+    grid = TileGrid.from_arrays(level['ids'], level['palette'], level['x0'], level['y0'])
+    ids = grid.ids
+    width, height = ids.shape
+    sx, sy = level['start']
+    def marker_lut():
+        return np.array([False] + [key[0] in MARKER_RESOURCES for key in grid.palette[1:]], dtype=bool)
+
+    if clear:
+        ids[marker_lut()[ids]] = 0
+        nogrid_tiles = [tile for tile in nogrid_tiles if tile['resource'] not in MARKER_RESOURCES]
+    # the window everything is put in
+    if radius is None:
+        i0, j0, i1, j1 = 0, 0, width, height
+    else:
+        i0, j0 = max(0, sx - radius), max(0, sy - radius)
+        i1, j1 = min(width, sx + radius + 1), min(height, sy + radius + 1)
+
+    wall = grid.tile_id(*WALL)
+    w, h = min(area[0], width - 2), min(area[1], height - 2)
+    for n in range(open_areas + cave_areas):
+        if n == 0:
+            x, y = sx - w // 2, sy - 2
+        else:
+            x, y = int(rng.integers(i0, max(i0 + 1, i1 - w))), int(rng.integers(j0, max(j0 + 1, j1 - h)))
+        x, y = int(np.clip(x, 1, width - w - 1)), int(np.clip(y, 1, height - h - 1))
+        if n < open_areas:
+            ids[x:x + w, y:y + h] = 0
+        else:
+            ids[x:x + w, y:y + h] = np.where(levelgen.caves(w, h, rng), wall, 0)
+        # a floor under it
+        ids[x:x + w, y + h] = wall
+    ids[sx, sy] = 0
+
+    solid = (ids != 0) & ~marker_lut()[ids]
+    fx, fy = levelgen.floors(solid)
+    inside = (fx >= i0) & (fx < i1) & (fy >= j0) & (fy < j1) & ((fx != sx) | (fy != sy))
+    fx, fy = fx[inside], fy[inside]
+    if len(fx) and enemies:
+        count = enemies * len(ENEMY_TYPES)
+        # on the same cells if there are not enough floors
+        cells = rng.choice(len(fx), size=count, replace=count > len(fx))
+        for n, cell in enumerate(cells.tolist()):
+            ids[fx[cell], fy[cell]] = grid.tile_id('entities', n % len(ENEMY_TYPES))
+    empty = ids[i0:i1, j0:j1] == 0
+    ex, ey = np.nonzero(empty)
+    if len(ex) and coins:
+        for cell in rng.choice(len(ex), size=min(coins, len(ex)), replace=False).tolist():
+            ids[i0 + ex[cell], j0 + ey[cell]] = grid.tile_id('coins', int(rng.integers(SPAWN_VARIANTS['coins'])))
+    # off-grid positions are in pixels of the base tile size
+    for _ in range(decor):
+        x = (level['x0'] + rng.uniform(i0, i1)) * base_tile_size
+        y = (level['y0'] + rng.uniform(j0, j1)) * base_tile_size
+        nogrid_tiles.append({'resource': 'tiles', 'variant': int(rng.choice(DECOR_VARIANTS)), 'pos': (float(x), float(y))})
+
+    level['ids'], level['palette'] = ids, grid.palette
+    meta = {'name': name, 'stress': params}
+    return level, nogrid_tiles, base_tile_size, tile_size, meta
+
+
+def write(path, **params):
+    '''
+    Builds the stress level (see build) and writes it as a binary (.bin) or a json map
+    '''
+    level, nogrid_tiles, base_tile_size, tile_size, meta = build(**params)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    levelgen.save(path, level, base_tile_size, tile_size, nogrid_tiles, meta)
+
+
+def write_preset(name, out_dir=STRESS_DIR):
+    path = os.path.join(out_dir, f'{name}.bin')
+    write(path, name=name, **PRESETS[name])
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Writes a stress level for benchmarks')
+    parser.add_argument('path', nargs='?', help='.bin or .json map')
+    parser.add_argument('--preset', choices=(*PRESETS, 'all'), help=f'a named level written to {STRESS_DIR}')
+    parser.add_argument('--base', default='maps/map.json')
+    parser.add_argument('--size', type=int, nargs=2, metavar=('WIDTH', 'HEIGHT'), help='a generated grid instead of the base')
+    parser.add_argument('--kind', choices=('tunnels', 'caves'), default='tunnels')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--enemies', type=int, default=0, help='enemies of every type')
+    parser.add_argument('--coins', type=int, default=0)
+    parser.add_argument('--decor', type=int, default=0, help='off-grid decorations')
+    parser.add_argument('--open', type=int, default=0, dest='open_areas', help='empty rooms')
+    parser.add_argument('--caves', type=int, default=0, dest='cave_areas')
+    parser.add_argument('--area', type=int, nargs=2, default=(24, 12), metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--radius', type=int)
+    parser.add_argument('--clear', action='store_true', help='remove the spawn markers of the base')
+    parser.add_argument('--name')
+    args = parser.parse_args()
+    if args.preset:
+        for name in PRESETS if args.preset == 'all' else (args.preset,):
+            print(write_preset(name))
+    elif args.path:
+        params = vars(args)
+        del params['preset']
+        write(params.pop('path'), **params)
+    else:
+        parser.error('a path or a preset is needed')
@@ -1,5 +1,101 @@
 import pygame
 import os
+from scripts import consts, assets
+from scripts.atlas import Atlas
+from scripts.framecache import FrameCache, source_key, on_main_thread, from_pixels
+from scripts.preload import Preloader
+
+_atlas = None
+_frame_cache = None
+_preloader = None
+
+
+def atlas():
+    '''
+    @ return the Atlas with pages of consts.ATLAS_PAGE_SIZE, None if it is off
+    '''
+    global _atlas
+    if _atlas is None and consts.ATLAS_PAGE_SIZE:
+        _atlas = Atlas(consts.ATLAS_PAGE_SIZE)
+    return _atlas
+
+
+def pack(frames):
+    '''
+    @ return the frames in the atlas if it is on and can be written, else the frames
+    '''
+    if atlas() is None or not atlas().writable():
+        return frames
+    return atlas().pack(frames)
+
+
+def build_frames(frames):
+    '''
+    @ frames - [pixels,] (see framecache.to_pixels) made off the main thread
+    @ return [surface,] in the format of the screen, in the atlas if it is on. On the main thread only
+    '''
+    build = atlas().from_pixels if atlas() else from_pixels
+    return [build(*pixels) for pixels in frames]
+
+
+def frame_cache():
+    '''
+    @ return the FrameCache of consts.FRAME_CACHE, None if it is off
+    '''
+    global _frame_cache
+    if _frame_cache is None and consts.FRAME_CACHE:
+        _frame_cache = FrameCache(consts.FRAME_CACHE, atlas())
+    return _frame_cache
+
+
+def cached(kind, paths, params, make):
+    '''
+    @ kind, paths, params - what the frames are made of (see framecache.source_key)
+    @ make - function () -> [surface,], it is not called if the frames are in the cache
+    @ return [surface,]
+    '''
+    cache = frame_cache()
+    if cache is None:
+        return pack(make())
+    return cache.load(source_key(kind, paths, *params), make)
+
+
+def preloader():
+    '''
+    @ return the Preloader of consts.PRELOAD_MANIFEST, None if it is off
+    '''
+    global _preloader
+    if _preloader is None and consts.PRELOAD_MANIFEST:
+        _preloader = Preloader(consts.PRELOAD_MANIFEST)
+    return _preloader
+
+
+def _cold():
+    cache = frame_cache()
+    return cache is None or not cache.index
+
+
+def preload(workers=None):
+    '''
+    Decodes the images of the last cold launch on a thread pool if the frame cache is cold too,
+    load_image takes them from there
+    @ return the Preloader if it decoded anything, else None
+    '''
+    if preloader() is None or not _cold() or not preloader().jobs: return None
+    preloader().run(_decode_image, workers)
+    return preloader()
+
+
+def save_frame_cache(manifest=True):
+    '''
+    Saves the frame cache and the jobs of the preloader, only a cold launch knows all the jobs
+    @ manifest - the jobs are saved too, only the ones of the start are worth decoding ahead
+    '''
+    if manifest and preloader() is not None and _cold():
+        preloader().save()
+    if frame_cache() is not None:
+        frame_cache().save()
+
 
 def resize_frames(animations: dict, colorkey: tuple[int]=None, exceptions=['attack_1', 'attack_2', 'attack_3']):
     width = animations[max(animations, key=lambda x: animations[x]._max_width if x not in exceptions else 0)]._max_width
@@ -16,7 +112,23 @@ def resize_frames(animations: dict, colorkey: tuple[int]=None, exceptions=['atta
                 frame.set_colorkey(colorkey)
 
 def load_image(path, scale, colorkey=None, size=None, bounding=False):
-    image = pygame.image.load(path).convert_alpha()
+    return cached('image', [path], (scale, size, colorkey, bounding), lambda: [_load_image(path, scale, colorkey, size, bounding)])[0]
+
+
+def _load_image(path, scale, colorkey=None, size=None, bounding=False):
+    image = preloader().take((path, scale, colorkey, size, bounding)) if preloader() else None
+    if image is None:
+        image = _decode_image(path, scale, colorkey, size, bounding)
+    return image
+
+
+def _decode_image(path, scale, colorkey=None, size=None, bounding=False):
+    image = pygame.image.load(path)
+    if on_main_thread():
+        image = image.convert_alpha()
+    else:
+        # the same pixels with alpha, the format of the screen is left to the main thread
+        image = pygame.image.frombytes(pygame.image.tobytes(image, 'RGBA'), image.get_size(), 'RGBA')
     if size is not None:
         image = pygame.transform.scale(image, size)
     else:
@@ -54,24 +166,55 @@ def crop_images(sheet, num_sprites, colorkey=None, bounding=True):
         images.append(img)
     return images
 
+
+def load_sheet(path, scale, num_sprites, colorkey=None, bounding=True):
+    '''
+    Loads the sprite sheet and crops it in frames (see crop_images)
+    '''
+    return cached('sheet', [path], (scale, num_sprites, colorkey, bounding), lambda: crop_images(_load_image(path, scale), num_sprites, colorkey, bounding))
+
+
+def flip_frames(frames, colorkey=None):
+    '''
+    @ return the frames flipped horizontally. They are not cached: animation.FlippedFrames keeps them in its budget,
+    out of the atlas, a page would keep the dropped ones
+    '''
+    flipped = []
+    for frame in frames:
+        frame = pygame.transform.flip(frame, True, False)
+        if colorkey:
+            frame.set_colorkey(colorkey)
+        flipped.append(frame)
+    return flipped
+
 def load_images(directory, scale, colorkey=None, size=None, bounding=True):
-    images = []
-    for filename in sorted(os.listdir(directory)):
-        if filename.endswith('.png') or filename.endswith('.jpg'):
-            path = os.path.join(directory, filename)
-            image = load_image(path, scale, colorkey, size=size, bounding=bounding)
-            images.append(image)
-    return images
+    return [load_image(path, scale, colorkey, size=size, bounding=bounding) for path in image_paths(directory)]
+
+
+def image_paths(directory):
+    '''
+    @ return paths of the images of the directory in the order of load_images
+    '''
+    return [os.path.join(directory, filename) for filename in sorted(os.listdir(directory)) if filename.endswith('.png') or filename.endswith('.jpg')]
 
 
 def resize_resources(resourcesdir_path, scale, colorkey=None):
         resources = {}
         for dirname in os.listdir(os.path.join(resourcesdir_path)):
             path = os.path.join(resourcesdir_path, dirname)
-            resources[dirname] = load_images(path, scale, colorkey)
+            # shared by the maps of the same scale, the key is the one of ListOfFilesAnimation
+            resources[dirname] = assets.acquire('images', image_paths(path), (scale, colorkey, None, True), lambda: load_images(path, scale, colorkey))
         return resources
 
 
+def release_resources(resourcesdir_path, scale, colorkey=None):
+    '''
+    Gives the images of load_resources back to the asset registry
+    '''
+    for dirname in os.listdir(resourcesdir_path):
+        assets.release('images', image_paths(os.path.join(resourcesdir_path, dirname)), (scale, colorkey, None, True))
+
+
 def load_resources(resourcesdir_path, scale, colorkey=None):
     '''
     resourcesdir_path: str - path to the resources directory
@@ -104,7 +247,16 @@ def join_images(dirpath, pattern, scale, size=None, colorkey=None):
     dirpath - directory path
     patter - pattern in names of the files to be joined 
     '''
-    images = [load_image(os.path.join(dirpath, filename), 1, colorkey=False, bounding=True) for filename in sorted(os.listdir(dirpath)) if filename.startswith(pattern)]
+    paths = joined_paths(dirpath, pattern)
+    return cached('join', paths, (scale, size, colorkey), lambda: _join_images(paths, scale, size, colorkey))
+
+
+def joined_paths(dirpath, pattern):
+    return [os.path.join(dirpath, filename) for filename in sorted(os.listdir(dirpath)) if filename.startswith(pattern)]
+
+
+def _join_images(paths, scale, size=None, colorkey=None):
+    images = [_load_image(path, 1, colorkey=False, bounding=True) for path in paths]
     result = []
     for image in images:
         w = image.get_width() * scale